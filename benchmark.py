@@ -0,0 +1,486 @@
+############### IMPORT MODULES ###############
+
+import sys,os,argparse,json,tempfile,shutil,random,time,resource,platform,heapq,io,contextlib,threading
+from itertools import islice
+import samreader
+
+############### SYNTHETIC SAM FILES ###############
+#a generated file only depends on its settings and on the seed: the same command always writes the same bytes,
+#so timings measured on two versions of samreader.py (or two machines) are comparable
+
+#type of CIGAR: relative weight, used by --cigar-mix ex. "match=0.8,clip=0.1,indel=0.1"
+CIGAR_MIX = {"match": 0.85, "clip": 0.05, "indel": 0.07, "splice": 0.03}
+
+BASES = "ACGT"
+SEQ_POOL_SIZE = 1 << 16 #random bases and qualities sliced for each read instead of drawing every base
+
+
+def parseMix(text):
+    '''"match=0.8,clip=0.2" -> {"match": 0.8, "clip": 0.2}, unknown types of CIGAR raise ValueError'''
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in CIGAR_MIX:
+            raise ValueError(f"unknown type of CIGAR \"{name}\", choose among {', '.join(CIGAR_MIX)}.")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def randomCigar(rng, kind, length):
+    '''CIGAR string of a read of length bases, and the length it covers on the reference'''
+    if kind == "clip":
+        clip = rng.randint(1, max(1, length // 5))
+        if rng.random() < 0.5:
+            return f"{clip}S{length - clip}M", length - clip
+        return f"{length - clip}M{clip}S", length - clip
+    if kind == "indel":
+        left = rng.randint(1, length - 2)
+        size = rng.randint(1, 5)
+        if rng.random() < 0.5: #insertion, consumes the read only
+            size = min(size, length - left - 1)
+            return f"{left}M{size}I{length - left - size}M", length - size
+        return f"{left}M{size}D{length - left}M", length + size
+    if kind == "splice":
+        left = rng.randint(1, length - 1)
+        intron = rng.randint(100, 5000)
+        return f"{left}M{intron}N{length - left}M", length + intron
+    return f"{length}M", length
+
+
+class SamGenerator:
+    '''deterministic writer of synthetic SAM files (pairs, long reads, CIGAR mix, unmapped reads, coordinate sorted or not)'''
+
+    def __init__(self, nb_reads, chromosomes, read_length=150, long_fraction=0.0, long_length=10000, paired_fraction=0.9,
+                 unmapped_fraction=0.02, cigar_mix=None, insert_size=400, sort="unsorted", seed=1):
+        self.nb_reads = nb_reads
+        self.chromosomes = chromosomes #[(name, length)...]
+        self.read_length = read_length
+        self.long_fraction = long_fraction
+        self.long_length = long_length
+        self.paired_fraction = paired_fraction
+        self.unmapped_fraction = unmapped_fraction
+        self.cigar_kinds, self.cigar_weights = zip(*(cigar_mix or CIGAR_MIX).items())
+        self.insert_size = insert_size
+        self.sort = sort
+        self.rng = random.Random(seed)
+        self.seq_pool = "".join(self.rng.choice(BASES) for _ in range(SEQ_POOL_SIZE))
+        self.qual_pool = "".join(chr(33 + self.rng.choice((2, 11, 20, 30, 35, 37, 40, 40, 40))) for _ in range(SEQ_POOL_SIZE))
+
+    def header(self):
+        lines = [f"@HD\tVN:1.6\tSO:{self.sort}"]
+        lines += [f"@SQ\tSN:{name}\tLN:{length}" for name, length in self.chromosomes]
+        lines.append("@PG\tID:benchmark\tPN:benchmark.py")
+        return "\n".join(lines) + "\n"
+
+    def sequence(self, length):
+        '''random SEQ and QUAL of length bases sliced from the pools (long reads are repeated pools)'''
+        start = self.rng.randrange(SEQ_POOL_SIZE)
+        seq = (self.seq_pool * (length // SEQ_POOL_SIZE + 2))[start:start + length]
+        qual = (self.qual_pool * (length // SEQ_POOL_SIZE + 2))[start:start + length]
+        return seq, qual
+
+    def readLength(self):
+        if self.rng.random() < self.long_fraction:
+            return max(100, int(self.rng.gauss(self.long_length, self.long_length / 4))), True
+        return self.read_length, False
+
+    def line(self, qname, flag, chrom, pos, mapq, cigar, rnext, pnext, tlen, length):
+        seq, qual = self.sequence(length)
+        return f"{qname}\t{flag}\t{chrom}\t{pos}\t{mapq}\t{cigar}\t{rnext}\t{pnext}\t{tlen}\t{seq}\t{qual}\tNM:i:0\n"
+
+    def templates(self, chrom, length, positions):
+        '''alignment lines of the reads starting at the given positions of one chromosome, as (position, line, first read of its template)'''
+        last_pos = 1
+        for index, pos in positions:
+            qname = f"read{index}"
+            read_length, long_read = self.readLength()
+            kind = self.rng.choices(self.cigar_kinds, self.cigar_weights)[0]
+            cigar, ref_length = randomCigar(self.rng, kind, read_length)
+            pos = min(pos, max(1, length - ref_length))
+            if self.sort == "coordinate": #increasing positions even when the end of the chromosome moved the read back (it overhangs)
+                pos = last_pos = max(pos, last_pos)
+            mapq = self.rng.choice((0, 3, 20, 40, 60, 60, 60))
+
+            if long_read or self.rng.random() >= self.paired_fraction: #single end
+                flag = 16 if self.rng.random() < 0.5 else 0
+                yield pos, self.line(qname, flag, chrom, pos, mapq, cigar, "*", 0, 0, read_length), True
+                continue
+
+            #pair on the same chromosome, FR most of the time
+            mate_pos = max(pos, min(pos + self.rng.randint(0, self.insert_size), length - self.read_length))
+            mate_cigar, mate_ref_length = randomCigar(self.rng, self.rng.choices(self.cigar_kinds, self.cigar_weights)[0], self.read_length)
+            mate_mapq = self.rng.choice((0, 3, 20, 40, 60, 60, 60))
+            proper = 2 if self.rng.random() < 0.9 else 0
+            reverse, mate_reverse = (0, 16) if self.rng.random() < 0.85 else (16, 16)
+            tlen = mate_pos + mate_ref_length - pos
+            yield pos, self.line(qname, 1 + proper + 64 + reverse + 2 * mate_reverse, chrom, pos, mapq, cigar, "=", mate_pos, tlen, read_length), True
+            yield mate_pos, self.line(qname, 1 + proper + 128 + mate_reverse + 2 * reverse, chrom, mate_pos, mate_mapq, mate_cigar, "=", pos, -tlen, self.read_length), False
+
+    def unmapped(self, index):
+        seq, qual = self.sequence(self.read_length)
+        return f"read{index}\t4\t*\t0\t0\t*\t*\t0\t0\t{seq}\t{qual}\n"
+
+    def lines(self):
+        '''alignment lines of the file, about nb_reads of them'''
+        nb_unmapped = int(self.nb_reads * self.unmapped_fraction)
+        #a pair writes 2 lines: templates per chromosome so that the file has about nb_reads lines
+        per_template = 2 * (1 - self.long_fraction) * self.paired_fraction + (1 - (1 - self.long_fraction) * self.paired_fraction)
+        nb_templates = int((self.nb_reads - nb_unmapped) / per_template)
+        total_length = sum(length for _, length in self.chromosomes)
+        index = 0
+
+        if self.sort == "coordinate":
+            #positions drawn in increasing order per chromosome, mates wait in a heap until the first reads of the templates are past them
+            for chrom, length in self.chromosomes:
+                nb = round(nb_templates * length / total_length)
+                positions = self.increasingPositions(length, nb, index)
+                index += nb
+                pending = []
+                for order, (pos, line, first) in enumerate(self.templates(chrom, length, positions)):
+                    while first and pending and pending[0][0] <= pos:
+                        yield heapq.heappop(pending)[2]
+                    heapq.heappush(pending, (pos, order, line))
+                while pending:
+                    yield heapq.heappop(pending)[2]
+        else:
+            lengths = [length for _, length in self.chromosomes]
+            for index in range(nb_templates):
+                chrom, length = self.rng.choices(self.chromosomes, lengths)[0]
+                for pos, line, first in self.templates(chrom, length, [(index, self.rng.randint(1, length))]):
+                    yield line
+            index = nb_templates
+
+        for i in range(nb_unmapped):
+            yield self.unmapped(index + i)
+
+    def increasingPositions(self, length, nb, first_index):
+        '''nb sorted uniform positions in [1, length] drawn one after the other (exponential gaps), with the index of their read'''
+        pos = 1.0
+        for i in range(nb):
+            pos += self.rng.expovariate((nb - i + 1) / max(1.0, length - pos))
+            yield first_index + i, min(length, int(pos))
+
+    def write(self, path):
+        with open(path, "w") as file:
+            file.write(self.header())
+            batch = []
+            for line in self.lines():
+                batch.append(line)
+                if len(batch) >= 10000:
+                    file.writelines(batch)
+                    batch = []
+            file.writelines(batch)
+        return path
+
+
+def chromosomeList(nb_chromosomes, chromosome_length, lengths=None):
+    '''[(name, length)...] from a list of lengths "1000000,500000" or nb_chromosomes of the same length'''
+    if lengths:
+        return [(f"chr{i + 1}", int(length)) for i, length in enumerate(lengths.split(","))]
+    return [(f"chr{i + 1}", chromosome_length) for i in range(nb_chromosomes)]
+
+
+############### STAGES ###############
+#each stage of samreader.py is timed on its own: the reads are parsed once more by the stages that need them,
+#the time of the parsing is measured by the "read" stage and removed from the others
+
+STAT_BATCH = 100000 #reads parsed in advance and given to the accumulators, the accumulators are timed on these batches only
+
+
+def currentRSS():
+    '''resident memory of the process now, in MB (from /proc/self/statm, the peak since the start of the process where there is no /proc)'''
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024 #bytes on macOS, KB on Linux
+
+
+class PeakRSS:
+    '''highest resident memory of the process while the block runs, sampled by a thread every interval seconds, in MB'''
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0.0
+        self.done = threading.Event()
+
+    def _sample(self):
+        while not self.done.wait(self.interval):
+            self.peak = max(self.peak, currentRSS())
+
+    def __enter__(self):
+        self.peak = currentRSS()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.done.set()
+        self.thread.join()
+        self.peak = max(self.peak, currentRSS())
+
+
+class StageTimer:
+    '''time, reads per second and memory of each stage {stage: {...}}
+    the memory is measured for each stage: the highest resident memory while it runs, and what it left allocated at its end
+    (the high-water mark of the process would only show the largest stage so far)'''
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, seconds, nb_reads=None, rss_delta=0.0, rss_peak=None):
+        rss = currentRSS()
+        stage = {"seconds": round(seconds, 4), "rss_peak_mb": round(max(rss, rss_peak or 0), 1), "rss_delta_mb": round(rss_delta, 1)}
+        if nb_reads:
+            stage["reads"] = nb_reads
+            stage["reads_per_s"] = round(nb_reads / seconds) if seconds > 0 else None
+        self.stages[name] = stage
+        rate = f"{stage['reads_per_s']:>12,} reads/s" if stage.get("reads_per_s") else " " * 20
+        print(f"{name:<18}{seconds:>10.3f} s {rate}{stage['rss_peak_mb']:>10.1f} MB{stage['rss_delta_mb']:>+10.1f} MB", flush=True)
+
+    def run(self, name, function, *args, nb_reads=None):
+        with PeakRSS() as memory:
+            before = memory.peak
+            start = time.perf_counter()
+            result = function(*args)
+            seconds = time.perf_counter() - start
+        self.add(name, seconds, nb_reads, currentRSS() - before, memory.peak)
+        return result
+
+
+def accumulatorStages(input_file, header_parsed, settings, timer):
+    '''feed the reads to each accumulator of SamStats separately and time them, return the filled SamStats and the number of reads'''
+    stats = samreader.SamStats(header_parsed, settings["window_size"], settings["mapq_threshold"], settings["short_size"], settings["long_size"],
+                               sort_order=samreader.sort_order(input_file))
+    names = {"pairs": stats.pairs, "chromosomes": stats.chrom, "mapq": stats.mapq, "alignment": stats.alignment, "indel": stats.indel, "windows": stats.windows}
+    seconds = dict.fromkeys(names, 0.0)
+    growth = dict.fromkeys(names, 0.0) #resident memory added by each accumulator over the batches
+
+    reads = samreader.iter_reads(input_file, settings["filter_mapq"], settings["fully_mapped"], validation=samreader.Validation("off"))
+    nb_reads = 0
+    while True:
+        batch = list(islice(reads, STAT_BATCH))
+        if not batch:
+            break
+        nb_reads += len(batch)
+        for name, accumulator in names.items():
+            before = currentRSS()
+            start = time.perf_counter()
+            samreader.accumulate(batch, accumulator)
+            seconds[name] += time.perf_counter() - start
+            growth[name] += currentRSS() - before
+
+    for name in names:
+        timer.add(f"stat:{name}" if name != "windows" else "windowing", seconds[name], nb_reads, growth[name])
+    return stats, nb_reads
+
+
+def countReads(input_file, settings):
+    reads = samreader.iter_reads(input_file, settings["filter_mapq"], settings["fully_mapped"], validation=samreader.Validation("off"))
+    return sum(1 for _ in reads)
+
+
+def referenceReads(input_file, settings):
+    '''the reading loop of samreader.py before the parsing was batched (text lines, a tuple per read), the reference of the read stage'''
+    reads_extract = {}
+    with open(input_file, "r") as file:
+        for line in file:
+            if line.startswith("@"):
+                continue
+            columns = line.strip().split("\t")
+            flag, mapq, cigar = int(columns[1]), int(columns[4]), columns[5]
+            if settings["fully_mapped"] and not samreader.isFullyMapped(flag, cigar):
+                continue
+            if settings["filter_mapq"] is not None and mapq < settings["filter_mapq"]:
+                continue
+            reads_extract.setdefault(columns[2], []).append((columns[0], flag, int(columns[3]), mapq, cigar))
+    return sum(len(reads) for reads in reads_extract.values())
+
+
+def validateLines(input_file):
+    '''check every line of the file against the SAM format, return the number of lines'''
+    validation = samreader.Validation("full")
+    nb_lines = 0
+    for line_index, line in enumerate(samreader.read_lines(input_file), start=1):
+        validation.check(line.decode(), line_index)
+        nb_lines += 1
+    return nb_lines
+
+
+def results(stats):
+    '''the windows and the summary values computed at the end of the analysis'''
+    return (stats.windows.coverage(), stats.windows.meanMAPQ(), stats.pairs.result(), stats.chrom.result(), stats.mapq.result(),
+            stats.alignment.result(), stats.indel.result())
+
+
+def quiet(function):
+    '''same function without the messages printed by samreader.py (saved files...)'''
+    def run(*args):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return function(*args)
+    return run
+
+
+def runStages(input_file, settings, plots=True):
+    '''time every stage of the analysis of input_file, return {stage: {seconds, reads, reads_per_s, rss_peak_mb, rss_delta_mb}}'''
+    timer = StageTimer()
+    header_parsed = timer.run("header", samreader.parse_header, input_file)
+    nb_reads = timer.run("read", countReads, input_file, settings)
+    timer.stages["read"].update({"reads": nb_reads, "reads_per_s": round(nb_reads / timer.stages["read"]["seconds"]) if nb_reads else None})
+    if samreader.fileFormat(input_file) == "sam": #the reference loop only reads plain text
+        nb_reference = timer.run("read:reference", referenceReads, input_file, settings)
+        timer.stages["read:reference"].update({"reads": nb_reference, "reads_per_s": round(nb_reference / timer.stages["read:reference"]["seconds"]) if nb_reference else None})
+    if settings["validate"]:
+        nb_lines = timer.run("validation", validateLines, input_file)
+        timer.stages["validation"].update({"reads": nb_lines, "reads_per_s": round(nb_lines / timer.stages["validation"]["seconds"])})
+
+    stats, nb_reads = accumulatorStages(input_file, header_parsed, settings, timer)
+    reads_window, mapq_window, paired_orientation, count_chrom, count_mapq, stat_alignment, stat_indel = timer.run("results", results, stats)
+
+    dir_name = tempfile.mkdtemp(prefix="samreader_benchmark_")
+    try:
+        timer.run("summary", quiet(samreader.Summary), os.path.basename(input_file), dir_name, paired_orientation, count_chrom, count_mapq, stat_alignment,
+                  settings["short_size"], settings["long_size"], settings["mapq_threshold"], stat_indel)
+        if plots:
+            timer.run("plot", quiet(samreader.plotReadsPerWindow), reads_window, mapq_window, settings["window_size"], dir_name)
+    finally:
+        shutil.rmtree(dir_name, ignore_errors=True)
+
+    return timer.stages
+
+
+############### BASELINE ###############
+#a baseline is the JSON report of a previous run, the stages slower than the baseline by more than --tolerance are regressions
+
+def environment():
+    return {"python": platform.python_version(), "machine": platform.machine(), "system": platform.system(), "cpus": os.cpu_count()}
+
+
+def compareBaseline(report, baseline, tolerance):
+    '''print the time of each stage against the baseline, return the list of the stages slower than (1 + tolerance) times the baseline'''
+    if baseline.get("generator") != report.get("generator"):
+        print("Warning: the baseline was measured on another synthetic file, the timings are not comparable.")
+    if baseline.get("environment") != report.get("environment"):
+        print("Warning: the baseline was measured on another machine or Python version.")
+
+    regressions = []
+    print(f"\n{'stage':<18}{'baseline':>10}{'now':>10}{'ratio':>8}")
+    for name, stage in report["stages"].items():
+        if name not in baseline["stages"]:
+            continue
+        before, now = baseline["stages"][name]["seconds"], stage["seconds"]
+        ratio = now / before if before > 0 else float("inf")
+        slower = ratio > 1 + tolerance and now - before > 0.01 #very short stages only vary with the noise of the machine
+        print(f"{name:<18}{before:>10.3f}{now:>10.3f}{ratio:>8.2f}{'  REGRESSION' if slower else ''}")
+        if slower:
+            regressions.append(name)
+    return regressions
+
+
+############### MAIN ###############
+
+def generatorSettings(args):
+    return {"reads": args.reads, "chromosomes": chromosomeList(args.chromosomes, args.chromosome_length, args.lengths),
+            "read_length": args.read_length, "long_fraction": args.long_fraction, "long_length": args.long_length,
+            "paired_fraction": args.paired_fraction, "unmapped_fraction": args.unmapped_fraction,
+            "cigar_mix": parseMix(args.cigar_mix) if args.cigar_mix else CIGAR_MIX, "sort": args.sort, "seed": args.seed}
+
+
+def generate(path, settings):
+    '''write the synthetic SAM file described by generatorSettings'''
+    return SamGenerator(settings["reads"], settings["chromosomes"], settings["read_length"], settings["long_fraction"], settings["long_length"],
+                        settings["paired_fraction"], settings["unmapped_fraction"], settings["cigar_mix"], sort=settings["sort"], seed=settings["seed"]).write(path)
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description="Generate synthetic SAM files and time each stage of samreader.py on them.",
+                                     epilog="python3 benchmark.py generate out.sam --reads 1000000 writes the file only.")
+    parser.add_argument("input_file", nargs="?", help="SAM/BAM file to time (default: a synthetic file generated with the options below)")
+    generator = parser.add_argument_group("synthetic file")
+    generator.add_argument("--reads", type=int, default=1000000, help="number of alignment lines (default: 1000000)")
+    generator.add_argument("--chromosomes", type=int, default=3, help="number of chromosomes (default: 3)")
+    generator.add_argument("--chromosome-length", type=int, default=10000000, help="length of each chromosome (default: 10000000)")
+    generator.add_argument("--lengths", help="comma separated lengths of the chromosomes, replaces --chromosomes and --chromosome-length")
+    generator.add_argument("--read-length", type=int, default=150, help="length of the short reads (default: 150)")
+    generator.add_argument("--long-fraction", type=float, default=0.0, help="fraction of long single-end reads (default: 0)")
+    generator.add_argument("--long-length", type=int, default=10000, help="mean length of the long reads (default: 10000)")
+    generator.add_argument("--paired-fraction", type=float, default=0.9, help="fraction of short reads written as pairs (default: 0.9)")
+    generator.add_argument("--unmapped-fraction", type=float, default=0.02, help="fraction of unmapped reads (default: 0.02)")
+    generator.add_argument("--cigar-mix", help=f"weights of the types of CIGAR, ex. \"match=0.8,clip=0.1,indel=0.1\" (types: {', '.join(CIGAR_MIX)})")
+    generator.add_argument("--sort", choices=("unsorted", "coordinate"), default="unsorted", help="order of the reads (default: unsorted, mates are adjacent)")
+    generator.add_argument("--seed", type=int, default=1, help="random seed, the same seed always gives the same file (default: 1)")
+    generator.add_argument("--keep", help="save the synthetic file at this path instead of a temporary file")
+    timing = parser.add_argument_group("timing")
+    timing.add_argument("--window-size", type=int, default=10000, help="window size of the coverage (default: 10000)")
+    timing.add_argument("--mapq", type=int, default=None, help="minimum MAPQ of the reads kept (default: all)")
+    timing.add_argument("--mapq-threshold", type=int, default=30, help="MAPQ threshold of the summary (default: 30)")
+    timing.add_argument("--fully-mapped", action="store_true", help="keep only fully mapped reads")
+    timing.add_argument("--no-validation", action="store_true", help="skip the validation stage")
+    timing.add_argument("--no-plot", action="store_true", help="skip the plot stage")
+    timing.add_argument("--report", help="save the timings of this run in a JSON file")
+    timing.add_argument("--baseline", help="JSON report of a previous run to compare with")
+    timing.add_argument("--tolerance", type=float, default=0.2, help="slowdown against the baseline reported as a regression (default: 0.2 = 20%%)")
+    return parser
+
+
+def main():
+    argv = sys.argv[1:]
+    generate_only = argv[:1] == ["generate"]
+    if generate_only:
+        argv = argv[1:]
+    args = parseArguments().parse_args(argv)
+
+    try:
+        generator_settings = generatorSettings(args)
+    except ValueError as error:
+        sys.exit(f"Error: {error}")
+
+    if generate_only:
+        if not args.input_file:
+            sys.exit("Error: give the path of the file to generate, ex. python3 benchmark.py generate out.sam")
+        start = time.perf_counter()
+        generate(args.input_file, generator_settings)
+        print(f"\"{args.input_file}\" written in {time.perf_counter() - start:.1f} s.")
+        return
+
+    temp_dir = None
+    input_file = args.input_file
+    if input_file is None:
+        if args.keep:
+            input_file = args.keep
+        else:
+            temp_dir = tempfile.mkdtemp(prefix="samreader_benchmark_")
+            input_file = os.path.join(temp_dir, "synthetic.sam")
+        start = time.perf_counter()
+        generate(input_file, generator_settings)
+        print(f"Synthetic file of {args.reads} reads written in {time.perf_counter() - start:.1f} s ({os.path.getsize(input_file) / (1 << 20):.1f} MB).\n")
+
+    settings = {"window_size": args.window_size, "filter_mapq": args.mapq, "fully_mapped": args.fully_mapped, "mapq_threshold": args.mapq_threshold,
+                "short_size": args.read_length // 2, "long_size": 2 * args.read_length, "validate": not args.no_validation}
+    try:
+        print(f"{'stage':<18}{'time':>12}{'':>20}{'peak RSS':>13}{'left':>13}")
+        stages = runStages(input_file, settings, plots=not args.no_plot)
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    report = {"environment": environment(), "settings": settings, "stages": stages,
+              "generator": None if args.input_file else {**generator_settings, "chromosomes": [list(chrom) for chrom in generator_settings["chromosomes"]]},
+              "input_file": args.input_file, "size": None if temp_dir else os.path.getsize(input_file)}
+    if args.report:
+        with open(args.report, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"\nTimings saved in \"{args.report}\".")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compareBaseline(report, baseline, args.tolerance)
+        if regressions:
+            sys.exit(f"\n{len(regressions)} stages are slower than the baseline: {', '.join(regressions)}.")
+        print("\nNo regression against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,400 +1,3016 @@
 ############### IMPORT MODULES ###############
 
-import sys,os,re, matplotlib.pyplot as plt, matplotlib.cm as cm, matplotlib.colors as colors
+import sys,os,re,argparse,json,tempfile,shutil,atexit,heapq,itertools,zlib,random,gzip,struct,io,mmap,hashlib,time,resource,contextlib,multiprocessing,pickle,math,queue,threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from array import array
+from collections import namedtuple, deque
+from functools import lru_cache
+import numpy as np
 
 ############### TOOL FUNCTIONS ###############
 
+#CIGAR operation: length and type, ex. "100M5S" -> [('100','M'), ('5','S')]
+CIGAR_OPS = re.compile(r"(\d+)([MIDNSHPX=])")
+
+#everything the statistics need from a CIGAR string
+CigarInfo = namedtuple("CigarInfo", ["ref_length", "query_length", "indel", "clipping", "fully_mapped"])
+
+CIGAR_CACHE_SIZE = 4096 #short reads have very few distinct CIGAR (mostly 100M), long reads barely repeat them
+
+
+def cigarInfo(ops):
+    '''CigarInfo of a list of CIGAR operations [(length, type)...]'''
+    ref_length, query_length, indel, clipping = 0, 0, 0, 0
+
+    for nb, op in ops: # for each pair number-operation
+        if op in ("M", "=", "X"): # consume reference and query
+            ref_length += nb
+            query_length += nb
+        elif op == "I":
+            query_length += nb
+            indel += nb
+        elif op == "D":
+            ref_length += nb
+            indel += nb
+        elif op == "N":
+            ref_length += nb
+        elif op == "S":
+            query_length += nb
+            clipping += nb
+        elif op == "H":
+            clipping += nb
+
+    fully_mapped = len(ops) == 1 and ops[0][1] == "M" #in any other case read is partially mapped
+
+    return CigarInfo(ref_length, query_length, indel, clipping, fully_mapped)
+
+
+@lru_cache(maxsize=CIGAR_CACHE_SIZE)
+def decodeCigar(cigar):
+    '''decode a CIGAR string in a single scan, results are cached (see decodeCigar.cache_info() for hits and misses)'''
+
+    if isinstance(cigar, CigarInfo): #BAM records come with their CIGAR already decoded
+        return cigar
+
+    if cigar == "*" or cigar == None: #unmapped
+        return CigarInfo(0, 0, 0, 0, False)
+
+    return cigarInfo([(int(nb), op) for nb, op in CIGAR_OPS.findall(cigar)])
+
+
+#BAM CIGAR operation types, indexed by the 4 lower bits of each packed operation
+BAM_CIGAR_OPS = "MIDNSHP=X"
+
+
+@lru_cache(maxsize=CIGAR_CACHE_SIZE)
+def decodeBamCigar(ops):
+    '''decode a binary CIGAR of a BAM record (packed uint32: length << 4 | type) without building its string, results are cached'''
+    return cigarInfo([(value >> 4, BAM_CIGAR_OPS[value & 0xF]) for value in struct.unpack(f"<{len(ops) // 4}I", ops)])
+
+
 def isFullyMapped(flag, cigar):
     '''determine if a read is mapped based on flag and cigar'''
     
     #case unmapped
-    if flag & 4 == 1: #unmapped
+    if flag & 4: #unmapped
         return False
-    
-    if cigar == "*" or cigar == None: #unmapped
-        return False 
-    
-    ops = re.findall(r"[MIDNSHPX=]", cigar) #extract operations from CIGAR string
 
-    #case mapped
-    if ops == ['M']:
-        return True
-    
-    return False #in any other case read is partially mapped
+    return decodeCigar(cigar).fully_mapped
 
 
 def lengthRefCigar(cigar): 
     '''calculate the length consumed on the reference sequence based on CIGAR'''
-   
-    ext = re.findall(r"(\d+)([MIDNSHPX=])",cigar) # split cigar on alpha numeric and numeric, ex. ext = ['100','M','5','S']
-    length = 0
-
-    for nb, op in ext: # for each pair number-operation
+    return decodeCigar(cigar).ref_length
 
-        if op in ("M", "D", "N", "X", "="): # these operations consume reference
-            length += int(nb)
-
-    return length
 
 def nbIndel(cigar):
     '''calculate the number of indel in read based on CIGAR'''
+    return decodeCigar(cigar).indel
 
-    ext = re.findall(r"(\d+)([MIDNSHPX=])",cigar) # split cigar on alpha numeric and numeric, ex. ext = ['100','M','5','S']
-    indel_count = 0
+############### SAM FILE CHECK FUNCTION ###############
 
-    for nb, op in ext:
+#regular expressions of the mandatory fields, compiled once
+QNAME_RE = re.compile(r'[!-?A-~]{1,254}')
+RNAME_RE = re.compile(r'\*|[0-9A-Za-z!#$%&+./:;?@^_|~-][0-9A-Za-z!#$%&*+./:;=?@^_|~-]*')
+CIGAR_RE = re.compile(r'\*|(?:[0-9]+[MIDNSHPX=])+')
+RNEXT_RE = re.compile(r'(?:\*|=|[0-9A-Za-z!#$%&+./:;?@^_|~-][0-9A-Za-z!#$%&*+./:;=?@^_|~-]*)')
+SEQ_RE = re.compile(r'\*|[A-Za-z=.]+')
+QUAL_RE = re.compile(r'\*|[!-~]+')
 
-        if op in ("I", "D"):
-            indel_count += int(nb)
+#whole alignment line in one match (fast path of full validation), the integer ranges are checked afterwards
+LINE_RE = re.compile("\t".join([QNAME_RE.pattern, r'([0-9]+)', "(?:" + RNAME_RE.pattern + ")", r'([0-9]+)', r'([0-9]+)',
+                                 "(?:" + CIGAR_RE.pattern + ")", RNEXT_RE.pattern, r'([0-9]+)', r'(-?[0-9]+)',
+                                 "(?:" + SEQ_RE.pattern + ")", "(?:" + QUAL_RE.pattern + ")"]) + r'(?:\t[^\n]*)?\n?')
 
-    return indel_count
+#(name, minimum, maximum) of the integer fields captured by LINE_RE
+INT_RANGES = (("FLAG", 0, 2**16 - 1), ("POS", 0, 2**31 - 1), ("MAPQ", 0, 2**8 - 1), ("PNEXT", 0, 2**31 - 1), ("TLEN", -2**31 + 1, 2**31 - 1))
 
-############### SAM FILE CHECK FUNCTION ###############
+VALIDATION_MODES = ("off", "head", "sample", "full")
+
+
+def checkFields(line):
+    '''return the format error of a line or None, each field is checked in turn to give a precise message'''
 
-def check(line, line_index):
-    '''
-    Verifies that each line (non-header) contains at least the 11 "mandatory" fields and that the header lines has SN and LN
-    '''
-  
     if line.startswith("@"): #check header
         if line.startswith("@SQ"):
             if "SN:" not in line or "LN:" not in line: #check for mandatory fields
-                print(f"Error at line {line_index}: @SQ must contain SN: and LN:.")
-                sys.exit(1)
+                return "@SQ must contain SN: and LN:."
+        return None
 
-    else:
+    #Process alignment lines
+    columns = line.strip().split("\t")
 
-        #Process alignment lines
-        columns = line.strip().split("\t")
+    #Check for at least 11 mandatory fields
+    if len(columns) < 11:
+        return "less than 11 fields."
 
-        #Check for at least 11 mandatory fields
-        if len(columns) < 11:
-            print(f"Format error at line {line_index}: less than 11 fields.")
-            sys.exit(1)
+    #Ger the first 11 mandatory fields
+    qname, flag, rname, pos, mapq, cigar, rnext, pnext, tlen, seq, qual = columns[:11]
 
-        #Ger the first 11 mandatory fields
-        qname, flag, rname, pos, mapq, cigar, rnext, pnext, tlen, seq, qual = columns[:11]
+    #Check for empty mandatory fields
+    if any(field == "" for field in columns[:11]):
+        return "one of the 11 mandatory fields is empty."
 
-        #Check for empty mandatory fields
-        if any(field == "" for field in columns[:11]):
-            print(f"Format error at line {line_index}: one of the 11 mandatory fields is empty.")
-            sys.exit(1)
+    #Check if each field is in correct Regexp/Range
+    for name, value, regexp in (("QNAME", qname, QNAME_RE), ("RNAME", rname, RNAME_RE), ("CIGAR", cigar, CIGAR_RE),
+                                ("RNEXT", rnext, RNEXT_RE), ("SEQ", seq, SEQ_RE), ("QUAL", qual, QUAL_RE)):
+        if not regexp.fullmatch(value):
+            return f"{name} incorrect."
 
-        #Check if each field is in correct Regexp/Range
-        #QNAME
-        if not re.fullmatch(r'[!-?A-~]{1,254}', qname):
-            print(f"Format error at line {line_index}: QNAME incorrect.")
-            sys.exit(1)
-                
-        #FLAG: first check if of type integer then if in the right range
+    #integer fields: first check if of type integer then if in the right range
+    for (name, minimum, maximum), value in zip(INT_RANGES, (flag, pos, mapq, pnext, tlen)):
         try:
-            flag_int = int(flag)
+            value = int(value)
         except ValueError:
-            print(f"Format error at line {line_index}: FLAG must be an interger.")
-            sys.exit(1)
-                
-        if not (0 <= flag_int <= 2**16 - 1):
-            print(f"Format error at line {line_index}: FLAG incorrect.")
-            sys.exit(1)
+            return f"{name} must be an interger."
+        if not (minimum <= value <= maximum):
+            return f"{name} incorrect."
 
-        #RNAME
-        if not re.fullmatch(r'\*|[0-9A-Za-z!#$%&+./:;?@^_|~-][0-9A-Za-z!#$%&*+./:;=?@^_|~-]*', rname):
-            print(f"Format error at line {line_index}: RNAME incorrect.")
-            sys.exit(1)
+    return None
 
-        #POS: first check if of type integer then if in the right range
-        try:
-            pos_int = int(pos)
-        except ValueError:
-            print(f"Format error at line {line_index}: POS must be an interger.")
-            sys.exit(1)
 
-        if not (0 <= pos_int <= 2**31 - 1):
-            print(f"Format error at line {line_index}: POS incorrect.")
-            sys.exit(1)
+def check(line, line_index, validation=None):
+    '''
+    Verifies that each line (non-header) contains at least the 11 "mandatory" fields and that the header lines has SN and LN,
+    errors are recorded in the validation report (or printed) and the line is rejected
+    '''
 
-        #MAPQ: first check if of type integer then if in the right range
-        try:
-            mapq_int = int(mapq)
-        except ValueError:
-            print(f"Format error at line {line_index}: MAPQ must be an interger.")
-            sys.exit(1)
+    if not line.startswith("@"):
+        match = LINE_RE.fullmatch(line)
+        if match:
+            flag, pos, mapq, pnext, tlen = match.groups() #signs are already checked by LINE_RE
+            if int(flag) < 2**16 and int(pos) < 2**31 and int(mapq) < 2**8 and int(pnext) < 2**31 and -2**31 < int(tlen) < 2**31:
+                return True
 
-        if not (0 <= mapq_int <= 2**8 - 1):
-            print(f"Format error at line {line_index}: MAPQ incorrect.")
-            sys.exit(1)
+    error = checkFields(line)
+    if error is None:
+        return True
 
-        #CIGAR
-        if not re.fullmatch(r'\*|([0-9]+[MIDNSHPX=])+', cigar):
-            print(f"Format error at line {line_index}: CIGAR incorrect.")
-            sys.exit(1)
+    if validation is None:
+        print(f"Format error at line {line_index}: {error}")
+    else:
+        validation.addError(line_index, error)
+    return False
+
+
+class Validation:
+    '''which lines are checked (off, head: the first lines, sample: a random fraction of the lines, full: every line)
+    and report of the errors found, mergeable like the accumulators'''
+
+    MAX_MESSAGES = 100 #errors reported with their line, the others are only counted
+
+    def __init__(self, mode="head", head_lines=50, sample_rate=0.01, seed=0):
+        self.mode = mode
+        self.head_lines = head_lines
+        self.sample_rate = sample_rate
+        self.random = random.Random(seed)
+        self.checked = 0
+        self.errors = {} #{error message: count}
+        self.messages = [] #[(line index, error message)] of the first errors
+
+    def forRange(self, start):
+        '''same settings for the part of the file starting at byte start, line numbers are unknown there (head only checks the first part)'''
+        return Validation(self.mode if start == 0 or self.mode != "head" else "off", self.head_lines, self.sample_rate, start)
+
+    def wanted(self, line_index):
+        '''True if the line has to be checked'''
+        if self.mode == "full":
+            return True
+        if self.mode == "head":
+            return line_index <= self.head_lines
+        if self.mode == "sample":
+            return self.random.random() < self.sample_rate
+        return False
 
-        #RNEXT
-        if not re.fullmatch(r'(?:\*|=|[0-9A-Za-z!#$%&+./:;?@^_|~-][0-9A-Za-z!#$%&*+./:;=?@^_|~-]*)', rnext):
-            print(f"Format error at line {line_index}: RNEXT incorrect.")
-            sys.exit(1)
+    def lastLine(self):
+        '''index of the last line that can be checked (None if any line can be)'''
+        if self.mode == "head":
+            return self.head_lines
+        if self.mode == "off":
+            return 0
+        return None
+
+    def check(self, line, line_index):
+        self.checked += 1
+        return check(line, line_index, self)
+
+    def addError(self, line_index, error):
+        self.errors[error] = self.errors.get(error, 0) + 1
+        if len(self.messages) < self.MAX_MESSAGES:
+            self.messages.append((line_index, error))
+
+    def merge(self, other):
+        self.checked += other.checked
+        for error, count in other.errors.items():
+            self.errors[error] = self.errors.get(error, 0) + count
+        self.messages.extend(other.messages[:self.MAX_MESSAGES - len(self.messages)])
+
+    def nbErrors(self):
+        return sum(self.errors.values())
+
+    def write(self, dir_name, fileName="validation.txt"):
+        '''save the report in a text file'''
+        with open(os.path.join(dir_name, fileName), "w") as fileReport:
+            fileReport.write(f"Validation mode: {self.mode}\nChecked lines: {self.checked}\nRejected lines: {self.nbErrors()}\n\n")
+            for error, count in sorted(self.errors.items(), key=lambda item: -item[1]):
+                fileReport.write(f"{count}\t{error}\n")
+            fileReport.write("\nFirst errors (line numbers are relative to the part of the file read by each worker with --workers):\n")
+            for line_index, error in self.messages:
+                fileReport.write(f"line {line_index}: {error}\n")
+        print(f"{self.nbErrors()} malformed lines were skipped, see \"{fileName}\" in directory \"{dir_name}\".")
+
+
+############### COMPRESSED INPUT ###############
+#.sam.gz files are read through gzip. BGZF files (bgzip, samtools) are a series of independent deflate blocks of at most 64 KB:
+#they are inflated by a pool of threads (zlib releases the GIL) and can be split between processes with virtual offsets
+#(block offset << 16 | offset in the decompressed block) as in the BAM indexes
+
+GZIP_MAGIC = b"\x1f\x8b"
+BGZF_MAGIC = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00" #gzip header with the BC extra field, always written this way by bgzip/htslib
+BGZF_HEADER_SIZE = 18
+BGZF_THREADS = min(4, os.cpu_count() or 1) #threads inflating the blocks of one file
+BGZF_LOOKAHEAD = 4 #blocks inflated in advance per thread
+
+
+def fileFormat(input_file):
+    '''"bam", "bgzf", "gzip" or "sam" according to the first bytes of the file'''
+    with open(input_file, "rb") as file:
+        start = file.read(len(BGZF_MAGIC))
+        if start == BGZF_MAGIC:
+            file.seek(0)
+            return "bam" if inflate(readBlock(file)).startswith(BAM_MAGIC) else "bgzf"
+    if start.startswith(GZIP_MAGIC):
+        return "gzip"
+    return "sam"
+
+
+def openSam(input_file, mode="r"):
+    '''open the SAM file, compressed or not, in text ("r") or binary ("rb") mode (only the text header of a BAM file)'''
+    file_format = fileFormat(input_file)
+    if file_format == "sam":
+        return open(input_file, mode)
+    if file_format == "bam":
+        return io.StringIO(BamReader(input_file).text)
+    return gzip.open(input_file, "rt" if mode == "r" else mode)
+
+
+def readBlock(file):
+    '''next BGZF block of the file as raw bytes (b"" at the end of the file)'''
+    header = file.read(BGZF_HEADER_SIZE)
+    if not header:
+        return b""
+    if not header.startswith(BGZF_MAGIC):
+        raise ValueError(f"corrupted BGZF block at byte {file.tell() - len(header)}")
+    block_size = struct.unpack_from("<H", header, 16)[0] + 1 #BSIZE is the total block size minus 1
+    return header + file.read(block_size - BGZF_HEADER_SIZE)
+
+
+def inflate(block):
+    '''decompressed data of a raw BGZF block'''
+    data = zlib.decompress(block[BGZF_HEADER_SIZE:-8], -15) #raw deflate between the header and the CRC32/ISIZE trailer
+    if len(data) != struct.unpack_from("<I", block, len(block) - 4)[0]:
+        raise ValueError("corrupted BGZF block: wrong decompressed size")
+    return data
+
+
+class BgzfReader:
+    '''decompressed content of a BGZF file, blocks are inflated in parallel by threads and given back in file order'''
+
+    def __init__(self, input_file, threads=BGZF_THREADS):
+        self.input_file = input_file
+        self.threads = threads
+
+    def blocks(self, coffset=0):
+        '''(block offset, decompressed data) of the blocks from the block offset coffset'''
+        with open(self.input_file, "rb") as file, ThreadPoolExecutor(max_workers=self.threads) as pool:
+            file.seek(coffset)
+            pending = deque() #blocks being inflated, bounded so that memory does not depend on the file size
+            while True:
+                while len(pending) < self.threads * BGZF_LOOKAHEAD:
+                    offset = file.tell()
+                    block = readBlock(file)
+                    if not block:
+                        break
+                    pending.append((offset, pool.submit(inflate, block)))
+                if not pending:
+                    return
+                offset, future = pending.popleft()
+                yield offset, future.result()
+
+    def batches(self, start=0, end=None, progress=None):
+        '''lists of the lines starting in the range of virtual offsets [start, end[, one list per block (start must be the beginning of a line)'''
+        coffset, uoffset = start >> 16, start & 0xFFFF
+        rest = b"" #beginning of a line continued in the next block
+        consumed = coffset #compressed bytes given to progress
+
+        for block_offset, data in self.blocks(coffset):
+            if progress is not None:
+                progress.update(block_offset - consumed)
+                consumed = block_offset
+            shift = 0
+            if block_offset == coffset:
+                data, shift = data[uoffset:], uoffset
+
+            last = False
+            if end is not None and block_offset >= end >> 16:
+                #keep the lines starting before the end of the range, the last one may continue in the next blocks
+                limit = max((end & 0xFFFF) - shift, 0) if block_offset == end >> 16 else 0
+                if limit == 0 and not rest:
+                    return
+                newline = data.find(b"\n", max(limit - 1, 0))
+                if newline >= 0:
+                    data, last = data[:newline + 1], True
+
+            lines = (rest + data).splitlines(True)
+            rest = lines.pop() if lines and not lines[-1].endswith(b"\n") else b""
+            if progress is not None:
+                progress.update(0, len(lines))
+            yield lines
+            if last:
+                return
+
+        if rest: #no new line at the end of the file
+            yield [rest]
+
+    def lineOffsets(self):
+        '''(virtual offset, line) of every line of the file'''
+        rest, rest_offset = b"", 0 #beginning of a line continued in the next block and its offset
+
+        for block_offset, data in self.blocks():
+            position = 0
+            if rest:
+                newline = data.find(b"\n")
+                if newline < 0:
+                    rest += data
+                    continue
+                yield rest_offset, rest + data[:newline]
+                rest, position = b"", newline + 1
+
+            newline = data.find(b"\n", position)
+            while newline >= 0:
+                yield block_offset << 16 | position, data[position:newline]
+                position = newline + 1
+                newline = data.find(b"\n", position)
+
+            if position < len(data):
+                rest, rest_offset = data[position:], block_offset << 16 | position
+
+        if rest:
+            yield rest_offset, rest
+
+
+def nextBlock(file, offset):
+    '''offset of the first BGZF block starting at or after offset (None at the end of the file)'''
+    while True:
+        file.seek(offset)
+        buffer = file.read(1 << 20)
+        if len(buffer) < len(BGZF_MAGIC):
+            return None
+        found = buffer.find(BGZF_MAGIC)
+        while found >= 0:
+            #a block is followed by another block or by the end of the file, this rules out the magic bytes appearing by chance in compressed data
+            candidate = offset + found
+            file.seek(candidate + 16)
+            file.seek(candidate + struct.unpack("<H", file.read(2))[0] + 1)
+            if file.read(len(BGZF_MAGIC)) in (BGZF_MAGIC, b""):
+                return candidate
+            found = buffer.find(BGZF_MAGIC, found + 1)
+        offset += len(buffer) - len(BGZF_MAGIC) + 1 #the magic bytes may overlap two reads
+
+
+def lineStart(file, coffset):
+    '''virtual offset of the first line starting in the block at coffset or after it'''
+    file.seek(coffset)
+    while True:
+        block = readBlock(file)
+        if not block:
+            return file.tell() << 16
+        data = inflate(block)
+        newline = data.find(b"\n")
+        if 0 <= newline < len(data) - 1:
+            return coffset << 16 | newline + 1
+        coffset = file.tell()
+        if newline >= 0: #the line ends with the block, the next one starts the following block
+            return coffset << 16
+
+
+def bgzf_ranges(input_file, nb_chunks, start=0, end=None):
+    '''split a BGZF file (or its range [start, end[) in ranges of virtual offsets aligned on line boundaries [(start, end)...]'''
+    size = os.path.getsize(input_file)
+    end = size << 16 if end is None else end
+    bounds = [start]
+
+    with open(input_file, "rb") as file:
+        for i in range(1, nb_chunks):
+            coffset = nextBlock(file, (start >> 16) + ((end >> 16) - (start >> 16)) * i // nb_chunks)
+            if coffset is None or coffset << 16 >= end:
+                break
+            bounds.append(min(max(lineStart(file, coffset), bounds[-1]), end))
+    bounds.append(end)
+
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start] or [(start, end)]
+
+
+READ_BATCH_SIZE = 1 << 24 #bytes of lines read at once
+
+
+def read_batches(input_file, start=0, end=None, progress=None):
+    '''lists of the lines (bytes) of the SAM file starting in the range [start, end[ of byte offsets (virtual offsets for BGZF)
+    the bytes of the file read (compressed bytes for gzip and BGZF) and the lines are counted in progress'''
+    file_format = fileFormat(input_file)
+    if file_format == "bgzf":
+        yield from BgzfReader(input_file).batches(start, end, progress)
+        return
+
+    if file_format == "gzip": #read from the beginning, see split_ranges
+        with gzip.open(input_file, "rb") as file:
+            consumed = 0
+            for batch in iter(lambda: file.readlines(READ_BATCH_SIZE), []):
+                if progress is not None:
+                    position = file.fileobj.tell()
+                    progress.update(position - consumed, len(batch))
+                    consumed = position
+                yield batch
+        return
+
+    #buffered lines of the file, the kernel is told that the file is read forward so that the disk reads ahead of the parsing
+    #(a memory map split on new lines was slower: its page faults cost more than the copies of read)
+    with open(input_file, "rb") as file:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(file.fileno(), start, 0, os.POSIX_FADV_SEQUENTIAL)
+        file.seek(start)
+        while end is None or start < end:
+            lines = file.readlines(READ_BATCH_SIZE)
+            if not lines:
+                return
+            stop = file.tell()
+            if end is not None and stop > end: #the lines starting at or after end belong to the next range
+                while lines and stop - len(lines[-1]) >= end:
+                    stop -= len(lines.pop())
+            if progress is not None:
+                progress.update(stop - start, len(lines))
+            start = stop
+            yield lines
+
+
+def read_lines(input_file, start=0, end=None, progress=None):
+    '''lines (bytes) of the SAM file starting in the range [start, end[, one after the other'''
+    batches = read_batches(input_file, start, end, progress)
+    if fileFormat(input_file) == "gzip": #zlib releases the GIL: the next batch is inflated by another thread while this one is parsed
+        batches = prefetch(batches)
+    return itertools.chain.from_iterable(batches)
+
+
+############### BAM INPUT ###############
+#BAM is binary SAM compressed in BGZF: records are decoded with struct straight from the decompressed blocks
+#and give the same Record as the SAM lines, pos and pnext are 0-based in BAM and 1-based in SAM
+
+BAM_MAGIC = b"BAM\x01"
+#refID, pos, l_read_name, mapq, bin, n_cigar_op, flag, l_seq, next_refID, next_pos, tlen
+BAM_CORE = struct.Struct("<iiBBHHHIiii")
+#SEQ of a BAM record holds two bases per byte, each byte gives its two characters at once
+BAM_BASE_PAIRS = np.array([[ord(high), ord(low)] for high in "=ACMGRSVTWYHKDBN" for low in "=ACMGRSVTWYHKDBN"], dtype=np.uint8)
+PHRED33 = bytes((quality + 33) & 0xFF for quality in range(256)) #QUAL of a BAM record to the characters of a SAM line
+
+
+class BamReader:
+    '''header and records of a BAM file, text is the SAM header and references the {reference_name: length} of the binary header'''
+
+    def __init__(self, input_file, threads=BGZF_THREADS):
+        self.blocks = BgzfReader(input_file, threads).blocks()
+        self.buffer = b"" #decompressed data not decoded yet, from offset
+        self.offset = 0
+
+        magic, l_text = struct.unpack("<4si", self._take(8))
+        if magic != BAM_MAGIC:
+            raise ValueError(f"not a BAM file: {input_file}")
+        self.text = self._take(l_text).rstrip(b"\0").decode()
+        self.references = {}
+        for i in range(struct.unpack("<i", self._take(4))[0]):
+            l_name = struct.unpack("<i", self._take(4))[0]
+            name = self._take(l_name)[:-1].decode() #names end with a NUL byte
+            self.references[name] = struct.unpack("<i", self._take(4))[0]
+        self.names = list(self.references) #reference names indexed by refID
+
+    def _take(self, size):
+        '''next size bytes of the decompressed file (header only, records are decoded in place)'''
+        while len(self.buffer) - self.offset < size:
+            try:
+                self.buffer = self.buffer[self.offset:] + next(self.blocks)[1]
+            except StopIteration:
+                raise ValueError("truncated BAM file") from None
+            self.offset = 0
+        self.offset += size
+        return self.buffer[self.offset - size:self.offset]
+
+    def records(self, validation=None, progress=None, filters=(0, 0, 0), sequences=False):
+        '''Record of each alignment, records with a reference unknown to the header are reported in validation
+        the compressed bytes read and the records are counted in progress
+        filters (see pushedFilters) are tested on the fixed part of the record, the name and the CIGAR are decoded for the records kept only
+        SEQ and QUAL are decoded (rest of the Record as in a SAM line, without the tags) only with sequences'''
+        exclude, require, min_mapq = filters
+        names, nb_references = self.names, len(self.names)
+        unpack_core, unpack_size = BAM_CORE.unpack_from, struct.Struct("<i").unpack_from
+        buffer, offset, record_index = self.buffer, self.offset, 0
+        consumed, counted = 0, 0 #compressed bytes and records given to progress
+
+        for block_offset, data in itertools.chain([(0, b"")], self.blocks):
+            if progress is not None:
+                progress.update(block_offset - consumed, record_index - counted)
+                consumed, counted = block_offset, record_index
+            buffer, offset = buffer[offset:] + data, 0 #only the incomplete last record is copied
+            end = len(buffer)
+
+            while offset + 4 <= end:
+                size = unpack_size(buffer, offset)[0]
+                if offset + 4 + size > end: #record continued in the next block
+                    break
+                record_index += 1
+                ref_id, pos, l_read_name, mapq, _, n_cigar_op, flag, l_seq, next_ref_id, next_pos, _ = unpack_core(buffer, offset + 4)
+                name_start = offset + 4 + BAM_CORE.size
+                cigar_start = name_start + l_read_name
+                offset += 4 + size
+
+                if not (-1 <= ref_id < nb_references and -1 <= next_ref_id < nb_references):
+                    if validation is not None:
+                        validation.addError(record_index, "reference id not in the header.")
+                    continue
+                if flag & exclude or flag & require != require or mapq < min_mapq:
+                    continue
 
-        #PNEXT: first check if of type integer then if in the right range
-        try:
-            pnext_int = int(pnext)
-        except ValueError:
-            print(f"Format error at line {line_index}: PNEXT must be an interger.")
-            sys.exit(1)
+                chromosome = names[ref_id] if ref_id >= 0 else "*"
+                if next_ref_id < 0:
+                    rnext = "*"
+                elif next_ref_id == ref_id:
+                    rnext = "="
+                else:
+                    rnext = names[next_ref_id]
+
+                rest = None
+                if sequences:
+                    seq_start = cigar_start + 4 * n_cigar_op
+                    qual_start = seq_start + (l_seq + 1) // 2
+                    if not l_seq:
+                        rest = b"*\t*"
+                    else:
+                        seq = BAM_BASE_PAIRS[np.frombuffer(buffer, np.uint8, qual_start - seq_start, seq_start)].tobytes()[:l_seq]
+                        qual = b"*" if buffer[qual_start] == 0xFF else buffer[qual_start:qual_start + l_seq].translate(PHRED33) #0xFF: no QUAL
+                        rest = seq + b"\t" + qual
 
-        if not (0 <= pnext_int <= 2**31 - 1):
-            print(f"Format error at line {line_index}: pNEXT incorrect.")
-            sys.exit(1)
+                yield Record(buffer[name_start:cigar_start - 1].decode(), flag, chromosome, pos + 1, mapq,
+                             decodeBamCigar(buffer[cigar_start:cigar_start + 4 * n_cigar_op]), rnext, next_pos + 1, rest)
+
+        if offset < len(buffer):
+            raise ValueError("truncated BAM file")
+
+
+def iter_bam_reads(input_file, filterMAPQ, fullyMappedOnly, validation=None, region=None, progress=None, flag_filter=(0, 0), sequences=False):
+    '''same as iter_reads for a BAM file'''
+    for read in BamReader(input_file).records(validation, progress, pushedFilters(filterMAPQ, fullyMappedOnly, flag_filter), sequences):
+        if fullyMappedOnly and not isFullyMapped(read.flag, read.cigar):
+            continue
+        if region is not None and not inRegion(read, region):
+            continue
+        yield read
+
+
+############### READ FILTERING AND EXTRACTION FUNCTIONS ###############
+
+class Record:
+    '''one alignment reduced to the fields used by the statistics, made only for the reads kept by the filters
+    SEQ, QUAL and the tags stay as the raw bytes of rest and are split on first use only'''
+    __slots__ = ("qname", "flag", "chromosome", "pos", "mapq", "cigar", "rnext", "pnext", "rest")
+
+    def __init__(self, qname, flag, chromosome, pos, mapq, cigar, rnext="*", pnext=0, rest=None):
+        self.qname = qname
+        self.flag = flag
+        self.chromosome = chromosome
+        self.pos = pos
+        self.mapq = mapq
+        self.cigar = cigar
+        self.rnext = rnext
+        self.pnext = pnext
+        self.rest = rest #b"SEQ\tQUAL[\tTAGS]" of a SAM line, None for BAM records
+
+    def __repr__(self):
+        return f"Record({self.qname!r}, {self.flag}, {self.chromosome!r}, {self.pos}, {self.mapq}, {self.cigar!r}, {self.rnext!r}, {self.pnext})"
+
+    @property
+    def seq(self):
+        return self.seqQual()[0]
+
+    @property
+    def qual(self):
+        return self.seqQual()[1]
+
+    def seqQual(self):
+        '''(SEQ, QUAL) split from rest at once, b"*" when missing'''
+        if self.rest is None:
+            return b"*", b"*"
+        fields = self.rest.split(b"\t", 2)
+        if len(fields) < 2:
+            return fields[0].rstrip(b"\r\n"), b"*"
+        return fields[0], fields[1].rstrip(b"\r\n")
+
+
+#FLAG bits that can be given by name to --exclude-flags and --require-flags
+FLAG_NAMES = {"paired": 0x1, "proper": 0x2, "unmapped": 0x4, "mate_unmapped": 0x8, "reverse": 0x10, "mate_reverse": 0x20, "read1": 0x40,
+              "read2": 0x80, "secondary": 0x100, "qcfail": 0x200, "duplicate": 0x400, "supplementary": 0x800}
+
+
+def flagMask(value):
+    '''FLAG bits of a number (decimal or 0x hexadecimal) or of comma separated names of FLAG_NAMES'''
+    if isinstance(value, int):
+        return value
+    try:
+        return int(value, 0)
+    except ValueError:
+        pass
+    mask = 0
+    for name in value.split(","):
+        if name.strip().lower() not in FLAG_NAMES:
+            raise argparse.ArgumentTypeError(f"unknown FLAG bit \"{name}\", use a number or {', '.join(FLAG_NAMES)}")
+        mask |= FLAG_NAMES[name.strip().lower()]
+    return mask
+
+
+def iter_reads(input_file, filterMAPQ, fullyMappedOnly, start=0, end=None, validation=None, region=None, progress=None, flag_filter=(0, 0), sequences=False):
+    '''read the SAM file (or only the byte range [start, end[ aligned on lines) line by line and yield the filtered reads as Record, nothing is kept in memory
+    malformed lines are skipped and reported in validation, region (chromosome, start, end) keeps only the reads overlapping it
+    flag_filter (excluded bits, required bits) skips the reads on their FLAG, the reading is followed by progress (see Progress)
+    SEQ and QUAL of BAM records are decoded only with sequences (they are always in the rest of SAM lines)'''
+    if validation is None:
+        validation = Validation()
+
+    if fileFormat(input_file) == "bam":
+        yield from iter_bam_reads(input_file, filterMAPQ, fullyMappedOnly, validation, region, progress, flag_filter, sequences)
+        return
+
+    yield from parse_lines(read_lines(input_file, start, end, progress), filterMAPQ, fullyMappedOnly, validation, region, flag_filter=flag_filter)
+
+
+def pushedFilters(filterMAPQ, fullyMappedOnly, flag_filter):
+    '''(excluded FLAG bits, required FLAG bits, minimum MAPQ) tested on the raw read before anything else is decoded
+    an unmapped read is never fully mapped, so fullyMappedOnly first excludes the bit 4 and only the reads left have their CIGAR decoded'''
+    exclude, require = flag_filter
+    if fullyMappedOnly:
+        exclude |= 4
+    return exclude, require, filterMAPQ if filterMAPQ is not None else 0
+
+
+def parse_lines(lines, filterMAPQ, fullyMappedOnly, validation, region=None, first_index=1, flag_filter=(0, 0)):
+    '''filtered reads (Record) of SAM lines (bytes) numbered from first_index, see iter_reads'''
+    exclude, require, min_mapq = pushedFilters(filterMAPQ, fullyMappedOnly, flag_filter)
+    last_checked = validation.lastLine()
+    for line_index, line in enumerate(lines, start=first_index):
+
+        #check the lines asked by the validation mode, past the last one that can be checked no call is made
+        if (last_checked is None or line_index <= last_checked) and validation.wanted(line_index) and not validation.check(line.decode(), line_index):
+            continue
+
+        if line.startswith(b"@"): #skip header lines
+            continue
 
-        #TLEN: first check if of type integer then if in the right range
         try:
-            tlen_int = int(tlen)
-        except ValueError:
-            print(f"Format error at line {line_index}: TLEN must be an interger.")
-            sys.exit(1)
+            #only the first 9 tabs are looked for: SEQ, QUAL and the tags stay in the last field and are never decoded
+            fields = line.split(b"\t", 9)
 
-        if not (-2**31 + 1 <= tlen_int <= 2**31 - 1):
-            print(f"Format error at line {line_index}: TLEN incorrect.")
-            sys.exit(1)
+            #filters on the fewest fields first: FLAG and MAPQ, then the CIGAR, a rejected read costs two int()
+            flag = int(fields[1])
+            mapq = int(fields[4])
+            if flag & exclude or flag & require != require or mapq < min_mapq:
+                continue
+            cigar = fields[5].decode()
+            if fullyMappedOnly and not decodeCigar(cigar).fully_mapped:
+                continue
+
+            #text fields used by the statistics (chromosome is the RNAME), integers are parsed straight from the bytes
+            read = Record(fields[0].decode(), flag, fields[2].decode(), int(fields[3]), mapq, cigar, fields[6].decode(), int(fields[7]), fields[9] if len(fields) > 9 else None)
+        except (ValueError, IndexError): #malformed line that was not checked
+            validation.addError(line_index, "line cannot be parsed.")
+            continue
 
-        #SEQ
-        if not re.fullmatch(r'\*|[A-Za-z=.]+', seq):
-            print(f"Format error at line {line_index}: SEQ incorrect.")
-            sys.exit(1)   
+        if region is not None and not inRegion(read, region):
+            continue
 
-        #QUAL
-        if not re.fullmatch(r'\*|[!-~]+', qual):
-            print(f"Format error at line {line_index}: QUAL incorrect.")
-            sys.exit(1)     
-    return True
+        yield read
 
 
-############### READ FILTERING AND EXTRACTION FUNCTIONS ###############
+#numpy type of each array typecode
+ARRAY_DTYPES = {"B": np.uint8, "H": np.uint16, "i": np.int32, "q": np.int64}
 
-def sam_reader(input_file, header_parsed, filterMAPQ, fullyMappedOnly):
-    '''extract useful information and store it in a dictionary'''
-    reads_extract = {chrom: [] for chrom in header_parsed.keys()}
 
-    with open(input_file, "r") as file:
-        for line_index, line in enumerate(file,start=1):
+class ChromColumns:
+    '''reads of one chromosome stored as typed columns instead of one tuple per read'''
 
-            if line_index > 50 or check(line, line_index): #check each line has all the mandatory fields for the 50 first lines (lazy evaluation) to avoid pb with heavy files
+    #column name: (array typecode, numpy dtype)
+    COLUMNS = {"qname": ("i", np.int32), "flag": ("H", np.uint16), "pos": ("i", np.int32), "mapq": ("B", np.uint8),
+               "ref_length": ("i", np.int32), "indel": ("i", np.int32)}
 
-                if line.startswith("@"): #skip header lines
-                    continue
-                columns = line.strip().split("\t")
-                    
-                #extract useful fields
-                qname = columns[0]
-                flag = int(columns[1])
-                pos = int(columns[3])
-                mapq = int(columns[4])
-                cigar = columns[5]
-
-                #extract chromosome from RNAME
-                chromosome = columns[2]
-
-                if fullyMappedOnly:
-                    #filter fully mapped reads only
-                    if not isFullyMapped(flag, cigar):
-                        continue
-                
-                if filterMAPQ is not None and mapq < filterMAPQ:
-                    continue
+    def __init__(self):
+        for name, (typecode, dtype) in self.COLUMNS.items():
+            setattr(self, name, array(typecode))
 
-                if chromosome not in reads_extract:
-                    reads_extract[chromosome] = []            
+    def __len__(self):
+        return len(self.flag)
 
-                reads_extract[chromosome].append((qname, flag, pos, mapq, cigar))
+    def append(self, qname_id, flag, pos, mapq, ref_length, indel):
+        self.qname.append(qname_id)
+        self.flag.append(flag)
+        self.pos.append(pos)
+        self.mapq.append(mapq)
+        self.ref_length.append(ref_length)
+        self.indel.append(indel)
+
+    def column(self, name):
+        '''numpy view of a column (no copy)'''
+        return np.frombuffer(getattr(self, name), dtype=self.COLUMNS[name][1])
+
+
+class ReadStore(dict):
+    '''in-memory reads {chromosome: ChromColumns}, qnames are dictionary-encoded as integers shared by all chromosomes'''
+
+    def __init__(self, chromosomes=()):
+        super().__init__((chrom, ChromColumns()) for chrom in chromosomes)
+        self.qname_ids = {} #{qname: id}
+
+    def add(self, read):
+        if read.chromosome not in self:
+            self[read.chromosome] = ChromColumns()
+
+        qname_id = self.qname_ids.setdefault(read.qname, len(self.qname_ids))
+        cigar = decodeCigar(read.cigar)
+        self[read.chromosome].append(qname_id, read.flag, read.pos, read.mapq, cigar.ref_length, cigar.indel)
+
+
+def sam_reader(input_file, header_parsed, filterMAPQ, fullyMappedOnly, flag_filter=(0, 0)):
+    '''extract useful information and store it in a columnar ReadStore'''
+    reads_extract = ReadStore() #only the chromosomes receiving reads get columns
+
+    for read in iter_reads(input_file, filterMAPQ, fullyMappedOnly, flag_filter=flag_filter):
+        reads_extract.add(read)
 
     return reads_extract
 
 
+def header_lengths(lines):
+    '''length of each reference sequence {reference_name: length} from the @SQ lines of a header (text lines, reading stops at the first alignment)'''
+    length_ref = {}
+    for line in lines:
+        if not line.startswith("@"):
+            break
+        if line.startswith("@SQ"):
+            columns = line.strip().split("\t")
+            for field in columns:
+                if field.startswith("SN:"):
+                    sn = field.split(":")[1]
+                elif field.startswith("LN:"):
+                    ln = int(field.split(":")[1])
+            length_ref[sn] = ln
+    return length_ref
+
+
+def header_sort_order(lines):
+    '''sort order given by the SO: tag of the @HD line of a header (coordinate, queryname...) or None'''
+    for line in lines:
+        if not line.startswith("@"):
+            break
+        if line.startswith("@HD"):
+            for field in line.strip().split("\t"):
+                if field.startswith("SO:"):
+                    return field[3:]
+    return None
+
+
 def parse_header(input_file):
     '''parse the header of the SAM file to get the length of each reference sequence {reference_name: length}'''
-    length_ref = {}
-    with open(input_file, "r") as file:
+    if fileFormat(input_file) == "bam": #the binary header of a BAM file lists the references
+        return BamReader(input_file).references
+
+    with openSam(input_file) as file:
+        return header_lengths(file)
+
+
+def sort_order(input_file):
+    '''sort order of the SAM file given by the SO: tag of the @HD header line (coordinate, queryname...) or None'''
+    with openSam(input_file) as file:
+        return header_sort_order(file)
+
+
+############### STREAMED INPUT ###############
+#"-" as input file reads the SAM from stdin (aligner | samreader.py -) in a single pass: the header is parsed from the first lines
+#and the statistics are written as partial summaries while the reads come, nothing is written to disk but the results
+
+STDIN = "-"
+STREAM_BATCH_SIZE = 1 << 16 #small batches so that the reads of a slow aligner are counted as soon as they come
+
+
+def read_stream(stream, progress=None):
+    '''(header lines as text, alignment lines as bytes) of a binary SAM stream, the alignment lines are read as they are iterated'''
+    header = []
+    first = []
+    for line in stream:
+        if not line.startswith(b"@"):
+            first = [line]
+            break
+        header.append(line.decode())
+
+    def lines():
+        for batch in itertools.chain([first], iter(lambda: stream.readlines(STREAM_BATCH_SIZE), [])):
+            if progress is not None:
+                progress.update(sum(map(len, batch)), len(batch))
+            yield from batch
+
+    return header, lines()
+
+
+def accumulateSnapshots(reads, accumulator, snapshot, every_reads=None, every_seconds=None):
+    '''same as accumulate, snapshot(accumulator, nb_reads) is called every every_reads reads and every every_seconds seconds'''
+    every_reads = every_reads or 0
+    next_time = time.monotonic() + every_seconds if every_seconds else None
+    nb_reads = 0
+    for read in reads:
+        accumulator.update(read)
+        nb_reads += 1
+        if every_reads and nb_reads % every_reads == 0:
+            snapshot(accumulator, nb_reads)
+            if next_time is not None:
+                next_time = time.monotonic() + every_seconds
+        elif next_time is not None and nb_reads % 1000 == 0 and time.monotonic() >= next_time: #the clock is only read every 1000 reads
+            snapshot(accumulator, nb_reads)
+            next_time = time.monotonic() + every_seconds
+    return accumulator
+
+
+def body_offset(input_file):
+    '''byte offset of the first alignment line, just after the header'''
+    offset = 0
+    with open(input_file, "rb") as file:
         for line in file:
-            if not line.startswith("@"):
+            if not line.startswith(b"@"):
                 break
-            if line.startswith("@SQ"):
-                columns = line.strip().split("\t")
-                for field in columns:
-                    if field.startswith("SN:"):
-                        sn = field.split(":")[1]
-                    elif field.startswith("LN:"):
-                        ln = int(field.split(":")[1])
-                length_ref[sn] = ln
-    return length_ref
+            offset += len(line)
+    return offset
 
 
-################ STATISTICS FUNCTIONS ###############
+def split_ranges(input_file, nb_chunks, start=0, end=None):
+    '''split the SAM file (or its range [start, end[, see regionSpan) in byte ranges aligned on line boundaries [(start, end)...]'''
+    file_format = fileFormat(input_file)
+    if file_format == "bgzf":
+        return bgzf_ranges(input_file, nb_chunks, start, end)
+    if file_format in ("gzip", "bam"): #a gzip stream can only be read from its beginning, BAM records cannot be found without an index
+        return [(0, None)]
 
-def readFlag(reads_extract):
-    '''count the number of reads per flag {flag: count}'''
-    readsByName = {}
-    paired_orientation = {} #count percentage of properly paired reads and of properly oriented pairs
+    end = os.path.getsize(input_file) if end is None else end
+    if end <= start:
+        return [(start, end)]
+    body_start = body_offset(input_file) if start == 0 else start
+    bounds = [start] #the first range also contains the header, so that its first lines are checked as in the serial path
 
-    for chromosome in reads_extract:
-        for read in reads_extract[chromosome]:
+    with open(input_file, "rb") as file:
+        for i in range(1, nb_chunks):
+            file.seek(max(body_start + (end - body_start) * i // nb_chunks - 1, 0))
+            file.readline() #move to the beginning of the next line
+            bounds.append(min(max(file.tell(), bounds[-1]), end))
+    bounds.append(end)
 
-            qname = read[0]
-            flag = read[1]
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
 
-            if qname not in readsByName: #we fill the dictionnary with flags for each qname (to see properly paired reads)
-                readsByName[qname] = []
-            readsByName[qname].append(flag)
 
-        total, properly_paired, properly_oriented = 0, 0, 0
+############### INDEX AND REGIONS ###############
+#the sidecar index (<file>.sri, JSON) gives for each chromosome the offsets of its first record and of the line after its last one,
+#its number of records and, in coordinate-sorted files, a checkpoint (POS, offset) every INDEX_CHECKPOINT records
+#offsets are byte offsets in plain SAM files and virtual offsets in BGZF files
 
-        for qname, flags in readsByName.items():
-            total += 1
+INDEX_SUFFIX = ".sri"
+INDEX_VERSION = 1
+INDEX_CHECKPOINT = 10000 #records between two position checkpoints
 
-            if len(flags) != 2: #skip unpaired reads
+
+def line_offsets(input_file):
+    '''(offset, line) of every line of a plain or BGZF SAM file, offsets can be given to read_lines'''
+    if fileFormat(input_file) == "bgzf":
+        yield from BgzfReader(input_file).lineOffsets()
+        return
+
+    offset = 0
+    for line in read_lines(input_file):
+        yield offset, line
+        offset += len(line) #lines end with their new line
+
+
+def fileIdentity(input_file):
+    '''size and modification time of the file, an index built for another content is not used'''
+    status = os.stat(input_file)
+    return {"size": status.st_size, "mtime_ns": status.st_mtime_ns}
+
+
+def build_index(input_file):
+    '''read the file once and return its index'''
+    file_format = fileFormat(input_file)
+    if file_format not in ("sam", "bgzf"):
+        raise ValueError(f"only plain and BGZF compressed SAM files can be indexed: {input_file}")
+
+    coordinate_sorted = sort_order(input_file) == "coordinate"
+    chromosomes = {} #{chromosome: {"start", "end", "count", "max_span", "checkpoints"}}
+    previous = None
+
+    for offset, line in line_offsets(input_file):
+        if previous is not None: #the range of the previous record ends where this line starts
+            previous["end"] = offset
+        if line.startswith(b"@"):
+            continue
+        fields = line.split(b"\t", 6)
+        try:
+            chromosome, pos, cigar = fields[2].decode(), int(fields[3]), fields[5].decode()
+        except (IndexError, ValueError): #malformed line, reported by the analysis
+            continue
+
+        entry = chromosomes.get(chromosome)
+        if entry is None:
+            entry = chromosomes[chromosome] = {"start": offset, "end": offset, "count": 0, "max_span": 0, "checkpoints": []}
+        if coordinate_sorted and entry["count"] % INDEX_CHECKPOINT == 0:
+            entry["checkpoints"].append([pos, offset])
+        entry["count"] += 1
+        entry["max_span"] = max(entry["max_span"], decodeCigar(cigar).ref_length)
+        previous = entry
+
+    if previous is not None: #the last record goes to the end of the file
+        size = os.path.getsize(input_file)
+        previous["end"] = size << 16 if file_format == "bgzf" else size
+
+    return {"version": INDEX_VERSION, "file": fileIdentity(input_file), "sort_order": sort_order(input_file), "chromosomes": chromosomes}
+
+
+def write_index(input_file):
+    '''build the index of the file and save it next to it as <file>.sri'''
+    index = build_index(input_file)
+    with open(input_file + INDEX_SUFFIX, "w") as file:
+        json.dump(index, file)
+    print(f"Index of \"{input_file}\" has been saved as \"{input_file + INDEX_SUFFIX}\".")
+    return index
+
+
+def load_index(input_file):
+    '''index of the file or None if there is none or if it was built for another version of the file'''
+    try:
+        with open(input_file + INDEX_SUFFIX, "r") as file:
+            index = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if index.get("version") != INDEX_VERSION or index.get("file") != fileIdentity(input_file):
+        return None
+    return index
+
+
+def parseRegion(region, header_parsed):
+    '''(chromosome, start, end) 1-based and inclusive from "chr", "chr:start" or "chr:start-end", ValueError if it is not valid'''
+    region = region.replace(",", "") #chr1:1,000,000-2,000,000
+    if region in header_parsed: #whole chromosome, even if its name contains ":"
+        return region, 1, header_parsed[region]
+
+    chromosome, _, interval = region.rpartition(":")
+    if chromosome not in header_parsed:
+        raise ValueError(f"unknown chromosome in region {region}")
+    start, _, end = interval.partition("-")
+    if not start.isdigit() or not (end.isdigit() or end == ""):
+        raise ValueError(f"region must be chr:start-end: {region}")
+    start, end = int(start), int(end) if end else header_parsed[chromosome]
+    if not 1 <= start <= end:
+        raise ValueError(f"region start must be between 1 and its end: {region}")
+    return chromosome, start, end
+
+
+def inRegion(read, region):
+    '''True if the read overlaps the region (unmapped reads placed at a position count for that position)'''
+    chromosome, start, end = region
+    return read.chromosome == chromosome and read.pos <= end and read.pos + max(decodeCigar(read.cigar).ref_length, 1) > start
+
+
+def regionSpan(input_file, region):
+    '''offsets [start, end[ holding the reads of the region, from the index (built on the first call)'''
+    if fileFormat(input_file) not in ("sam", "bgzf"): #no index: the whole file is read and filtered
+        return 0, None
+
+    index = load_index(input_file) or write_index(input_file)
+    chromosome, start, end = region
+    entry = index["chromosomes"].get(chromosome)
+    if entry is None: #no read on this chromosome
+        return 0, 0
+
+    first, last = entry["start"], entry["end"]
+    for pos, offset in entry["checkpoints"]: #coordinate-sorted file only
+        if pos <= start - entry["max_span"]: #reads before this checkpoint end before the region
+            first = offset
+        elif pos > end: #this read and all the next ones start after the region
+            last = offset
+            break
+
+    return first, last
+
+
+############### SAMPLED PREVIEW ###############
+#--sample N reads about N reads at random places of the file instead of the whole file: runs of SAMPLE_RUN consecutive lines are read
+#after random byte offsets (moved to the next line), so the time does not depend on the size of the file. Each run is a cluster of the
+#sample: the summary columns are ratio estimates with a 95% confidence interval computed from the variance between the runs
+
+SAMPLE_RUN = 64 #consecutive lines read after each random offset
+SAMPLE_Z = 1.96 #95% confidence intervals
+HLL_PRECISION = 14 #2^14 registers of one byte, about 0.8% of error on the number of distinct values
+
+
+class HyperLogLog:
+    '''approximate number of distinct values (strings) in a fixed memory of 2^precision registers, mergeable like the accumulators'''
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        hashed = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+        index = hashed >> (64 - self.precision) #first bits: register
+        rank = 64 - self.precision - (hashed & ((1 << (64 - self.precision)) - 1)).bit_length() + 1 #position of the first 1 in the other bits
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        size = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / size) * size * size / sum(2.0 ** -rank for rank in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros: #small numbers of values: linear counting is more accurate
+            estimate = size * math.log(size / zeros)
+        return round(estimate)
+
+
+def samSampleRuns(input_file, offsets, run_length):
+    '''(lines, bytes they take in the file) of the run of lines starting at or after each offset of a plain SAM file'''
+    with open(input_file, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        for offset in offsets:
+            start = buffer.find(b"\n", offset - 1) + 1 #the offset is moved to the beginning of the next line
+            if start == 0:
                 continue
+            lines, end = [], start
+            while len(lines) < run_length:
+                newline = buffer.find(b"\n", end)
+                if newline < 0:
+                    break
+                lines.append(buffer[end:newline])
+                end = newline + 1
+            yield lines, end - start
 
-            f1, f2 = flags
 
-            #check if properly paired (bit 0x40 et 0x80 in either f1 or f2 and 0x2 in both) 
-            if ((f1 & 0x80 and f2 & 0x40) or (f2 & 0x80 and f1 & 0x40)) and f1 & 0x2 and f2 & 0x2:
-                properly_paired += 1
+def bgzfSampleRuns(input_file, offsets, run_length):
+    '''same as samSampleRuns for a BGZF file, the bytes of the lines are counted in compressed bytes'''
+    with open(input_file, "rb") as file:
+        for offset in offsets:
+            coffset = nextBlock(file, offset)
+            if coffset is None:
+                continue
+            file.seek(coffset)
+            data, compressed = b"", 0
+            while data.count(b"\n") <= run_length: #the first line may have started in the previous block
+                position = file.tell()
+                block = readBlock(file)
+                if not block:
+                    break
+                data += inflate(block)
+                compressed += file.tell() - position
+            lines = data.split(b"\n")[1 if coffset else 0:-1][:run_length] #only complete lines
+            if lines and data:
+                yield lines, compressed * (sum(map(len, lines)) + len(lines)) / len(data)
+
+
+def ratioEstimate(y, x):
+    '''sum(y) / sum(x) of the runs (numpy arrays of one value per run) and its confidence interval (estimate, low, high)'''
+    total_x = x.sum()
+    if total_x == 0:
+        return 0.0, 0.0, 0.0
+    ratio = y.sum() / total_x
+    nb_runs = len(x)
+    if nb_runs < 2:
+        return ratio, ratio, ratio
+    half = SAMPLE_Z * math.sqrt(nb_runs / (nb_runs - 1) * ((y - ratio * x) ** 2).sum()) / total_x
+    return ratio, ratio - half, ratio + half
+
+
+class SampleStats:
+    '''reads of a random sample of the file, each one with the run it was read in, and the estimates of the summary columns'''
+
+    #one value per read: run, FLAG, MAPQ, aligned length, indel, template weight (1/2 for a mate on the same chromosome, 0 if not primary)
+    COLUMNS = ("run", "flag", "mapq", "ref_length", "indel", "weight")
+
+    def __init__(self, header_parsed, MAPQ_threshold, short_size, long_size):
+        self.header_parsed = header_parsed
+        self.MAPQ_threshold = MAPQ_threshold
+        self.short_size = short_size
+        self.long_size = long_size
+        self.reads = {} #{chromosome: {column: [values]}}
+        self.run_lines = [] #lines read in each run
+        self.run_bytes = [] #bytes of the file taken by each run
+        self.templates = HyperLogLog() #distinct QNAME of the sampled reads
+        self.total_bytes = 0 #bytes of the file the runs were drawn in
+
+    def addRun(self, reads, nb_lines, nb_bytes):
+        run = len(self.run_lines)
+        self.run_lines.append(nb_lines)
+        self.run_bytes.append(nb_bytes)
+        for read in reads:
+            self.templates.add(read.qname)
+            columns = self.reads.setdefault(read.chromosome, {name: [] for name in self.COLUMNS})
+            cigar = decodeCigar(read.cigar)
+            if read.flag & 0x900:
+                weight = 0
+            elif read.flag & 1 and not read.flag & 8 and read.rnext in ("=", read.chromosome):
+                weight = 0.5
+            else:
+                weight = 1
+            for name, value in zip(self.COLUMNS, (run, read.flag, read.mapq, cigar.ref_length, int(cigar.indel >= 1), weight)):
+                columns[name].append(value)
+
+    def estimatedReads(self):
+        '''number of lines of the file (estimate, low, high)'''
+        estimate = ratioEstimate(np.array(self.run_lines, dtype=float), np.array(self.run_bytes, dtype=float))
+        return tuple(self.total_bytes * value for value in estimate)
+
+    def estimatedTemplates(self):
+        '''number of distinct templates (QNAME) of the file (estimate, low, high): the lines of the file divided by the mean lines per distinct QNAME of the sample
+        the mates are found in the same run only if they are next to each other in the file (not for a coordinate-sorted file, where it tends to the lines)'''
+        sampled = sum(self.run_lines)
+        if not sampled:
+            return 0.0, 0.0, 0.0
+        per_line = min(self.templates.count() / sampled, 1) #the sketch may count a little more than the lines
+        return tuple(value * per_line for value in self.estimatedReads())
+
+    def _perRun(self, runs, values):
+        return np.bincount(runs, weights=values, minlength=len(self.run_lines))
+
+    def table(self, groups=None):
+        '''columns and rows as summaryTable, each value given as "estimate [low-high]", groups {contig: row name} pools contigs in one row'''
+        columns = ["TOTAL", "MAP", "UMAP", "MAPQ-", "MAPQ+", "PAIR%", "RF%", f"<{self.short_size}BP%", "INT%", f">{self.long_size}BP%", "MEANL", "MINL", "MAXL", "INDEL%"]
+        run_bytes = np.array(self.run_bytes, dtype=float)
+        rows = {}
+
+        contigs = {}
+        for contig in contigOrder(self.header_parsed, self.reads):
+            contigs.setdefault(groups.get(contig, contig) if groups else contig, []).append(contig)
+
+        for chromosome, group in contigs.items():
+            sampled = [self.reads[contig] for contig in group if contig in self.reads]
+            values = {name: np.array([value for columns in sampled for value in columns[name]]) for name in self.COLUMNS}
+            runs, flag = values["run"].astype(int), values["flag"].astype(int)
+            ones = np.ones(len(runs))
+            count = self._perRun(runs, ones)
+
+            def total(selected):
+                '''number of reads of the file estimated from the selected reads of the sample'''
+                return [round(value * self.total_bytes) for value in ratioEstimate(self._perRun(runs, selected.astype(float)), run_bytes)]
+
+            def share(selected, among=count, scale=100):
+                return [round(scale * value, 2) for value in ratioEstimate(self._perRun(runs, selected.astype(float)), among)]
+
+            mapped = (flag & 4) == 0
+            above = values["mapq"] >= self.MAPQ_threshold
+            templates = self._perRun(runs, values["weight"].astype(float))
+            paired = ((flag & 0xC0) != 0) & ((flag & 0x3) == 0x3) & (values["weight"] == 0.5)
+            oriented = (((flag & 0x10) != 0) != ((flag & 0x20) != 0)) & (values["weight"] == 0.5)
+            short = values["ref_length"] <= self.short_size
+            long = values["ref_length"] >= self.long_size
+            intermediate = ~short & ~long
+
+            row = [total(ones), total(mapped), total(~mapped), total(~above), total(above),
+                   share(0.5 * paired, templates), share(0.5 * oriented, templates),
+                   share(short), share(intermediate), share(long),
+                   share(values["ref_length"].astype(float), scale=1),
+                   len(runs) and int(values["ref_length"].min()), len(runs) and int(values["ref_length"].max()),
+                   share(values["indel"], scale=1)]
+            cells = []
+            for column, value in zip(columns, row):
+                if isinstance(value, int): #observed in the sample, no interval
+                    cells.append(str(value))
+                else:
+                    estimate, low, high = value
+                    suffix = "%" if column.endswith("BP%") or column == "INT%" else ""
+                    cells.append(f"{estimate}{suffix} [{max(low, 0)}-{high}]")
+            rows[chromosome] = cells
+
+        return columns, rows
+
+
+def sampleStats(input_file, header_parsed, filterMAPQ, fullyMappedOnly, MAPQ_threshold, short_size, long_size, nb_reads, seed=0, run_length=SAMPLE_RUN, flag_filter=(0, 0)):
+    '''SampleStats of about nb_reads lines read in runs of run_length after random offsets of a plain or BGZF SAM file, ValueError for other files'''
+    file_format = fileFormat(input_file)
+    if file_format not in ("sam", "bgzf"):
+        raise ValueError(f"only plain and BGZF SAM files can be sampled, {file_format} files cannot be read at random offsets")
+
+    size = os.path.getsize(input_file)
+    start = body_offset(input_file) if file_format == "sam" else 0
+    rng = random.Random(seed)
+    nb_runs = max(1, -(-nb_reads // run_length))
+    offsets = sorted(rng.randrange(start, size) for i in range(nb_runs)) if size > start else [] #in file order, the disk reads forward
+
+    stats = SampleStats(header_parsed, MAPQ_threshold, short_size, long_size)
+    stats.total_bytes = size - start
+    runs = samSampleRuns(input_file, offsets, run_length) if file_format == "sam" else bgzfSampleRuns(input_file, offsets, run_length)
+    validation = Validation("off")
+    for lines, nb_bytes in runs:
+        lines = [line for line in lines if not line.startswith(b"@")]
+        stats.addRun(parse_lines(lines, filterMAPQ, fullyMappedOnly, validation, flag_filter=flag_filter), len(lines), nb_bytes)
+    return stats
+
 
-            #check if properly oriented (RF or FR but FF or RR are misoriented)
-            #bit 0x10 indicates R
-            if f1 & 0x10 and not f2 & 0x10:
-                properly_oriented += 1
-                    
-            elif f2 & 0x10 and not f1 & 0x10:
-                properly_oriented += 1
-            
+############### STREAMING ACCUMULATORS ###############
+#each statistic is an accumulator fed read by read with update(read) and combined with merge(other)
+#so that the whole file is analysed in a single pass with a memory bounded by chromosomes and windows
+
+MAX_PENDING_MATES = 2000000 #unresolved mates kept in memory before spilling them to temporary files
+SPILL_PARTITIONS = 64 #number of temporary files the unresolved mates are hashed into
+LENGTH_EXACT = 4096 #alignment lengths below it have one bin each
+LENGTH_SUBBINS = 64 #bins per power of 2 above LENGTH_EXACT, lengths are known within 1/64 of their value
+LENGTH_OCTAVES = 20 #powers of 2 above LENGTH_EXACT, longer alignments go to the last bin
+MANY_CONTIGS = 1000 #above this number of references (draft assemblies), the shorter ones are pooled in one "other" row of the summary
+OTHER_CONTIGS = "other"
+
+
+class FlagAccumulator:
+    '''percentage of properly paired reads and of properly oriented pairs per chromosome {chromosome: [pair%, oriented%]}
+
+    only the mates still waiting for their other end are kept: a pair is forgotten as soon as it is resolved, sorted files
+    (@HD SO: tag) let us also forget mates that can no longer be resolved, and above max_pending the unresolved mates are
+    spilled to hash-partitioned temporary files which are paired at the end'''
+
+    def __init__(self, header_parsed, sort_order=None, max_pending=MAX_PENDING_MATES):
+        self.header_parsed = header_parsed
+        self.pending = {} #{chromosome: {qname: flag}} mates waiting for the other end, made with the first read of the chromosome
+        self.counts = {} #{chromosome: [templates, properly paired, properly oriented]}
+        self.sort_order = sort_order
+        self.max_pending = max_pending
+        self.nb_pending = 0
+        self.spill_dir = None #temporary directory of the spilled mates
+        self.spill_files = None #partition files opened for appending by the first spill, closed before they are read or sent to another process
+
+        #queryname sorted: the mates of a template are consecutive
+        self.first_qname = None #first template seen, its mate may be at the end of the previous part of the file
+        self.last_qname = None
+        self.last_added = [] #[(chromosome, qname)] mates of last_qname still pending
+        self.spilled_qname = None #template being read during the last spill, its other end has to be kept
+
+        #coordinate sorted: a mate is at PNEXT, once we are past PNEXT it will not come anymore
+        self.expected = {} #{chromosome: heap of (PNEXT, qname)}
+        self.first_pos = {} #{chromosome: first position seen}, mates before it may be in the previous part of the file
+        self.last_pos = {} #{chromosome: last position seen}
+
+    def __getstate__(self):
+        self._closeSpill()
+        return self.__dict__
+
+    def __setstate__(self, state):
+        '''accumulator sent back by a worker process: the temporary files are now ours to delete'''
+        self.__dict__.update(state)
+        if self.spill_dir is not None:
+            atexit.register(shutil.rmtree, self.spill_dir, True)
+
+    def _add(self, chromosome):
+        if chromosome not in self.counts:
+            self.pending[chromosome] = {}
+            self.counts[chromosome] = [0, 0, 0]
+
+    def _resolve(self, chromosome, f1, f2):
+        '''count a template once both of its ends have been seen'''
+        counts = self.counts[chromosome]
+
+        #check if properly paired (bit 0x40 et 0x80 in either f1 or f2 and 0x2 in both) 
+        if ((f1 & 0x80 and f2 & 0x40) or (f2 & 0x80 and f1 & 0x40)) and f1 & 0x2 and f2 & 0x2:
+            counts[1] += 1
+
+        #check if properly oriented (RF or FR but FF or RR are misoriented)
+        #bit 0x10 indicates R
+        if (f1 & 0x10) != (f2 & 0x10):
+            counts[2] += 1
+
+    def _pend(self, chromosome, qname, flag):
+        '''keep a mate until its other end is seen, both ends already counted as a template are resolved'''
+        pending = self.pending[chromosome]
+        if qname in pending: #both ends were seen in different parts of the file, template counted twice
+            self._resolve(chromosome, pending.pop(qname), flag)
+            self.counts[chromosome][0] -= 1
+            self.nb_pending -= 1
+        else:
+            pending[qname] = flag
+            self.nb_pending += 1
+            if self.nb_pending > self.max_pending:
+                self._spill()
+
+    def _forget(self, chromosome, qname):
+        '''drop a mate whose other end will not come (the template stays counted as unpaired)'''
+        if self.pending[chromosome].pop(qname, None) is not None:
+            self.nb_pending -= 1
+
+    def _partitions(self, mode):
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="samreader_mates_")
+            atexit.register(shutil.rmtree, self.spill_dir, True)
+        return [open(os.path.join(self.spill_dir, f"mates_{i}.txt"), mode) for i in range(SPILL_PARTITIONS)]
+
+    def _closeSpill(self):
+        '''close the partition files so that they can be read (they are opened again by the next spill)'''
+        if self.spill_files is not None:
+            for file in self.spill_files:
+                file.close()
+            self.spill_files = None
+
+    def _spill(self):
+        '''move all the unresolved mates to the temporary files'''
+        if self.spill_files is None:
+            self.spill_files = self._partitions("a")
+        files = self.spill_files
+        for chromosome, pending in self.pending.items():
+            for qname, flag in pending.items():
+                files[partition(qname)].write(f"{chromosome}\t{qname}\t{flag}\n")
+            pending.clear()
+        self.nb_pending = 0
+
+        #what the sorted fast path expected refers to spilled mates now, the other ends must wait for the end of the file
+        self.expected = {}
+        self.spilled_qname = self.last_qname
+
+    def _sortedFastPath(self, read):
+        '''for sorted files: False if the read can be counted as unpaired right away, True if it has to wait for its mate'''
+        chromosome = read.chromosome
+
+        if self.sort_order == "queryname":
+            if read.qname != self.last_qname: #the previous template is complete, its missing mates will not come
+                for chrom, qname in self.last_added:
+                    if qname != self.first_qname and qname != self.spilled_qname:
+                        self._forget(chrom, qname)
+                self.last_added = []
+                self.last_qname = read.qname
+                if self.first_qname is None:
+                    self.first_qname = read.qname
+            self.last_added.append((chromosome, read.qname))
+
+        elif self.sort_order == "coordinate":
+            if read.pos < self.last_pos.get(chromosome, read.pos): #the file is not really sorted
+                print("Warning: the file is not sorted by coordinate as stated in its header, sorted fast path disabled.")
+                self.sort_order = None
+                return True
+            self.last_pos[chromosome] = read.pos
+            first_pos = self.first_pos.setdefault(chromosome, read.pos)
+
+            #mates expected before the current position will not come anymore
+            expected = self.expected.setdefault(chromosome, [])
+            while expected and expected[0][0] < read.pos:
+                self._forget(chromosome, heapq.heappop(expected)[1])
+
+            if read.rnext in ("=", chromosome):
+                if read.pnext <= first_pos: #mate in the previous part of the file (or at the same position just before it)
+                    return True
+                if read.pnext < read.pos: #mate already passed: filtered out, or spilled and paired at the end
+                    return self.spill_dir is not None
+                if read.pnext == read.pos and self.spill_dir is not None: #mate at the same position, it may have been spilled just before
+                    return True
+                heapq.heappush(expected, (read.pnext, read.qname))
+
+        return True
+
+    def update(self, read):
+        self._add(read.chromosome)
+        if read.flag & 0x900: #secondary and supplementary alignments are not mates
+            return
+        pending = self.pending[read.chromosome]
+
+        if read.qname in pending: #second end of the template: the pair is resolved and forgotten
+            self._resolve(read.chromosome, pending.pop(read.qname), read.flag)
+            self.nb_pending -= 1
+            return
+
+        self.counts[read.chromosome][0] += 1
+
+        if not read.flag & 1 or read.rnext == "*": #single end read, or mate without a reference: no other end will come
+            return
+        if read.rnext not in ("=", read.chromosome): #mate on another reference, it will never be paired on this one
+            return
+
+        if self.sort_order is not None and not self._sortedFastPath(read):
+            return
+
+        pending[read.qname] = read.flag
+        self.nb_pending += 1
+        if self.nb_pending > self.max_pending:
+            self._spill()
+
+    def merge(self, other):
+        for chromosome in other.counts:
+            self._add(chromosome)
+            counts = self.counts[chromosome]
+            for i, value in enumerate(other.counts[chromosome]):
+                counts[i] += value
+
+            for qname, flag in other.pending[chromosome].items():
+                self._pend(chromosome, qname, flag)
+
+        if other.spill_dir is not None: #the spilled mates of the other part are moved to our own files
+            other._closeSpill()
+            if self.spill_files is None:
+                self.spill_files = self._partitions("a")
+            for i, other_file in enumerate(other._partitions("r")):
+                shutil.copyfileobj(other_file, self.spill_files[i])
+                other_file.close()
+            shutil.rmtree(other.spill_dir, True)
+
+    def _spilledCounts(self):
+        '''counts once the spilled mates are paired, one partition at a time'''
+        counts = {chromosome: list(values) for chromosome, values in self.counts.items()}
+        if self.spill_dir is None:
+            return counts
+        self._closeSpill()
+
+        in_memory = [[] for i in range(SPILL_PARTITIONS)]
+        for chromosome, pending in self.pending.items():
+            for qname, flag in pending.items():
+                in_memory[partition(qname)].append((chromosome, qname, flag))
+
+        saved_counts = self.counts
+        self.counts = counts #_resolve() writes in self.counts
+        for i, file in enumerate(self._partitions("r")):
+            mates = {}
+            entries = ((chromosome, qname, int(flag)) for chromosome, qname, flag in (line.rstrip("\n").split("\t") for line in file))
+            for chromosome, qname, flag in itertools.chain(entries, in_memory[i]):
+                if (chromosome, qname) in mates:
+                    self._resolve(chromosome, mates.pop((chromosome, qname)), flag)
+                    counts[chromosome][0] -= 1
+                else:
+                    mates[(chromosome, qname)] = flag
+            file.close()
+        self.counts = saved_counts
+
+        return counts
+
+    def state(self):
+        '''counts of templates once the mates are paired, enough to give the result again'''
+        return self._spilledCounts()
+
+    @classmethod
+    def fromState(cls, header_parsed, state):
+        accumulator = cls(header_parsed)
+        accumulator.counts = state
+        accumulator.pending = {chromosome: {} for chromosome in state}
+        return accumulator
+
+    def result(self, groups=None):
+        '''groups {contig: row name} pools the templates of several contigs in one row'''
+        counts = self._spilledCounts()
+        paired_orientation = {}
+        for chromosome, (total, properly_paired, properly_oriented) in pooledRows(contigOrder(self.header_parsed, counts), lambda contig: counts.get(contig, [0, 0, 0]), groups).items():
+            if total == 0: #case chromosome has no reads
+                paired_orientation[chromosome] = [0.0, 0.0]
+                continue
             perc_properly_paired = round(100*properly_paired / total, 2)
             perc_properly_oriented = round(100*properly_oriented / total, 2)
             paired_orientation[chromosome] = [perc_properly_paired, perc_properly_oriented]
-        
+        return paired_orientation
+
+
+def partition(qname):
+    '''temporary file of a spilled mate, the same in every process'''
+    return zlib.crc32(qname.encode()) % SPILL_PARTITIONS
+
+
+def contigOrder(header_parsed, seen):
+    '''contigs of the header in their order, then the other ones seen in the reads (unmapped "*" or missing from the header)'''
+    return list(header_parsed) + [contig for contig in seen if contig not in header_parsed]
+
+
+def pooledRows(contigs, values, groups=None):
+    '''{row name: counters} of the contigs, values(contig) gives the list of counters of a contig and groups {contig: row name}
+    sums the counters of the contigs of a group in a single row'''
+    rows = {}
+    for contig in contigs:
+        name = groups.get(contig, contig) if groups else contig
+        counters = values(contig)
+        rows[name] = [a + b for a, b in zip(rows[name], counters)] if name in rows else list(counters)
+    return rows
+
+
+class ContigCounts:
+    '''integer counters of the contigs as an array of structs: a contig gets an integer id with its first read and its nb_fields counters
+    are values[id * nb_fields:(id + 1) * nb_fields], contigs without reads take no memory'''
+
+    def __init__(self, nb_fields):
+        self.nb_fields = nb_fields
+        self.ids = {} #{contig: id}
+        self.names = [] #contig of each id
+        self.values = array("q")
+
+    def offset(self, contig):
+        '''index of the first counter of the contig, its counters are created with its first read'''
+        index = self.ids.get(contig)
+        if index is None:
+            index = self.ids[contig] = len(self.names)
+            self.names.append(contig)
+            self.values.extend([0] * self.nb_fields)
+        return index * self.nb_fields
+
+    def get(self, contig):
+        index = self.ids.get(contig)
+        if index is None:
+            return [0] * self.nb_fields
+        return self.values[index * self.nb_fields:(index + 1) * self.nb_fields].tolist()
+
+    def merge(self, other):
+        rows = np.array([self.offset(contig) // self.nb_fields for contig in other.names], dtype=np.int64) #new contigs first, the array cannot grow under a view
+        if len(rows):
+            arrayView(self.values).reshape(-1, self.nb_fields)[rows] += arrayView(other.values).reshape(-1, self.nb_fields)
+
+    def rows(self, header_parsed, groups=None):
+        '''{contig or group: [counters]} of every contig of the header and of the reads'''
+        return pooledRows(contigOrder(header_parsed, self.names), self.get, groups)
+
+    def state(self):
+        return {"names": self.names, "values": self.values.tolist()}
+
+    @classmethod
+    def fromState(cls, nb_fields, state):
+        counts = cls(nb_fields)
+        counts.names = list(state["names"])
+        counts.ids = {contig: index for index, contig in enumerate(counts.names)}
+        counts.values = array("q", state["values"])
+        return counts
+
+
+class ContigAccumulator:
+    '''accumulator of NB_FIELDS integer counters per contig (ContigCounts)'''
+    NB_FIELDS = 2
+
+    def __init__(self, header_parsed):
+        self.header_parsed = header_parsed
+        self.counts = ContigCounts(self.NB_FIELDS)
+
+    def merge(self, other):
+        self.counts.merge(other.counts)
+
+    def state(self):
+        return self.counts.state()
+
+    @classmethod
+    def fromState(cls, header_parsed, state, *args):
+        accumulator = cls(header_parsed, *args)
+        accumulator.counts = ContigCounts.fromState(cls.NB_FIELDS, state)
+        return accumulator
+
+
+class ChromAccumulator(ContigAccumulator):
+    '''count the number of mapped and unmapped reads per chromosome {chromosome: [mapped, unmapped]}'''
+
+    def update(self, read):
+        # check if the read is mapped, if the flag has the bit 4 it means it is unmapped
+        #counters are [mapped, unmapped]
+        self.counts.values[self.counts.offset(read.chromosome) + (read.flag & 4 != 0)] += 1
+
+    def result(self, groups=None):
+        return self.counts.rows(self.header_parsed, groups)
+
+
+class MAPQAccumulator(ContigAccumulator):
+    '''count the number of reads per MAPQ {chromosome: [MAPQ above threshold, MAPQ below threshold]}'''
+
+    def __init__(self, header_parsed, MAPQ_threshold):
+        super().__init__(header_parsed)
+        self.MAPQ_threshold = MAPQ_threshold
+
+    def update(self, read):
+        self.counts.values[self.counts.offset(read.chromosome) + (read.mapq < self.MAPQ_threshold)] += 1
+
+    def result(self, groups=None):
+        return self.counts.rows(self.header_parsed, groups)
+
+
+class LengthHistogram:
+    '''alignment lengths of one chromosome in a fixed number of bins: one per length below LENGTH_EXACT, then LENGTH_SUBBINS per power of 2
+    the sum, minimum and maximum are kept exactly'''
+
+    SHIFT = LENGTH_EXACT.bit_length() - 1
+    SUBBITS = LENGTH_SUBBINS.bit_length() - 1
+    NB_BINS = LENGTH_EXACT + LENGTH_OCTAVES * LENGTH_SUBBINS
+
+    def __init__(self):
+        self.counts = zeros("q", self.NB_BINS)
+        self.length_sum = 0
+        self.total = 0
+        self.min_len = None
+        self.max_len = None
+
+    @classmethod
+    def bin(cls, length):
+        if length < LENGTH_EXACT:
+            return length
+        octave = length.bit_length() - 1
+        index = LENGTH_EXACT + (octave - cls.SHIFT) * LENGTH_SUBBINS + ((length >> (octave - cls.SUBBITS)) & (LENGTH_SUBBINS - 1))
+        return min(index, cls.NB_BINS - 1)
+
+    @classmethod
+    def bins(cls, lengths):
+        '''bin of each length of a numpy array'''
+        lengths = lengths.astype(np.int64)
+        octaves = np.maximum(np.floor(np.log2(np.maximum(lengths, 1))).astype(np.int64), cls.SHIFT)
+        logbins = LENGTH_EXACT + (octaves - cls.SHIFT) * LENGTH_SUBBINS + ((lengths >> (octaves - cls.SUBBITS)) & (LENGTH_SUBBINS - 1))
+        return np.where(lengths < LENGTH_EXACT, lengths, np.minimum(logbins, cls.NB_BINS - 1))
+
+    @classmethod
+    def edges(cls):
+        '''lowest length of each bin and of the next one (numpy arrays)'''
+        octaves = np.repeat(np.arange(LENGTH_OCTAVES), LENGTH_SUBBINS) + cls.SHIFT
+        subbins = np.tile(np.arange(LENGTH_SUBBINS), LENGTH_OCTAVES)
+        low = np.concatenate((np.arange(LENGTH_EXACT), (1 << octaves) + (subbins << (octaves - cls.SUBBITS)))).astype(np.float64)
+        return low, np.append(low[1:], 2.0 * low[-1] - low[-2])
+
+    def add(self, length):
+        self.counts[self.bin(length)] += 1
+        self.length_sum += length
+        self.total += 1
+        if self.min_len is None or length < self.min_len:
+            self.min_len = length
+        if self.max_len is None or length > self.max_len:
+            self.max_len = length
+
+    def merge(self, other):
+        arrayView(self.counts)[:] += arrayView(other.counts)
+        self.length_sum += other.length_sum
+        self.total += other.total
+        if other.min_len is not None and (self.min_len is None or other.min_len < self.min_len):
+            self.min_len = other.min_len
+        if other.max_len is not None and (self.max_len is None or other.max_len > self.max_len):
+            self.max_len = other.max_len
+
+    def _bounds(self):
+        '''counts and [low, high[ of each bin, narrowed to the minimum and maximum lengths seen'''
+        low, high = self.edges()
+        return arrayView(self.counts).astype(np.float64), np.clip(low, self.min_len, self.max_len + 1), np.clip(high, self.min_len, self.max_len + 1)
+
+    def countBelow(self, size):
+        '''number of alignments of length <= size, exact below LENGTH_EXACT and interpolated in the bin of size above'''
+        if self.total == 0 or size < self.min_len:
+            return 0
+        if size >= self.max_len:
+            return self.total
+        counts, low, high = self._bounds()
+        index = self.bin(size)
+        inside = counts[index] * (size + 1 - low[index]) / max(high[index] - low[index], 1)
+        return int(counts[:index].sum() + round(min(inside, counts[index])))
+
+    def _quantile(self, weights, fraction):
+        '''length at which the cumulated weights of the bins reach fraction of their total, linear inside a bin'''
+        counts, low, high = self._bounds()
+        cumulated = np.cumsum(weights)
+        target = fraction * cumulated[-1]
+        index = min(int(np.searchsorted(cumulated, target)), len(counts) - 1)
+        before = cumulated[index - 1] if index else 0.0
+        inside = (target - before) / weights[index] if weights[index] else 0.0
+        if high[index] - low[index] <= 1: #exact length
+            return int(low[index])
+        return int(round(low[index] + inside * (high[index] - 1 - low[index])))
+
+    def percentile(self, percent):
+        '''length below or equal to which percent % of the alignments are'''
+        if self.total == 0:
+            return 0
+        return self._quantile(arrayView(self.counts).astype(np.float64), percent / 100)
+
+    def nx(self, percent=50):
+        '''N50 style length: the alignments at least this long hold percent % of the aligned bases'''
+        if self.total == 0:
+            return 0
+        counts, low, high = self._bounds()
+        return self._quantile(counts * (low + high - 1) / 2, 1 - percent / 100)
+
+    def state(self):
+        '''content as JSON values, only the bins with alignments'''
+        counts = arrayView(self.counts)
+        bins = np.flatnonzero(counts)
+        return {"bins": bins.tolist(), "counts": counts[bins].tolist(), "sum": self.length_sum, "total": self.total, "min": self.min_len, "max": self.max_len}
+
+    @classmethod
+    def fromState(cls, state):
+        histogram = cls()
+        arrayView(histogram.counts)[state["bins"]] = state["counts"]
+        histogram.length_sum, histogram.total, histogram.min_len, histogram.max_len = state["sum"], state["total"], state["min"], state["max"]
+        return histogram
+
+
+class AlignmentAccumulator:
+    '''histogram of the alignment lengths of each chromosome, the statistics are given for any short and long sizes
+    {chromosome: (short, long, mean, total, min, max)}'''
+
+    def __init__(self, header_parsed, short_size=None, large_size=None):
+        self.header_parsed = header_parsed
+        self.short_size = short_size
+        self.large_size = large_size
+        self.lengths = {} #{chromosome: LengthHistogram}, made with the first read of the chromosome
+
+    def _histogram(self, chromosome):
+        histogram = self.lengths.get(chromosome)
+        if histogram is None:
+            histogram = self.lengths[chromosome] = LengthHistogram()
+        return histogram
+
+    def update(self, read):
+        self._histogram(read.chromosome).add(decodeCigar(read.cigar).ref_length)
+
+    def merge(self, other):
+        for chromosome, histogram in other.lengths.items():
+            self._histogram(chromosome).merge(histogram)
+
+    def histograms(self, groups=None):
+        '''{chromosome: LengthHistogram or None without reads} of the chromosomes of the header and of the reads
+        groups {contig: row name} merges the histograms of several contigs in one row'''
+        histograms = {}
+        for chromosome in contigOrder(self.header_parsed, self.lengths):
+            histogram = self.lengths.get(chromosome)
+            name = groups.get(chromosome) if groups else None
+            if name is None:
+                histograms[chromosome] = histogram
+                continue
+            if histograms.get(name) is None:
+                histograms[name] = LengthHistogram() if histogram is not None else None
+            if histogram is not None:
+                histograms[name].merge(histogram)
+        return histograms
+
+    def result(self, short_size=None, large_size=None, groups=None):
+        short_size = short_size if short_size is not None else self.short_size
+        large_size = large_size if large_size is not None else self.large_size
+        stats = {}
+        for chromosome, histogram in self.histograms(groups).items():
+            if histogram is None or histogram.total == 0: #case chromosome has no reads
+                stats[chromosome] = (0, 0, 0, 0, 0, 0)
+                continue
+            under = histogram.countBelow(short_size)
+            over = histogram.total - histogram.countBelow(large_size - 1)
+            stats[chromosome] = (under, over, round(histogram.length_sum / histogram.total, 3), histogram.total, histogram.min_len, histogram.max_len)
+        return stats
+
+    def lengthTable(self, percentiles, groups=None):
+        '''median, N50 and percentile lengths of each chromosome ([column names], {chromosome: [values]})'''
+        columns = ["TOTAL", "MEDIAN", "N50"] + [f"P{percent:g}" for percent in percentiles]
+        rows = {}
+        empty = LengthHistogram()
+        for chromosome, histogram in self.histograms(groups).items():
+            histogram = histogram or empty
+            rows[chromosome] = [histogram.total, histogram.percentile(50), histogram.nx(50)] + [histogram.percentile(percent) for percent in percentiles]
+        return columns, rows
+
+    def state(self):
+        return {chromosome: histogram.state() for chromosome, histogram in self.lengths.items()}
+
+    @classmethod
+    def fromState(cls, header_parsed, state):
+        accumulator = cls(header_parsed)
+        accumulator.lengths = {chromosome: LengthHistogram.fromState(histogram) for chromosome, histogram in state.items()}
+        return accumulator
+
+
+class IndelAccumulator(ContigAccumulator):
+    '''percentage of reads w/ at least one indel {chromosome: ratio}'''
+
+    def update(self, read):
+        offset = self.counts.offset(read.chromosome) #counters are [total, at least one indel]
+        self.counts.values[offset] += 1
+        if decodeCigar(read.cigar).indel >= 1:
+            self.counts.values[offset + 1] += 1
+
+    def result(self, groups=None):
+        indel_dict = {}
+        for chromosome, (total, atLeastOne) in self.counts.rows(self.header_parsed, groups).items():
+            indel_dict[chromosome] = round(atLeastOne / total, 2) if total else 0.0
+        return indel_dict
+
+
+def arrayView(values):
+    '''numpy view (no copy) of a typed array'''
+    return np.frombuffer(values, dtype=ARRAY_DTYPES[values.typecode])
+
+
+def zeros(typecode, length, value=0):
+    '''typed array of the given length filled with value'''
+    values = array(typecode, bytes(array(typecode).itemsize * length))
+    if value:
+        arrayView(values)[:] = value
+    return values
+
+
+class WindowAccumulator:
+    '''coverage and MAPQ per window on each reference, arrays are only created for chromosomes receiving reads'''
+
+    def __init__(self, header_parsed, window_size, MAPQ_threshold, per_base=False, mapq_extras=False):
+        self.header_parsed = header_parsed
+        self.window_size = window_size
+        self.MAPQ_threshold = MAPQ_threshold
+        self.per_base = per_base
+        self.mapq_extras = mapq_extras
+        #coverage and MAPQ are kept as difference arrays so that each read costs O(1) whatever the number of windows it spans
+        self.partial_bp = {} #{chromosome: [bp added to the first and last window of the reads]}
+        self.full_diff = {} #{chromosome: [difference array of the number of reads covering the whole window]}
+        self.depth_diff = {} #{chromosome: [difference array of the depth per base]} only with per_base
+        self.mapq_sum_diff = {} #{chromosome: [difference array of the sum of MAPQ per window]}
+        self.mapq_count_diff = {} #{chromosome: [difference array of the number of MAPQ per window]}
+        #only with mapq_extras
+        self.reads_diff = {} #{chromosome: [difference array of the number of reads per window, whatever their MAPQ]}
+        self.mapq0_diff = {} #{chromosome: [difference array of the number of reads with MAPQ 0 per window]}
+        self.mapq_min = {} #{chromosome: segment tree of the minimum MAPQ per window}
+        self.mapq_max = {} #{chromosome: segment tree of the maximum MAPQ per window}
+
+    #how each array is combined in merge()
+    MERGE = {"partial_bp": np.add, "full_diff": np.add, "depth_diff": np.add, "mapq_sum_diff": np.add, "mapq_count_diff": np.add,
+             "reads_diff": np.add, "mapq0_diff": np.add, "mapq_min": np.minimum, "mapq_max": np.maximum}
+
+    def _windows(self, chromosome):
+        if chromosome not in self.partial_bp:
+            nb_windows = (self.header_parsed[chromosome] // self.window_size) + 1 # calculate the number of windows needed to cover the reference
+            self.partial_bp[chromosome] = zeros("q", nb_windows)
+            self.full_diff[chromosome] = zeros("q", nb_windows + 1)
+            self.mapq_sum_diff[chromosome] = zeros("q", nb_windows + 1)
+            self.mapq_count_diff[chromosome] = zeros("q", nb_windows + 1)
+            if self.per_base:
+                self.depth_diff[chromosome] = zeros("i", self.header_parsed[chromosome] + 2)
+            if self.mapq_extras:
+                tree_size = 1 << (nb_windows - 1).bit_length()
+                self.reads_diff[chromosome] = zeros("q", nb_windows + 1)
+                self.mapq0_diff[chromosome] = zeros("q", nb_windows + 1)
+                self.mapq_min[chromosome] = zeros("B", 2 * tree_size, 255)
+                self.mapq_max[chromosome] = zeros("B", 2 * tree_size)
+        return self.partial_bp[chromosome], self.full_diff[chromosome]
+
+    def addInterval(self, chromosome, start, end, mapq):
+        '''add a read covering [start, end] on the reference'''
+        window_size = self.window_size
+        partial, full = self._windows(chromosome)
+
+        end = min(end, self.header_parsed[chromosome]) #reads overhanging the end of the reference
+        if end < start: #nothing consumed on the reference
+            return
+
+        #the first and last windows get the number of bp covered, the windows in between are fully covered
+        first_window = start // window_size
+        last_window = end // window_size
+        if first_window == last_window:
+            partial[first_window] += end - start + 1
+        else:
+            partial[first_window] += (first_window + 1) * window_size - start
+            partial[last_window] += end - last_window * window_size + 1
+            full[first_window + 1] += 1
+            full[last_window] -= 1
+
+        if self.per_base:
+            depth = self.depth_diff[chromosome]
+            depth[start] += 1
+            depth[end + 1] -= 1
+
+        if self.mapq_extras:
+            self.reads_diff[chromosome][first_window] += 1
+            self.reads_diff[chromosome][last_window + 1] -= 1
+            if mapq == 0:
+                self.mapq0_diff[chromosome][first_window] += 1
+                self.mapq0_diff[chromosome][last_window + 1] -= 1
+
+        if mapq < self.MAPQ_threshold: #skip mapq values below threshold
+            return
+
+        #every window from first to last receives the MAPQ of the read
+        mapq_sum, mapq_count = self.mapq_sum_diff[chromosome], self.mapq_count_diff[chromosome]
+        mapq_sum[first_window] += mapq
+        mapq_sum[last_window + 1] -= mapq
+        mapq_count[first_window] += 1
+        mapq_count[last_window + 1] -= 1
+
+        if self.mapq_extras:
+            self._rangeMinMax(chromosome, first_window, last_window, mapq)
+
+    def _rangeMinMax(self, chromosome, first_window, last_window, mapq):
+        '''tag the O(log windows) nodes of the segment trees covering [first_window, last_window], pushed down in minMaxMAPQ()'''
+        tree_min, tree_max = self.mapq_min[chromosome], self.mapq_max[chromosome]
+        lo = first_window + len(tree_min) // 2
+        hi = last_window + len(tree_min) // 2 + 1
+        while lo < hi:
+            if lo & 1:
+                if mapq < tree_min[lo]: tree_min[lo] = mapq
+                if mapq > tree_max[lo]: tree_max[lo] = mapq
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                if mapq < tree_min[hi]: tree_min[hi] = mapq
+                if mapq > tree_max[hi]: tree_max[hi] = mapq
+            lo >>= 1
+            hi >>= 1
+
+    def update(self, read):
+        if read.flag & 4 or read.chromosome not in self.header_parsed: # only mapped reads on known references (skip chromosome '*')
+            return
+
+        #calculate the position of the read on the reference
+        start = read.pos
+        end = start + decodeCigar(read.cigar).ref_length - 1
+        self.addInterval(read.chromosome, start, end, read.mapq)
+
+    def merge(self, other):
+        for chromosome in other.partial_bp:
+            self._windows(chromosome)
+            for name, combine in self.MERGE.items():
+                mine, theirs = getattr(self, name), getattr(other, name)
+                if chromosome in theirs:
+                    view = arrayView(mine[chromosome])
+                    combine(view, arrayView(theirs[chromosome]), out=view)
+
+    def _prefixSum(self, diff):
+        return np.cumsum(arrayView(diff)[:-1])
+
+    def coverageBp(self, chromosome):
+        '''number of bp covered per window (prefix sum of the difference array)'''
+        return arrayView(self.partial_bp[chromosome]) + self.window_size * self._prefixSum(self.full_diff[chromosome])
+
+    def chromCoverage(self, chromosome):
+        '''number of reads per window of one chromosome, empty if it has no reads'''
+        if chromosome not in self.partial_bp:
+            return []
+        return [round(c / self.window_size, 3) for c in self.coverageBp(chromosome).tolist()]
+
+    def coverage(self):
+        '''number of reads per window {chromosome: [reads per window]}'''
+        return {chrom: self.chromCoverage(chrom) for chrom in self.partial_bp}
+
+    def depth(self, chromosome):
+        '''depth of each base of the chromosome as an int32 array (index is the position on the reference), only with per_base'''
+        return np.cumsum(arrayView(self.depth_diff[chromosome])[:-1], dtype=np.int32)
+
+    def chromMeanMAPQ(self, chromosome):
+        '''mean MAPQ per window of one chromosome'''
+        sums = self._prefixSum(self.mapq_sum_diff[chromosome]).tolist()
+        counts = self._prefixSum(self.mapq_count_diff[chromosome]).tolist()
+        return [round(s / c, 3) if c else 0.0 for s, c in zip(sums, counts)]
+
+    def meanMAPQ(self):
+        '''mean MAPQ per window {chromosome: [mean MAPQ per window]}'''
+        return {chrom: self.chromMeanMAPQ(chrom) for chrom in self.mapq_sum_diff}
+
+    def minMaxMAPQ(self):
+        '''minimum and maximum MAPQ per window {chromosome: ([min per window], [max per window])}, only with mapq_extras'''
+        min_max = {}
+        for chrom in self.mapq_min:
+            nb_windows = len(self.partial_bp[chrom])
+            counts = self._prefixSum(self.mapq_count_diff[chrom])
+            trees = []
+
+            for tree, push in ((arrayView(self.mapq_min[chrom]).copy(), np.minimum), (arrayView(self.mapq_max[chrom]).copy(), np.maximum)):
+                #push the tags from the root to the leaves, one level at a time
+                level = 1
+                while 2 * level < len(tree):
+                    children = tree[2 * level:4 * level]
+                    push(children, np.repeat(tree[level:2 * level], 2), out=children)
+                    level *= 2
+                leaves = tree[len(tree) // 2:len(tree) // 2 + nb_windows]
+                trees.append(np.where(counts > 0, leaves, 0).tolist()) #windows without reads are set to 0
+
+            min_max[chrom] = tuple(trees)
+        return min_max
+
+    def fractionMAPQ0(self):
+        '''fraction of the reads with MAPQ 0 per window {chromosome: [fraction per window]}, only with mapq_extras'''
+        fraction = {}
+        for chrom in self.mapq0_diff:
+            mapq0 = self._prefixSum(self.mapq0_diff[chrom]).tolist()
+            reads = self._prefixSum(self.reads_diff[chrom]).tolist()
+            fraction[chrom] = [round(z / r, 3) if r else 0.0 for z, r in zip(mapq0, reads)]
+        return fraction
+
+
+class BinAccumulator:
+    '''bp covered per bin of bin_size bp and MAPQ sum/count of the reads starting and ending in each bin
+    it is the finest level of the coverage cache: coverage and mean MAPQ of any window size multiple of bin_size are computed from it'''
+
+    ARRAYS = ("partial_bp", "full_diff", "start_sum", "start_count", "end_sum", "end_count")
+
+    def __init__(self, header_parsed, bin_size, MAPQ_threshold):
+        self.header_parsed = header_parsed
+        self.bin_size = bin_size
+        self.MAPQ_threshold = MAPQ_threshold
+        self.arrays = {} #{chromosome: {array name: array}} only for chromosomes receiving reads
+
+    def _bins(self, chromosome):
+        if chromosome not in self.arrays:
+            nb_bins = self.header_parsed[chromosome] // self.bin_size + 1
+            self.arrays[chromosome] = {name: zeros("q", nb_bins + 1) for name in self.ARRAYS}
+        return self.arrays[chromosome]
+
+    def update(self, read):
+        if read.flag & 4 or read.chromosome not in self.header_parsed: #same reads as WindowAccumulator
+            return
+
+        arrays = self._bins(read.chromosome)
+        start = read.pos
+        end = min(start + decodeCigar(read.cigar).ref_length - 1, self.header_parsed[read.chromosome])
+        if end < start:
+            return
+
+        bin_size = self.bin_size
+        first_bin, last_bin = start // bin_size, end // bin_size
+        if first_bin == last_bin:
+            arrays["partial_bp"][first_bin] += end - start + 1
+        else:
+            arrays["partial_bp"][first_bin] += (first_bin + 1) * bin_size - start
+            arrays["partial_bp"][last_bin] += end - last_bin * bin_size + 1
+            arrays["full_diff"][first_bin + 1] += 1
+            arrays["full_diff"][last_bin] -= 1
+
+        if read.mapq < self.MAPQ_threshold:
+            return
+
+        #a window overlaps the reads starting before its end minus the reads ending before its start
+        arrays["start_sum"][first_bin] += read.mapq
+        arrays["start_count"][first_bin] += 1
+        arrays["end_sum"][last_bin] += read.mapq
+        arrays["end_count"][last_bin] += 1
+
+    def merge(self, other):
+        for chromosome, theirs in other.arrays.items():
+            mine = self._bins(chromosome)
+            for name in self.ARRAYS:
+                view = arrayView(mine[name])
+                np.add(view, arrayView(theirs[name]), out=view)
+
+    def result(self):
+        '''bp covered and MAPQ sums/counts per bin {chromosome: {"bp", "start_sum", "start_count", "end_sum", "end_count": numpy array}}'''
+        bins = {}
+        for chromosome, arrays in self.arrays.items():
+            bp = arrayView(arrays["partial_bp"])[:-1] + self.bin_size * np.cumsum(arrayView(arrays["full_diff"])[:-1])
+            bins[chromosome] = {"bp": bp, **{name: arrayView(arrays[name])[:-1].copy() for name in self.ARRAYS[2:]}}
+        return bins
+
+
+#base quality and composition (--qc): SEQ and QUAL of the reads are copied end to end in batches handled as numpy uint8 buffers,
+#the cycle of each base and the read it belongs to are computed from the read lengths, so reads of any length are handled together
+QUAL_LEVELS = 94 #Phred+33 qualities 0 to 93 (characters ! to ~)
+QC_BATCH_BYTES = 1 << 20 #bases handled together
+QC_MAX_CYCLES = 1000 #statistics per cycle for the first cycles only (long reads), all the bases count in the other statistics
+QC_CYCLE_PERCENTILES = (10, 25, 50, 75, 90)
+
+
+
+def readCycles(lengths, starts, nb_cycles):
+    '''cycle and offset of the first nb_cycles bases of each read of a batch whose bases are end to end'''
+    kept = np.minimum(lengths, nb_cycles)
+    cycles = np.arange(kept.sum(), dtype=np.int64) - np.repeat(np.cumsum(kept) - kept, kept)
+    return cycles, cycles + np.repeat(starts, kept)
+
+
+class QCAccumulator:
+    '''per cycle base quality and N content, GC and N content and mean quality of each read, GC and N content per window
+    each read is counted once (secondary and supplementary alignments are skipped), reverse strand reads are turned back to the sequencing order,
+    the bases of a mapped read go to the window of its first position'''
+
+    def __init__(self, header_parsed, window_size):
+        self.header_parsed = header_parsed
+        self.window_size = window_size
+        self._newBatch()
+        self.ids = {} #{chromosome: id} of the contigs with reads
+        self.names = [] #chromosome of each id
+        self.windows = {} #{chromosome: array [GC bases, A/C/G/T bases, N bases] x windows}
+        self.reads = 0
+        self.qual_reads = 0 #reads with a QUAL
+        self.cycle_reads = np.zeros(0, dtype=np.int64) #reads long enough to have each cycle
+        self.cycle_n = np.zeros(0, dtype=np.int64)
+        self.cycle_qual_hist = np.zeros((0, QUAL_LEVELS), dtype=np.int64) #bases of each quality at each cycle
+        self.gc_hist = np.zeros(101, dtype=np.int64) #reads per GC% of their A/C/G/T bases
+        self.n_hist = np.zeros(101, dtype=np.int64) #reads per N%
+        self.read_qual_hist = np.zeros(QUAL_LEVELS, dtype=np.int64) #reads per mean quality
+
+    def _newBatch(self):
+        self.seq_bytes, self.qual_bytes = bytearray(), bytearray()
+        self.lengths, self.qual_lengths = array("q"), array("q") #QUAL "*" has length 0
+        self.contig_ids, self.positions = array("q"), array("q") #contig id -1 for the unmapped reads
+
+    def update(self, read):
+        flag = read.flag
+        if flag & 0x900 or read.rest is None:
+            return
+        seq, qual = read.seqQual()
+        if seq == b"*" or not seq:
+            return
+        if qual == b"*" or len(qual) != len(seq):
+            qual = b""
+        if flag & 16: #SEQ and QUAL of the reverse strand, reversed back to the order of the cycles
+            seq, qual = seq[::-1], qual[::-1]
+
+        self.seq_bytes += seq
+        self.qual_bytes += qual
+        self.lengths.append(len(seq))
+        self.qual_lengths.append(len(qual))
+        contig_id = -1
+        if not flag & 4:
+            contig_id = self.ids.get(read.chromosome, -1)
+            if contig_id < 0 and read.chromosome in self.header_parsed: #first read of the contig
+                contig_id = self.ids[read.chromosome] = len(self.names)
+                self.names.append(read.chromosome)
+        self.contig_ids.append(contig_id)
+        self.positions.append(read.pos)
+        if len(self.seq_bytes) >= QC_BATCH_BYTES:
+            self.flush()
+
+    def _grow(self, nb_cycles):
+        if nb_cycles > len(self.cycle_reads):
+            extra = nb_cycles - len(self.cycle_reads)
+            self.cycle_reads = np.concatenate((self.cycle_reads, np.zeros(extra, dtype=np.int64)))
+            self.cycle_n = np.concatenate((self.cycle_n, np.zeros(extra, dtype=np.int64)))
+            self.cycle_qual_hist = np.concatenate((self.cycle_qual_hist, np.zeros((extra, QUAL_LEVELS), dtype=np.int64)))
+
+    def flush(self):
+        '''add the statistics of the reads waiting in the batch'''
+        if not self.lengths:
+            return
+        lengths = np.frombuffer(self.lengths, dtype=np.int64)
+        starts = np.cumsum(lengths) - lengths
+        nb_cycles = min(int(lengths.max()), QC_MAX_CYCLES)
+        self._grow(nb_cycles)
+        self.reads += len(lengths)
+        #reads having each cycle: reads at least that long
+        self.cycle_reads[:nb_cycles] += np.cumsum(np.bincount(np.minimum(lengths, nb_cycles), minlength=nb_cycles + 1)[::-1])[::-1][1:]
+
+        #bases per read summed with reduceat on boolean arrays, lower case letters are the upper case ones with the bit 0x20
+        bases = np.frombuffer(self.seq_bytes, dtype=np.uint8) | 0x20
+        gc = np.add.reduceat((bases == ord("g")) | (bases == ord("c")), starts, dtype=np.int64)
+        called = gc + np.add.reduceat((bases == ord("a")) | (bases == ord("t")) | (bases == ord("u")), starts, dtype=np.int64)
+        n_bases = np.flatnonzero(bases == ord("n")) #N bases are rare, counted from their offsets
+        n_reads = np.searchsorted(starts, n_bases, side="right") - 1
+        n = np.bincount(n_reads, minlength=len(lengths))
+        if len(n_bases):
+            cycles = n_bases - starts[n_reads]
+            self.cycle_n[:nb_cycles] += np.bincount(cycles[cycles < nb_cycles], minlength=nb_cycles)
+        with_bases = called > 0 #reads with A/C/G/T bases
+        self.gc_hist += np.bincount((100 * gc[with_bases] + called[with_bases] // 2) // called[with_bases], minlength=101)
+        self.n_hist += np.bincount((100 * n + lengths // 2) // lengths, minlength=101)
+
+        #GC, A/C/G/T and N bases added to the window of the first position of the mapped reads, contig by contig
+        contig_ids = np.frombuffer(self.contig_ids, dtype=np.int64)
+        windows = np.frombuffer(self.positions, dtype=np.int64) // self.window_size
+        for contig_id in np.unique(contig_ids[contig_ids >= 0]):
+            rows = np.flatnonzero(contig_ids == contig_id)
+            counts = self._windows(self.names[contig_id])
+            for values, column in ((gc, 0), (called, 1), (n, 2)):
+                np.add.at(counts[column], windows[rows], values[rows])
+
+        qual_lengths = np.frombuffer(self.qual_lengths, dtype=np.int64)
+        if self.qual_bytes:
+            qual_lengths = qual_lengths[qual_lengths > 0]
+            qual_starts = np.cumsum(qual_lengths) - qual_lengths
+            quals = np.minimum(np.frombuffer(self.qual_bytes, dtype=np.uint8) - 33, QUAL_LEVELS - 1) #characters below ! wrap around to the top
+            self.qual_reads += len(qual_lengths)
+            self.read_qual_hist += np.bincount(np.add.reduceat(quals, qual_starts, dtype=np.int64) // qual_lengths, minlength=QUAL_LEVELS)
+            #(cycle, quality) pairs numbered in one axis, the bases past nb_cycles of long reads are left out
+            cycles, offsets = readCycles(qual_lengths, qual_starts, nb_cycles)
+            cells = cycles * QUAL_LEVELS + (quals[offsets] if len(offsets) < len(quals) else quals)
+            self.cycle_qual_hist[:nb_cycles] += np.bincount(cells, minlength=nb_cycles * QUAL_LEVELS).reshape(nb_cycles, QUAL_LEVELS)
+        self._newBatch()
+
+    def _windows(self, chromosome):
+        if chromosome not in self.windows:
+            self.windows[chromosome] = np.zeros((3, self.header_parsed[chromosome] // self.window_size + 1), dtype=np.int64)
+        return self.windows[chromosome]
+
+    def merge(self, other):
+        self.flush()
+        other.flush()
+        nb_cycles = len(other.cycle_reads)
+        self._grow(nb_cycles)
+        for name in ("cycle_reads", "cycle_n", "cycle_qual_hist"):
+            getattr(self, name)[:nb_cycles] += getattr(other, name)
+        for name in ("gc_hist", "n_hist", "read_qual_hist"):
+            getattr(self, name)[:] += getattr(other, name)
+        self.reads += other.reads
+        self.qual_reads += other.qual_reads
+        for chromosome, counts in other.windows.items():
+            self._windows(chromosome)[:] += counts
+
+    def cycleTable(self, percentiles=QC_CYCLE_PERCENTILES):
+        '''rows (cycle, reads, mean quality, quality percentiles, N%) of each cycle, the quality columns are None for the cycles without QUAL'''
+        self.flush()
+        cumulative = np.cumsum(self.cycle_qual_hist, axis=1)
+        quality_sums = self.cycle_qual_hist @ np.arange(QUAL_LEVELS)
+        rows = []
+        for cycle, reads in enumerate(self.cycle_reads):
+            n_percent = round(100 * self.cycle_n[cycle] / reads, 2)
+            quals = cumulative[cycle, -1]
+            if not quals:
+                rows.append((cycle + 1, int(reads), None, [None] * len(percentiles), n_percent))
+                continue
+            #lowest quality reached by p% of the bases of the cycle
+            levels = [int(np.searchsorted(cumulative[cycle], quals * percentile / 100)) for percentile in percentiles]
+            rows.append((cycle + 1, int(reads), round(quality_sums[cycle] / quals, 2), levels, n_percent))
+        return rows
+
+    def windowTable(self):
+        '''{chromosome: (GC%, N%, bases) of each window}, GC% of the A/C/G/T bases and N% of all the bases, nan for the windows without reads'''
+        self.flush()
+        table = {}
+        for chromosome in self.header_parsed:
+            if chromosome not in self.windows:
+                continue
+            gc, called, n = self.windows[chromosome]
+            bases = called + n
+            with np.errstate(divide="ignore", invalid="ignore"):
+                gc_percent = np.round(100 * gc / called, 2)
+                n_percent = np.round(100 * n / bases, 2)
+            table[chromosome] = (gc_percent, n_percent, bases)
+        return table
+
+
+class SamStats:
+    '''all the accumulators filled together in a single pass over the reads'''
+
+    def __init__(self, header_parsed, window_size, MAPQ_threshold, short_size, long_size, per_base=False, mapq_extras=False, sort_order=None, max_pending=MAX_PENDING_MATES, validation=None, bin_size=None, flag_filter=(0, 0), qc=False):
+        self.validation = validation if validation is not None else Validation() #lines checked and errors found while reading
+        self.flag_filter = flag_filter #(excluded, required) FLAG bits of the reads given to the accumulators
+        self.header_parsed = header_parsed
+        self.pairs = FlagAccumulator(header_parsed, sort_order, max_pending)
+        self.chrom = ChromAccumulator(header_parsed)
+        self.mapq = MAPQAccumulator(header_parsed, MAPQ_threshold)
+        self.alignment = AlignmentAccumulator(header_parsed, short_size, long_size)
+        self.indel = IndelAccumulator(header_parsed)
+        self.windows = WindowAccumulator(header_parsed, window_size, MAPQ_threshold, per_base, mapq_extras)
+        self.accumulators = [self.pairs, self.chrom, self.mapq, self.alignment, self.indel, self.windows]
+        self.bins = None #fine coverage bins saved in the coverage cache, only with bin_size
+        if bin_size is not None:
+            self.bins = BinAccumulator(header_parsed, bin_size, MAPQ_threshold)
+            self.accumulators.append(self.bins)
+        self.qc = None #base quality and composition, only with qc
+        if qc:
+            self.qc = QCAccumulator(header_parsed, window_size)
+            self.accumulators.append(self.qc)
+
+    def update(self, read):
+        for accumulator in self.accumulators:
+            accumulator.update(read)
+
+    def merge(self, other):
+        for accumulator, other_accumulator in zip(self.accumulators, other.accumulators):
+            accumulator.merge(other_accumulator)
+        self.validation.merge(other.validation)
+
+
+def accumulate(reads, accumulator):
+    '''feed every read to the accumulator and return it'''
+    for read in reads:
+        accumulator.update(read)
+    return accumulator
+
+
+def streamStats(input_file, header_parsed, filterMAPQ, fullyMappedOnly, window_size, MAPQ_threshold, short_size, long_size, region=None, progress=None, plots=None, **options):
+    '''compute all the statistics in a single pass over the SAM file without storing the reads (options are passed to SamStats)
+    with a region (chromosome, start, end) only the part of the file given by the index is read
+    with plots (PlotPipeline) each chromosome is plotted as soon as the reads have moved past it'''
+    if region is not None:
+        start, end = regionSpan(input_file, region)
+        return rangeStats(input_file, start, end, header_parsed, filterMAPQ, fullyMappedOnly, window_size, MAPQ_threshold, short_size, long_size, region, options, progress)
+    stats = SamStats(header_parsed, window_size, MAPQ_threshold, short_size, long_size, **options)
+    reads = iter_reads(input_file, filterMAPQ, fullyMappedOnly, validation=stats.validation, progress=progress, flag_filter=stats.flag_filter, sequences=stats.qc is not None)
+    if plots is not None:
+        reads = plots.track(reads, stats.windows)
+    return accumulate(reads, stats)
+
+
+def rangeStats(input_file, start, end, header_parsed, filterMAPQ, fullyMappedOnly, window_size, MAPQ_threshold, short_size, long_size, region, options, progress=None):
+    '''compute all the statistics on the byte range [start, end[ of the SAM file (run in a worker process)'''
+    stats = SamStats(header_parsed, window_size, MAPQ_threshold, short_size, long_size, **options)
+    stats.validation = stats.validation.forRange(start)
+    progress = progress if progress is not None else worker_progress
+    return accumulate(iter_reads(input_file, filterMAPQ, fullyMappedOnly, start, end, stats.validation, region, progress, stats.flag_filter, stats.qc is not None), stats)
+
+
+def submitRanges(pool, input_file, nb_chunks, header_parsed, filterMAPQ, fullyMappedOnly, window_size, MAPQ_threshold, short_size, long_size, region=None, **options):
+    '''submit the byte ranges of the SAM file (of the region if any) to a pool of processes, return the futures in file order'''
+    settings = (header_parsed, filterMAPQ, fullyMappedOnly, window_size, MAPQ_threshold, short_size, long_size, region, options)
+    span = regionSpan(input_file, region) if region is not None else (0, None)
+    return [pool.submit(rangeStats, input_file, start, end, *settings) for start, end in split_ranges(input_file, nb_chunks, *span)]
+
+
+def mergeFutures(futures, progress=None):
+    '''merge the partial statistics of the byte ranges in file order, progress is shown while waiting for them'''
+    pending = set(futures) if progress is not None else ()
+    while pending:
+        done, pending = wait(pending, timeout=progress.interval)
+        progress.show()
+    stats = futures[0].result()
+    for future in futures[1:]:
+        stats.merge(future.result())
+    return stats
+
+
+def parallelStats(input_file, header_parsed, filterMAPQ, fullyMappedOnly, window_size, MAPQ_threshold, short_size, long_size, workers, region=None, progress=None, **options):
+    '''same as streamStats but the file is split in byte ranges parsed by a pool of processes, partial results are merged in file order
+    progress must be created with shared=True to count the reading of the workers'''
+    with ProcessPoolExecutor(max_workers=workers, initializer=setWorkerProgress, initargs=(progress,)) as pool:
+        futures = submitRanges(pool, input_file, workers, header_parsed, filterMAPQ, fullyMappedOnly, window_size, MAPQ_threshold, short_size, long_size, region, **options)
+        return mergeFutures(futures, progress)
+
+
+############### PIPELINE ###############
+#the stages of a run overlap: the disk reads ahead of the parsing (posix_fadvise for plain files, a reader thread filling a bounded queue for gzip,
+#threads of BgzfReader for BGZF), and the plot of a chromosome is drawn by a pool of processes as soon as the reads of a coordinate-sorted
+#file have moved past it, a full queue blocks the faster stage so the memory stays bounded whatever the speed of the disk and of the plots
+
+PIPELINE_QUEUE = 2 #batches read ahead of the parsing
+PLOT_QUEUE = 2 #plots waiting per process of the plot pool
+END = object() #last item of a queue
+
+
+def prefetch(batches, size=PIPELINE_QUEUE):
+    '''iterate over batches produced by a reader thread, at most size batches wait in the queue
+    an error of the reader is raised here, and the reader stops when the batches are no longer wanted'''
+    batch_queue = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                batch_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read():
+        try:
+            for batch in batches:
+                if not put(batch):
+                    return
+            put(END)
+        except BaseException as error:
+            put(error)
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    try:
+        while True:
+            batch = batch_queue.get()
+            if batch is END:
+                return
+            if isinstance(batch, BaseException):
+                raise batch
+            yield batch
+    finally:
+        stop.set()
+        reader.join()
+
+
+class PlotPipeline:
+    '''coverage plots drawn by a pool of processes while a coordinate-sorted file is still read
+    when the reads move to the next chromosome the windows of the previous one are final and its plot is submitted,
+    a chromosome seen again (file not really sorted) is plotted again with the others at the end'''
+
+    def __init__(self, window_size, dir_name, workers):
+        self.window_size = window_size
+        self.dir_name = dir_name
+        self.workers = workers
+        self.windows = None
+        self.pending = {} #{future: chromosome}
+        self.submitted = set()
+        self.reopened = set()
+        self.plotted = set() #chromosomes whose plot is final
+        os.makedirs(dir_name, exist_ok = True)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        self.pool.submit(pyplot) #the processes are started and import matplotlib before the reading begins
+
+    def _collect(self, futures):
+        for future in futures:
+            chromosome = self.pending.pop(future)
+            future.result()
+            if chromosome not in self.reopened:
+                self.plotted.add(chromosome)
+            print(f"Graph of coverage depth along the {chromosome} has been saved as \"coverage_{chromosome}.png\" in directory \"{self.dir_name}\".")
+
+    def finish(self, chromosome):
+        '''submit the plot of a chromosome whose windows are final, wait while the pool has too many plots'''
+        counts = self.windows.chromCoverage(chromosome)
+        if not counts: #skip chromosomes without reads
+            return
+        while len(self.pending) >= PLOT_QUEUE * self.workers:
+            self._collect(wait(self.pending, return_when=FIRST_COMPLETED).done)
+        future = self.pool.submit(plotChromosome, chromosome, counts, self.windows.chromMeanMAPQ(chromosome), self.window_size, self.dir_name)
+        self.pending[future] = chromosome
+        self.submitted.add(chromosome)
+
+    def track(self, reads, windows):
+        '''yield the reads and plot each chromosome once the reads have moved past it'''
+        self.windows = windows
+        current = None
+        for read in reads:
+            if read.chromosome != current:
+                if current is not None:
+                    self.finish(current)
+                current = read.chromosome
+                if current in self.submitted:
+                    self.reopened.add(current)
+                    self.plotted.discard(current) #a plot collected before is not final anymore
+            yield read
+
+    def close(self):
+        '''wait for the plots submitted, return the chromosomes that do not have to be plotted again'''
+        self._collect(wait(self.pending).done)
+        self.pool.shutdown()
+        return self.plotted
+
+
+############### PROGRESS AND METRICS ###############
+#Progress shows the reading live on stderr (reads/s, ETA from the bytes of the input consumed), worker processes add their counts to shared counters
+#Metrics records the wall time, CPU time, records and peak memory of each stage of main(), saved as JSON with --metrics
+
+class Progress:
+    '''bytes of the input and lines read out of total_bytes (None if unknown, ex. stdin), shown on stream at most every interval seconds
+    (shared=True to count in worker processes)'''
+
+    def __init__(self, total_bytes, label="Reading", shared=False, stream=None):
+        self.total_bytes = max(total_bytes, 1) if total_bytes is not None else None
+        self.label = label
+        self.counters = multiprocessing.Array("q", 2) if shared else [0, 0] #[bytes, lines]
+        self.stream = stream if stream is not None else sys.stderr
+        self.tty = self.stream.isatty()
+        self.interval = 0.5 if self.tty else 30 #a log file gets one line every 30 s
+        self.pid = os.getpid() #only the process that created the progress shows it
+        self.start = time.perf_counter()
+        self.last_shown = self.start
+
+    def update(self, nb_bytes, nb_lines=0):
+        if isinstance(self.counters, list):
+            self.counters[0] += nb_bytes
+            self.counters[1] += nb_lines
+        else:
+            with self.counters.get_lock():
+                self.counters[0] += nb_bytes
+                self.counters[1] += nb_lines
+        if os.getpid() == self.pid and time.perf_counter() - self.last_shown >= self.interval:
+            self.show()
+
+    def show(self, last=False):
+        now = time.perf_counter()
+        self.last_shown = now
+        nb_bytes, nb_lines = self.counters[0], self.counters[1]
+        elapsed = max(now - self.start, 1e-9)
+        text = f"{nb_lines:,} reads  {nb_lines / elapsed:,.0f} reads/s  {nb_bytes / (1 << 20) / elapsed:,.1f} MB/s"
+        if self.total_bytes is not None:
+            fraction = min(nb_bytes / self.total_bytes, 1.0)
+            eta = elapsed * (1 - fraction) / fraction if fraction > 0 else None
+            eta_text = "done" if last else "--:--:--" if eta is None else time.strftime("%H:%M:%S", time.gmtime(eta))
+            text = f"{100 * fraction:5.1f}%  {text}  ETA {eta_text}"
+        text = f"{self.label}: {text}"
+        self.stream.write(f"\r{text}\033[K" if self.tty else text + "\n")
+        if last and self.tty:
+            self.stream.write("\n")
+        self.stream.flush()
+
+    def finish(self):
+        if self.total_bytes is not None:
+            self.counters[0] = self.total_bytes
+        self.show(last=True)
+
+
+worker_progress = None #progress of the parent process in the worker processes of a pool, see setWorkerProgress
+
+
+def setWorkerProgress(progress):
+    '''initializer of the worker processes: the byte ranges they read are counted in the progress of the parent'''
+    global worker_progress
+    worker_progress = progress
+
+
+def inputSize(input_file, start=0, end=None):
+    '''bytes of the file read for the range [start, end[ (compressed bytes for BGZF whose offsets are virtual)'''
+    size = os.path.getsize(input_file)
+    if fileFormat(input_file) == "bgzf":
+        return (size if end is None else end >> 16) - (start >> 16)
+    return (size if end is None else end) - start
+
+
+def peakRSS():
+    '''peak resident memory of this process and of its finished children, in MB'''
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024 #bytes on macOS, KB on Linux
+
+
+def cpuTime():
+    '''user + system CPU time of this process and of its finished children (the pools of processes are counted once they are shut down)'''
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+class Metrics:
+    '''wall time, CPU time, records processed and peak memory of each stage'''
+
+    def __init__(self):
+        self.stages = [] #[{name, sample, wall_s, cpu_s, records, bytes, peak_rss_mb...}] in the order they ended
+        self.start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name, sample=None):
+        '''with metrics.stage("reads") as stage: ... stage["records"] = n'''
+        stage = {"name": name, "sample": sample, "records": None, "bytes": None}
+        wall, cpu = time.perf_counter(), cpuTime()
+        try:
+            yield stage
+        finally:
+            stage["wall_s"] = round(time.perf_counter() - wall, 4)
+            stage["cpu_s"] = round(cpuTime() - cpu, 4)
+            stage["peak_rss_mb"] = round(peakRSS(), 1)
+            if stage["records"] is not None and stage["wall_s"] > 0:
+                stage["records_per_s"] = round(stage["records"] / stage["wall_s"])
+            if stage["bytes"] is not None and stage["wall_s"] > 0:
+                stage["mb_per_s"] = round(stage["bytes"] / (1 << 20) / stage["wall_s"], 2)
+            self.stages.append(stage)
+
+    def write(self, path, **information):
+        '''save the stages and information (input files, settings...) in a JSON file'''
+        report = {"version": 1, "wall_s": round(time.perf_counter() - self.start, 4), "cpu_s": round(cpuTime(), 4), "peak_rss_mb": round(peakRSS(), 1),
+                  **information, "stages": self.stages}
+        with open(path, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Metrics of the run have been saved as \"{os.path.basename(path)}\" in directory \"{os.path.dirname(path) or '.'}\".")
+
+
+def nbRecords(stats):
+    '''number of reads accumulated in stats (after the filters)'''
+    return sum(mapped + unmapped for mapped, unmapped in stats.chrom.result().values())
+
+
+############### CHECKPOINTS ###############
+#with --resume the accumulators are pickled in <output directory>/checkpoint.pkl with the byte offset reached, every --checkpoint-seconds
+#and at the end: a later run reads only the bytes added after this offset (a SAM file being written is only appended to)
+#the unresolved mates spilled to temporary files are copied next to the checkpoint, only plain SAM files can be resumed
+
+CHECKPOINT_NAME = "checkpoint.pkl"
+CHECKPOINT_VERSION = 2
+CHECKPOINT_SECONDS = 300 #default time between two checkpoints
+CHECKPOINT_HASHED_BYTES = 1 << 16 #bytes hashed at the beginning of the file and just before the offset reached
+SEGMENT_SIZE = 1 << 28 #bytes read between two chances to save a checkpoint
+
+
+def completeEnd(input_file, start=0):
+    '''offset just after the last complete line of the file (a file being written may end with half a line), start if there is none after start'''
+    size = os.path.getsize(input_file)
+    if size <= start:
+        return start
+    with open(input_file, "rb") as file, mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ) as buffer:
+        return buffer.rfind(b"\n", start) + 1 or start
+
+
+def segmentEnd(input_file, start, end):
+    '''end of the segment of about SEGMENT_SIZE bytes starting at start, aligned on a line'''
+    if end - start <= SEGMENT_SIZE:
+        return end
+    with open(input_file, "rb") as file:
+        file.seek(start + SEGMENT_SIZE - 1)
+        file.readline()
+        return min(file.tell(), end)
+
+
+def readHash(input_file, offset):
+    '''hash of the first bytes of the file and of the bytes just before offset: the part already read must not change'''
+    digest = hashlib.blake2b(digest_size=16)
+    with open(input_file, "rb") as file:
+        digest.update(file.read(min(offset, CHECKPOINT_HASHED_BYTES)))
+        file.seek(max(offset - CHECKPOINT_HASHED_BYTES, 0))
+        digest.update(file.read(min(offset, CHECKPOINT_HASHED_BYTES)))
+    return digest.hexdigest()
+
+
+class Checkpoint:
+    '''statistics (SamStats) of a plain SAM file up to the byte offset, saved in path, settings are the values the statistics depend on'''
+
+    def __init__(self, path, input_file, settings):
+        self.path = path
+        self.input_file = input_file
+        self.settings = settings
+        self.stats = None
+        self.offset = 0
+        self.hash = None
+
+    def unchanged(self):
+        '''True if the bytes already read are still there (the file was only appended to)'''
+        return os.path.getsize(self.input_file) >= self.offset and self.hash == readHash(self.input_file, self.offset)
+
+    def load(self):
+        '''read the checkpoint of path, False if there is none or it cannot be used for this file and these settings'''
+        try:
+            with open(self.path, "rb") as file:
+                saved = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return False
+        if saved["version"] != CHECKPOINT_VERSION or saved["settings"] != self.settings:
+            print(f"Checkpoint \"{self.path}\" was made with other settings, the file is read from the beginning.")
+            return False
+        if os.path.getsize(self.input_file) < saved["offset"] or saved["hash"] != readHash(self.input_file, saved["offset"]):
+            print(f"The file changed before the offset of checkpoint \"{self.path}\", it is read from the beginning.")
+            return False
+
+        self.stats, self.offset, self.hash = saved["stats"], saved["offset"], saved["hash"]
+        pairs = self.stats.pairs
+        if pairs.spill_dir is not None: #spilled mates saved with the checkpoint go to a new temporary directory
+            pairs.spill_dir = tempfile.mkdtemp(prefix="samreader_mates_")
+            atexit.register(shutil.rmtree, pairs.spill_dir, True)
+            shutil.copytree(self.path + ".mates", pairs.spill_dir, dirs_exist_ok=True)
+        return True
+
+    def save(self):
+        '''write the checkpoint in a temporary file replacing the previous one at once, a checkpoint that cannot be written is skipped'''
+        self.hash = readHash(self.input_file, self.offset)
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            spill_dir = self.stats.pairs.spill_dir
+            if spill_dir is not None:
+                self.stats.pairs._closeSpill() #the buffered spilled mates are written before the copy
+                shutil.rmtree(self.path + ".mates", ignore_errors=True)
+                shutil.copytree(spill_dir, self.path + ".mates")
+            with open(self.path + ".tmp", "wb") as file:
+                pickle.dump({"version": CHECKPOINT_VERSION, "input_file": os.path.abspath(self.input_file), "offset": self.offset,
+                             "hash": self.hash, "settings": self.settings, "stats": self.stats}, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as error:
+            print(f"Checkpoint could not be saved: {error}")
+
+
+def readAppended(checkpoint, read_range, interval=CHECKPOINT_SECONDS):
+    '''add to checkpoint.stats the complete lines written after checkpoint.offset, read segment by segment with read_range(start, end) -> SamStats
+    the checkpoint is saved every interval seconds and at the end, return the number of bytes read'''
+    start = checkpoint.offset
+    end = completeEnd(checkpoint.input_file, start)
+    last_saved = time.monotonic()
+    if checkpoint.stats is None: #empty statistics, even for a file without reads
+        checkpoint.stats = read_range(start, start)
+
+    while checkpoint.offset < end:
+        stop = segmentEnd(checkpoint.input_file, checkpoint.offset, end)
+        checkpoint.stats.merge(read_range(checkpoint.offset, stop))
+        checkpoint.offset = stop
+        if time.monotonic() - last_saved >= interval:
+            checkpoint.save()
+            last_saved = time.monotonic()
+
+    if end > start or not os.path.exists(checkpoint.path):
+        checkpoint.save()
+    return end - start
+
+
+############### COVERAGE CACHE ###############
+#with --cache the results of an analysis are saved in <directory of the file>/.samreader_cache/<file>.<key>.npz (in the user cache directory
+#$XDG_CACHE_HOME/samreader or ~/.cache/samreader when the directory of the file cannot be written), the key being made of
+#the identity of the file (size, modification time, hash of its first and last MB) and of every setting changing the results but the window size
+#coverage and MAPQ are kept per bin of CACHE_BIN_SIZE bp and as a pyramid of bins of 2, 4, 8... times this size,
+#so that any window size multiple of CACHE_BIN_SIZE is computed from the cache without reading the SAM file again
+
+CACHE_DIR = ".samreader_cache"
+USER_CACHE_DIR = "samreader" #in $XDG_CACHE_HOME or ~/.cache
+CACHE_VERSION = 3
+CACHE_BIN_SIZE = 100
+CACHE_HASHED_BYTES = 1 << 20 #bytes hashed at the beginning and at the end of the file
+
+
+def contentHash(input_file):
+    '''hash of the first and last MB of the file, with its size it tells apart files with the same size and time'''
+    digest = hashlib.blake2b(digest_size=16)
+    with open(input_file, "rb") as file:
+        digest.update(file.read(CACHE_HASHED_BYTES))
+        file.seek(max(os.path.getsize(input_file) - CACHE_HASHED_BYTES, 0))
+        digest.update(file.read(CACHE_HASHED_BYTES))
+    return digest.hexdigest()
+
+
+def cachePath(input_file, settings, cache_dir=None):
+    '''path of the cache of the file analysed with settings (dictionary of the settings changing the results)'''
+    identity = {**fileIdentity(input_file), "hash": contentHash(input_file), "settings": settings, "bin_size": CACHE_BIN_SIZE, "version": CACHE_VERSION}
+    key = hashlib.blake2b(json.dumps(identity, sort_keys=True).encode(), digest_size=8).hexdigest()
+    name = f"{os.path.basename(input_file)}.{key}.npz"
+    if cache_dir is not None:
+        return os.path.join(cache_dir, name)
+
+    local_dir = os.path.join(os.path.dirname(os.path.abspath(input_file)), CACHE_DIR)
+    if os.path.exists(os.path.join(local_dir, name)) or writableDir(local_dir): #a cache already next to the file is read even if it cannot be written
+        return os.path.join(local_dir, name)
+    return os.path.join(userCacheDir(), name) #read-only or shared directory of the file
+
+
+def writableDir(path):
+    '''True if the directory can be written, or created in a directory that can be written'''
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            return False
+        path = parent
+    return os.path.isdir(path) and os.access(path, os.W_OK | os.X_OK)
+
+
+def userCacheDir():
+    '''directory of the caches of the files whose directory cannot be written'''
+    return os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), USER_CACHE_DIR)
+
+
+class CoverageCache:
+    '''pyramid of coverage bins of each chromosome {chromosome: [level 0, level 1...]}, level k has bins of bin_size * 2**k bp'''
+
+    def __init__(self, header_parsed, bin_size, levels):
+        self.header_parsed = header_parsed
+        self.bin_size = bin_size
+        self.levels = levels #{chromosome: [{array name: numpy array} or callable loading it]}
+
+    @classmethod
+    def fromBins(cls, bins):
+        '''build the pyramid from a BinAccumulator, each level sums the pairs of bins of the previous one'''
+        levels = {}
+        for chromosome, level in bins.result().items():
+            levels[chromosome] = [level]
+            while len(level["bp"]) > 1:
+                level = {name: np.pad(values, (0, len(values) % 2)).reshape(-1, 2).sum(axis=1) for name, values in level.items()}
+                levels[chromosome].append(level)
+        return cls(bins.header_parsed, bins.bin_size, levels)
+
+    def canServe(self, window_size):
+        return window_size % self.bin_size == 0
+
+    def _level(self, chromosome, window_size):
+        '''coarsest level whose bins divide the window size, and the number of its bins per window'''
+        nb_bins = window_size // self.bin_size
+        level = min((nb_bins & -nb_bins).bit_length() - 1, len(self.levels[chromosome]) - 1)
+        arrays = self.levels[chromosome][level]
+        if callable(arrays): #loaded from the file on first use
+            arrays = self.levels[chromosome][level] = arrays()
+        return arrays, nb_bins >> level
+
+    def _windowSums(self, chromosome, window_size):
+        '''bp covered, MAPQ sum and MAPQ count per window of the chromosome (same windows as WindowAccumulator)'''
+        arrays, group = self._level(chromosome, window_size)
+        nb_windows = self.header_parsed[chromosome] // window_size + 1
+        padded = {name: np.pad(values, (0, nb_windows * group - len(values))) for name, values in arrays.items()}
+
+        bp = padded["bp"].reshape(nb_windows, group).sum(axis=1)
+        sums = []
+        for name in ("sum", "count"):
+            started = np.cumsum(padded["start_" + name])[group - 1::group] #reads starting before the end of each window
+            ended = np.concatenate(([0], np.cumsum(padded["end_" + name])[group - 1::group][:-1])) #reads ending before its start
+            sums.append(started - ended)
+        return bp, sums[0], sums[1]
+
+    def windows(self, window_size):
+        return CachedWindows(self, window_size)
+
+    def save(self, path, results, validation):
+        '''write the pyramid, the results of the other accumulators and the validation report in a compressed numpy file'''
+        chromosomes = list(self.levels)
+        arrays = {f"{i}/{k}/{name}": values for i, chromosome in enumerate(chromosomes)
+                  for k, level in enumerate(self.levels[chromosome]) for name, values in level.items()}
+        meta = {"header": self.header_parsed, "bin_size": self.bin_size, "chromosomes": chromosomes,
+                "nb_levels": [len(self.levels[chromosome]) for chromosome in chromosomes], "results": results,
+                "validation": {"mode": validation.mode, "checked": validation.checked, "errors": validation.errors, "messages": validation.messages}}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez_compressed(path + ".tmp.npz", meta=np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8), **arrays)
+        os.replace(path + ".tmp.npz", path) #a cache being written is never read
+
+
+class CachedWindows:
+    '''coverage and mean MAPQ per window computed from the cache, same results as WindowAccumulator'''
+
+    def __init__(self, cache, window_size):
+        self.cache = cache
+        self.window_size = window_size
+
+    def coverage(self):
+        return {chrom: [round(c / self.window_size, 3) for c in self.cache._windowSums(chrom, self.window_size)[0].tolist()] for chrom in self.cache.levels}
+
+    def meanMAPQ(self):
+        mapq_window = {}
+        for chrom in self.cache.levels:
+            _, sums, counts = self.cache._windowSums(chrom, self.window_size)
+            mapq_window[chrom] = [round(s / c, 3) if c else 0.0 for s, c in zip(sums.tolist(), counts.tolist())]
+        return mapq_window
+
+
+class CachedStats:
+    '''results of an analysis read from the cache, with the attributes of SamStats used to write the results'''
+
+    def __init__(self, cache, window_size, results, validation):
+        #the accumulators are rebuilt from their counts: the short and long sizes and the pooled contigs are given when writing the results
+        self.header_parsed = cache.header_parsed
+        self.pairs = FlagAccumulator.fromState(cache.header_parsed, results["pairs"])
+        self.chrom = ChromAccumulator.fromState(cache.header_parsed, results["chrom"])
+        self.mapq = MAPQAccumulator.fromState(cache.header_parsed, results["mapq"], None)
+        self.indel = IndelAccumulator.fromState(cache.header_parsed, results["indel"])
+        self.alignment = AlignmentAccumulator.fromState(cache.header_parsed, results["alignment"])
+        self.windows = cache.windows(window_size)
+        self.validation = validation
+
+
+def saveCache(path, stats):
+    '''save the results of an analysis made with a bin_size, a cache that cannot be written is skipped'''
+    results = {name: getattr(stats, name).state() for name in ("pairs", "chrom", "mapq", "indel", "alignment")}
+    try:
+        CoverageCache.fromBins(stats.bins).save(path, results, stats.validation)
+    except OSError as error:
+        print(f"Coverage cache could not be saved: {error}")
+
+
+def loadCache(path, window_size):
+    '''CachedStats of the cache file for the window size, None if there is no cache or it cannot give this window size'''
+    if window_size % CACHE_BIN_SIZE != 0 or not os.path.exists(path):
+        return None
+    try:
+        data = np.load(path)
+        meta = json.loads(data["meta"].tobytes())
+    except (OSError, ValueError, KeyError):
+        return None
+
+    levels = {}
+    for i, chromosome in enumerate(meta["chromosomes"]):
+        #arrays are only decompressed for the level used by the window size
+        levels[chromosome] = [lambda i=i, k=k: {name: data[f"{i}/{k}/{name}"] for name in ("bp", "start_sum", "start_count", "end_sum", "end_count")}
+                              for k in range(meta["nb_levels"][i])]
+    cache = CoverageCache(meta["header"], meta["bin_size"], levels)
+
+    validation = Validation(meta["validation"]["mode"])
+    validation.checked, validation.errors, validation.messages = meta["validation"]["checked"], meta["validation"]["errors"], meta["validation"]["messages"]
+    return CachedStats(cache, window_size, meta["results"], validation)
+
+
+################ STATISTICS FUNCTIONS ###############
+
+def readFlag(reads_extract):
+    '''percentage of properly paired reads and of properly oriented pairs per chromosome {chromosome: [pair%, oriented%]}'''
+    paired_orientation = {}
+
+    for chromosome, columns in reads_extract.items():
+        if len(columns) == 0: #case chromosome has no reads
+            paired_orientation[chromosome] = [0.0, 0.0]
+            continue
+
+        #group the reads of a same template together, keeping the file order inside each template
+        primary = (columns.column("flag") & 0x900) == 0 #secondary and supplementary alignments are not mates
+        qnames = columns.column("qname")[primary]
+        flags = columns.column("flag")[primary]
+        order = np.argsort(qnames, kind="stable")
+        qnames, flags = qnames[order], flags[order]
+
+        #rank of each read inside its template: reads 0 and 1 make a pair, 2 and 3 another one...
+        index = np.arange(len(qnames))
+        new_template = np.ones(len(qnames), dtype=bool)
+        new_template[1:] = qnames[1:] != qnames[:-1]
+        rank = index - np.maximum.accumulate(np.where(new_template, index, 0))
+
+        total = int(np.count_nonzero(rank % 2 == 0))
+        if total == 0:
+            paired_orientation[chromosome] = [0.0, 0.0]
+            continue
+        second = index[rank % 2 == 1]
+        f1, f2 = flags[second - 1], flags[second]
+
+        #check if properly paired (bit 0x40 et 0x80 in either f1 or f2 and 0x2 in both) 
+        first_last = ((f1 & 0x80) != 0) & ((f2 & 0x40) != 0) | ((f2 & 0x80) != 0) & ((f1 & 0x40) != 0)
+        properly_paired = int(np.count_nonzero(first_last & ((f1 & 0x2) != 0) & ((f2 & 0x2) != 0)))
+
+        #check if properly oriented (RF or FR but FF or RR are misoriented), bit 0x10 indicates R
+        properly_oriented = int(np.count_nonzero((f1 & 0x10) != (f2 & 0x10)))
+
+        perc_properly_paired = round(100*properly_paired / total, 2)
+        perc_properly_oriented = round(100*properly_oriented / total, 2)
+        paired_orientation[chromosome] = [perc_properly_paired, perc_properly_oriented]
+
     return paired_orientation
 
 
 def readCHROM(reads_extract):
     '''count the number of mapped and unmapped reads per chromosome {chromosome: [mapped, unmapped]}'''
-    count_chrom= {key: [0, 0] for key in reads_extract.keys()} #create a counting dico with same keys as reads_extract 
-    for chromosome in reads_extract:
-        for read in reads_extract[chromosome]:
-            if read[1] & 4 == 0: # check if the read is mapped, if the flag has the bit 4 it means it is unmapped
-                count_chrom[chromosome][0] += 1 #count_chrom[chromosome][0] is the number of mapped reads
-            else:
-                count_chrom[chromosome][1] +=1 #count_chrom[chromosome][1] is the number of unmapped reads
+    count_chrom = {}
+    for chromosome, columns in reads_extract.items():
+        unmapped = int(np.count_nonzero(columns.column("flag") & 4)) # if the flag has the bit 4 it means it is unmapped
+        count_chrom[chromosome] = [len(columns) - unmapped, unmapped]
     return count_chrom
 
 
 def readMAPQ(reads_extract, MAPQ_threshold):
     '''count the number of reads per MAPQ {MAPQ above threshold, MAPQ below threshold}'''
+    count_mapq = {}
+    for chromosome, columns in reads_extract.items():
+        above = int(np.count_nonzero(columns.column("mapq") >= MAPQ_threshold))
+        count_mapq[chromosome] = [above, len(columns) - above]
+    return count_mapq
 
-    count_mapq = {chromosome: [0, 0] for chromosome in reads_extract.keys()} #dict {chromosome: [nb mapped, nb unmapped]}
 
-    for chromosome in reads_extract:
-        for read in reads_extract[chromosome]:
-            mapq = read[3]
+def statAlignment(reads_extract, short_size, large_size):
+    '''return basic statistics on alignment length'''
+    accumulator = AlignmentAccumulator(list(reads_extract), short_size, large_size)
+    for chromosome, columns in reads_extract.items():
+        lengths = columns.column("ref_length")
+        if len(lengths) == 0: #case chromosome has no reads
+            continue
+        histogram = accumulator._histogram(chromosome)
+        arrayView(histogram.counts)[:] += np.bincount(LengthHistogram.bins(lengths), minlength=LengthHistogram.NB_BINS)
+        histogram.length_sum, histogram.total = int(lengths.sum(dtype=np.int64)), len(lengths)
+        histogram.min_len, histogram.max_len = int(lengths.min()), int(lengths.max())
+    return accumulator.result()
 
-            if mapq >= MAPQ_threshold :
-                count_mapq[chromosome][0] += 1
-            else:
-                count_mapq[chromosome][1] += 1
 
-    return count_mapq
+def statIndel(reads_extract):
+    '''calculate percentage of reads w/ at least one indel'''
+    indel_dict = {}
+    for chromosome, columns in reads_extract.items():
+        total = len(columns)
+        atLeastOne = int(np.count_nonzero(columns.column("indel") >= 1))
+        indel_dict[chromosome] = round(atLeastOne / total, 2) if total else 0.0
+    return indel_dict
 
+def contigGroups(header_parsed, min_length=None):
+    '''contigs pooled in the "other" row {contig: "other"} and the minimum length of the references keeping their own row
+    min_length is given by --min-contig-length, by default only the MANY_CONTIGS longest references of a larger header have their own row'''
+    if min_length is None:
+        if len(header_parsed) <= MANY_CONTIGS:
+            return {}, 0
+        longest = sorted(header_parsed, key=header_parsed.get, reverse=True) #stable, contigs of the same length are kept in header order
+        return {contig: OTHER_CONTIGS for contig in longest[MANY_CONTIGS:]}, header_parsed[longest[MANY_CONTIGS - 1]]
+    return {contig: OTHER_CONTIGS for contig, length in header_parsed.items() if length < min_length}, min_length
 
-def statAlignment(reads_extract, short_size, large_size):
-    '''return basic statistics on alignment length'''
-    lengths = {key: [] for key in reads_extract.keys()}
-    stats = {key: [] for key in reads_extract.keys()}
 
-    for chromosome in reads_extract:
-        for read in reads_extract[chromosome]:
-            cigar = read[4]
-            length = lengthRefCigar(cigar)
-            lengths[chromosome].append(length)
+def summaryTable(paired_orientation, count_chrom, count_mapq, stat_alignment, short_size, long_size, stat_indel):
+    '''columns of the summary and their values for each chromosome ([column names], {chromosome: [values]})'''
+    columns = ["TOTAL", "MAP", "UMAP", "MAPQ-", "MAPQ+", "PAIR%", "RF%", f"<{short_size}BP%", "INT%", f">{long_size}BP%", "MEANL", "MINL", "MAXL", "INDEL%"]
+    rows = {}
 
-    for chromosome in lengths:
-        under50, over250, mean, total, min_len, max_len = 0, 0, 0, len(lengths[chromosome]), min(lengths[chromosome]), max(lengths[chromosome])
-        
-        for length in lengths[chromosome]:
-            mean += length
+    #CHROM_NAME
+    for chromosome in count_chrom.keys():
+        row = []
 
-            if length <= short_size:
-                under50 += 1
+        #TOTAL_READS, MAPPED_READS, UNMAPPED_READS
+        total_reads = count_chrom[chromosome][0] + count_chrom[chromosome][1]
+        mapped_reads = count_chrom[chromosome][0]
+        unmapped_reads = count_chrom[chromosome][1]
+        row += [total_reads, mapped_reads, unmapped_reads]
 
-            if length >= large_size:
-                over250 += 1
-        
-        mean = round(mean / total, 3)
-        stats[chromosome] = (under50, over250, mean, total, min_len, max_len)
+        #MAPQ<={MAPQ_threshold}, MAPQ>{MAPQ_threshold}
+        mapq_below = count_mapq[chromosome][1]
+        mapq_above = count_mapq[chromosome][0]
+        row += [mapq_below, mapq_above]
 
-    return stats
+        #%_PROP_PAIRED, %_PROP_ORIENTED
+        perc_properly_paired = paired_orientation[chromosome][0]
+        perc_properly_oriented = paired_orientation[chromosome][1]
+        row += [perc_properly_paired, perc_properly_oriented]
 
-def statIndel(reads_extract):
-    '''calculate percentage of reads w/ at least one indel'''
-    indel_dict = {key: 0 for key in reads_extract.keys()}
-
-    for chromosome in reads_extract:
-        total, atLeastOne = 0, 0
-        for read in reads_extract[chromosome]:
-            
-            total += 1
-            cigar = read[4]
-            nb_indel = nbIndel(cigar)
-
-            if nb_indel >= 1:
-                atLeastOne += 1
-        
-        indel_dict[chromosome] += round(atLeastOne / total, 2)
-    
-    return indel_dict
+        #<{short_size}BP%, [{short_size};{long_size}BP]%, >{long_size}BP%, MEAN_LENGTH, MIN_LENGTH, MAX_LENGTH
+        under = stat_alignment[chromosome][0]
+        over = stat_alignment[chromosome][1]
+        mean_len = stat_alignment[chromosome][2]
+        total_len = stat_alignment[chromosome][3] or 1 #avoid division by zero for chromosomes without reads
+        min_len = stat_alignment[chromosome][4]
+        max_len = stat_alignment[chromosome][5]
+
+        row.append(f"{round(under/total_len,2)*100}%")
+        row.append(f"{100-(round(over/total_len,2)+round(under/total_len,2))*100}%")
+        row.append(f"{round(over/total_len,2)*100}%")
+        row += [mean_len, min_len, max_len]
+
+        #percentage of reads w/ at least one indel
+        row.append(stat_indel[chromosome])
+
+        rows[chromosome] = [str(value) for value in row]
+
+    return columns, rows
+
+
+def Summary(fileName, dir_name, paired_orientation, count_chrom, count_mapq, stat_alignment, short_size, long_size, MAPQ_threshold, stat_indel, pooled=None):
+    '''create a text file to summarize the results, the table is also returned (see summaryTable)
+    pooled (number of contigs, length) tells how many contigs are in the "other" row and the minimum length of the others'''
+    columns, rows = summaryTable(paired_orientation, count_chrom, count_mapq, stat_alignment, short_size, long_size, stat_indel)
 
-def Summary(fileName, dir_name, paired_orientation, count_chrom, count_mapq, stat_alignment, short_size, long_size, MAPQ_threshold, stat_indel):
-    '''create a text file to summarize the results'''
     with open(os.path.join(dir_name, fileName), "w") as fileSummary: #open file in write mode
         fileSummary.write("===================================================== Summary of SAM file =====================================================\n\n")
 
         #table header
-        fileSummary.write(f"CHR_NAME\tTOTAL\tMAP\tUMAP\tMAPQ-\tMAPQ+\tPAIR%\tRF%\t")
-        fileSummary.write(f"<{short_size}BP%\tINT%\t>{long_size}BP%\tMEANL\tMINL\tMAXL\tINDEL%\n")
-
-        #CHROM_NAME
-        for chromosome in count_chrom.keys():
-            fileSummary.write(f"{chromosome}\t")
-
-            #TOTAL_READS, MAPPED_READS, UNMAPPED_READS
-            total_reads = count_chrom[chromosome][0] + count_chrom[chromosome][1]
-            mapped_reads = count_chrom[chromosome][0]
-            unmapped_reads = count_chrom[chromosome][1]
-            fileSummary.write(f"{total_reads}\t{mapped_reads}\t{unmapped_reads}\t")
-
-            #MAPQ<={MAPQ_threshold}, MAPQ>{MAPQ_threshold}
-            mapq_below = count_mapq[chromosome][1]
-            mapq_above = count_mapq[chromosome][0]
-            fileSummary.write(f"{mapq_below}\t{mapq_above}\t")
-
-            #%_PROP_PAIRED, %_PROP_ORIENTED
-            perc_properly_paired = paired_orientation[chromosome][0]
-            perc_properly_oriented = paired_orientation[chromosome][1]
-            fileSummary.write(f"{perc_properly_paired}\t{perc_properly_oriented}\t")
-
-            #<{short_size}BP%, [{short_size};{long_size}BP]%, >{long_size}BP%, MEAN_LENGTH, MIN_LENGTH, MAX_LENGTH
-            under = stat_alignment[chromosome][0]
-            over = stat_alignment[chromosome][1]
-            mean_len = stat_alignment[chromosome][2]
-            total_len = stat_alignment[chromosome][3]
-            min_len = stat_alignment[chromosome][4]
-            max_len = stat_alignment[chromosome][5]
-
-            fileSummary.write(f"{round(under/total_len,2)*100}%\t")
-            fileSummary.write(f"{100-(round(over/total_len,2)+round(under/total_len,2))*100}%\t")
-            fileSummary.write(f"{round(over/total_len,2)*100}%\t")         
-            fileSummary.write(f"{mean_len}\t") 
-            fileSummary.write(f"{min_len}\t") 
-            fileSummary.write(f"{max_len}\t")
-
-            #percentage of reads w/ at least one indel
-            fileSummary.write(f"{stat_indel[chromosome]}\n")
+        fileSummary.write("CHR_NAME\t" + "\t".join(columns) + "\n")
+
+        for chromosome, row in rows.items():
+            fileSummary.write(f"{chromosome}\t" + "\t".join(row) + "\n")
 
         fileSummary.write(f"\nLEGEND:\nCHR_NAME: Chromosome name\nTOTAL: Total reads\nMAP: Mapped reads\nUMAP: Unmapped reads\n")
         fileSummary.write(f"MAPQ-: Reads with MAPQ less than or equal to {MAPQ_threshold}\nMAPQ+: Reads with MAPQ greater than {MAPQ_threshold}\n")
@@ -403,9 +3019,77 @@ def Summary(fileName, dir_name, paired_orientation, count_chrom, count_mapq, sta
         fileSummary.write(f"INT%: Percentage of reads with intermediate aligned length (between {short_size} and {long_size} bp)\n")
         fileSummary.write(f">{long_size}BP%: Percentage of reads with aligned length greater than {long_size} bp\n")
         fileSummary.write(f"MEANL: Mean length of alignments\nMINL: Minimum length of alignments\nMAXL: Maximum length of alignments\n")
-        fileSummary.write(f"INDEL%: Percentage of reads with at least one indel\n\n")
+        fileSummary.write(f"INDEL%: Percentage of reads with at least one indel\n")
+        if pooled is not None:
+            fileSummary.write(f"{OTHER_CONTIGS}: {pooled[0]} contigs pooled in one row, the references with their own row are at least {pooled[1]} bp long (--min-contig-length)\n")
+        fileSummary.write("\n")
 
     print(f"Summary of SAM file has been saved as \"{fileName}\" in directory \"{dir_name}\".")
+    return columns, rows
+
+
+def writeLengths(alignment, dir_name, percentiles, groups=None):
+    '''save the median, N50 and percentile lengths of the alignments of each chromosome (AlignmentAccumulator) in lengths.txt'''
+    columns, rows = alignment.lengthTable(percentiles, groups)
+    with open(os.path.join(dir_name, "lengths.txt"), "w") as fileLengths:
+        fileLengths.write("CHR_NAME\t" + "\t".join(columns) + "\n")
+        for chromosome, row in rows.items():
+            fileLengths.write(f"{chromosome}\t" + "\t".join(str(value) for value in row) + "\n")
+        fileLengths.write(f"\nLEGEND:\nTOTAL: Number of alignments\nMEDIAN: Median length of alignments\n")
+        fileLengths.write(f"N50: Alignments at least this long hold half of the aligned bases\nP<x>: Length below or equal to which x% of the alignments are\n")
+        fileLengths.write(f"(lengths above {LENGTH_EXACT} bp are known within {round(100 / LENGTH_SUBBINS, 1)}%)\n")
+
+
+def writePreview(stats, fileName, dir_name, MAPQ_threshold, groups=None):
+    '''create the summary text file of a sample (SampleStats), every value is an estimate with its 95% confidence interval'''
+    columns, rows = stats.table(groups)
+    reads, low, high = stats.estimatedReads()
+    short_size, long_size = stats.short_size, stats.long_size
+
+    with open(os.path.join(dir_name, fileName), "w") as filePreview:
+        filePreview.write("=========================================== Preview of SAM file (estimated from a sample) ===========================================\n\n")
+        filePreview.write("CHR_NAME\t" + "\t".join(columns) + "\n")
+        for chromosome, row in rows.items():
+            filePreview.write(f"{chromosome}\t" + "\t".join(row) + "\n")
+
+        filePreview.write(f"\nSampled lines: {sum(stats.run_lines)} in {len(stats.run_lines)} runs read at random places of the file\n")
+        filePreview.write(f"Estimated lines in the file: {round(reads)} [{round(low)}-{round(high)}]\n")
+        templates, low, high = stats.estimatedTemplates()
+        filePreview.write(f"Estimated distinct templates (QNAME) in the file: {round(templates)} [{round(low)}-{round(high)}]\n")
+        filePreview.write(f"(lines of the file divided by the sampled lines per distinct QNAME, counted with a HyperLogLog sketch, mates are counted together only if they are next to each other in the file)\n")
+
+        filePreview.write(f"\nLEGEND:\nValues are estimates followed by their 95% confidence interval [low-high]\n")
+        filePreview.write(f"CHR_NAME: Chromosome name\nTOTAL: Total reads\nMAP: Mapped reads\nUMAP: Unmapped reads\n")
+        filePreview.write(f"MAPQ-: Reads with MAPQ less than or equal to {MAPQ_threshold}\nMAPQ+: Reads with MAPQ greater than {MAPQ_threshold}\n")
+        filePreview.write(f"PAIR%: Percentage of properly paired reads\nRF%: Percentage of properly oriented pairs (forward-reverse or reverse-forward)\n")
+        filePreview.write(f"(PAIR% and RF% are estimated from the FLAG of each sampled read, bits 0x2, 0x10 and 0x20, the mates are not paired)\n")
+        filePreview.write(f"<{short_size}BP%: Percentage of reads with alignmed length less than {short_size} bp\n")
+        filePreview.write(f"INT%: Percentage of reads with intermediate aligned length (between {short_size} and {long_size} bp)\n")
+        filePreview.write(f">{long_size}BP%: Percentage of reads with aligned length greater than {long_size} bp\n")
+        filePreview.write(f"MEANL: Mean length of alignments\nMINL: Minimum length of the sampled alignments\nMAXL: Maximum length of the sampled alignments\n")
+        filePreview.write(f"INDEL%: Percentage of reads with at least one indel\n\n")
+
+    print(f"Preview of SAM file has been saved as \"{fileName}\" in directory \"{dir_name}\".")
+    return columns, rows
+
+
+def writeMatrix(dir_name, tables):
+    '''one samples x chromosomes file per summary column, tables is {sample: (columns, rows)} as returned by Summary'''
+    chromosomes = []
+    for columns, rows in tables.values():
+        chromosomes += [chrom for chrom in rows if chrom not in chromosomes]
+    columns = next(iter(tables.values()))[0]
+
+    for index, column in enumerate(columns):
+        #file name without the characters of the column names that are awkward in file names
+        file_name = "matrix_" + column.replace("<", "short").replace(">", "long").replace("%", "").replace("+", "_above").replace("-", "_below") + ".txt"
+        with open(os.path.join(dir_name, file_name), "w") as fileMatrix:
+            fileMatrix.write(f"SAMPLE\t" + "\t".join(chromosomes) + "\n")
+            for sample, (sample_columns, rows) in tables.items():
+                values = [rows[chrom][index] if chrom in rows else "NA" for chrom in chromosomes]
+                fileMatrix.write(f"{sample}\t" + "\t".join(values) + "\n")
+
+    print(f"Samples x chromosomes matrices of the summary columns have been saved as \"matrix_*.txt\" in directory \"{dir_name}\".")
 
 
 ################ STATISTICS ON FILTERED DATA ###############
@@ -413,175 +3097,381 @@ def Summary(fileName, dir_name, paired_orientation, count_chrom, count_mapq, sta
 def positionsReads(reads_extract):
     '''calculate the positions of each mapped read on the reference sequence for each chromosome {[(start1, end1),(start2, end2)...]} and MAPQ'''
     positions = {}
-    for chromosome in reads_extract:
+    for chromosome, columns in reads_extract.items():
         
-        if not chromosome == "*": #skip chromosome '*'
-            
-            for read in reads_extract[chromosome]:
-                
-                if read[1] & 4 == 0: # only mapped reads
-
-                    mapq = read[3]
-
-                    #calculate the position of the read on the reference
-                    start, end = read[2], 0        
-                    cigar = read[4]
-                    length = lengthRefCigar(cigar)
-                    end = start + length - 1
-
-                    if chromosome not in positions:
-                        positions[chromosome] = []
-                        positions[chromosome].append((start, end, mapq))
-                    else:
-                        positions[chromosome].append((start, end, mapq))
+        if chromosome == "*": #skip chromosome '*'
+            continue
+
+        mapped = (columns.column("flag") & 4) == 0 # only mapped reads
+        if not mapped.any():
+            continue
+
+        #calculate the position of the read on the reference
+        start = columns.column("pos")[mapped]
+        end = start + columns.column("ref_length")[mapped] - 1
+        mapq = columns.column("mapq")[mapped]
+        positions[chromosome] = list(zip(start.tolist(), end.tolist(), mapq.tolist()))
 
     return positions
 
 
 def readsPerWindow(positions, header_parsed, window_size):
     '''calculate the niumber of reads per window on each reference'''
-    reads_window = {chrom: [] for chrom in positions.keys()}
+    windows = WindowAccumulator(header_parsed, window_size, 0)
 
     for chrom, reads in positions.items():
-
-        if not reads: #case chromosome has no reads
-            continue
-        
-        length_ref = header_parsed[chrom]
-
-        nb_windows = (length_ref // window_size) + 1 # calculate the number of windows needed to cover the reference
-        windows_counts = [0.0] * nb_windows # initialize a list to count reads per window
-
-        # for each read we determine the range of windows it is on
         for start, end, mapq in reads:
-            first_window = start // window_size
-            last_window = end // window_size
-            for window in range(first_window, last_window + 1):
-                '''we add to each window's count 1 if fully covered or coverage ratio if not entirely covered (for first and last)'''
-                if window == first_window:
-                    overlap = (first_window + 1) * window_size - start                    
-                    windows_counts[window] += overlap / window_size
-                elif window == last_window:
-                    overlap = end - last_window * window_size                    
-                    windows_counts[window] += overlap / window_size
-                else:    
-                    windows_counts[window] += 1.0
-        
-        #round up and add to the dictionnary of repartition per chromosome
-        windows_counts = [round(c, 3) for c in windows_counts]
-        reads_window[chrom] = windows_counts
+            windows.addInterval(chrom, start, end, mapq)
     
-    return reads_window
+    return windows.coverage()
 
 
 def meanMAPQPerWindow(positions, header_parsed, window_size, MAPQ_threshold):
     '''calculate the mean MAPQ per window on each reference'''
-    mapq_window = {chrom: [] for chrom in positions.keys()}
+    windows = WindowAccumulator(header_parsed, window_size, MAPQ_threshold)
 
     for chrom, reads in positions.items():
+        for start, end, mapq in reads:
+            windows.addInterval(chrom, start, end, mapq)
+    
+    return windows.meanMAPQ()
+
+
+def writeDepth(windows, dir_name):
+    '''save the depth per base of each chromosome in a bedGraph file (0-based coordinates, only covered bases)'''
+    for chrom in windows.depth_diff:
+        depth = windows.depth(chrom)
+
+        #runs of bases with the same depth
+        change = np.flatnonzero(np.diff(depth)) + 1
+        starts = np.concatenate(([0], change))
+        ends = np.concatenate((change, [len(depth)]))
+        values = depth[starts]
+        covered = values > 0
+
+        file_name = f"depth_{chrom}.bedgraph"
+        with open(os.path.join(dir_name, file_name), "w") as file:
+            for start, end, value in zip(starts[covered].tolist(), ends[covered].tolist(), values[covered].tolist()):
+                file.write(f"{chrom}\t{start - 1}\t{end - 1}\t{value}\n") #index of the array is the 1-based position
+        print(f"Depth per base along the {chrom} has been saved as \"{file_name}\" in directory \"{dir_name}\".")
+
+
+def writeWindowsMAPQ(windows, dir_name):
+    '''save the mean, min and max MAPQ and the fraction of MAPQ 0 reads of each window in a text file'''
+    file_name = "windows_mapq.txt"
+    mean_mapq = windows.meanMAPQ()
+    min_max = windows.minMaxMAPQ()
+    fraction_mapq0 = windows.fractionMAPQ0()
+
+    with open(os.path.join(dir_name, file_name), "w") as file:
+        file.write("CHR_NAME\tSTART\tMEANQ\tMINQ\tMAXQ\tMAPQ0%\n")
+        for chrom in mean_mapq:
+            min_mapq, max_mapq = min_max[chrom]
+            for window, values in enumerate(zip(mean_mapq[chrom], min_mapq, max_mapq, fraction_mapq0[chrom])):
+                mean, low, high, fraction = values
+                file.write(f"{chrom}\t{window * windows.window_size}\t{mean}\t{low}\t{high}\t{round(100 * fraction, 1)}\n")
+
+    print(f"MAPQ per window has been saved as \"{file_name}\" in directory \"{dir_name}\".")
+
+
+def writeQC(qc, dir_name):
+    '''save the base quality and N content per cycle, the GC, N and mean quality distributions of the reads (qc.txt) and the GC and N content per window (windows_gc.txt)'''
+    cycles = qc.cycleTable()
+    with open(os.path.join(dir_name, "qc.txt"), "w") as fileQC:
+        fileQC.write("=========================================== Base quality and composition of the reads ===========================================\n\n")
+        fileQC.write(f"Reads: {qc.reads} ({qc.qual_reads} with QUAL)\n")
+        if qc.reads:
+            gc_reads = qc.gc_hist.sum()
+            fileQC.write(f"Mean GC%: {round(float(np.dot(np.arange(101), qc.gc_hist)) / gc_reads, 2) if gc_reads else None}\n")
+            fileQC.write(f"Reads with N: {qc.reads - qc.n_hist[0]} ({round(100 * (qc.reads - qc.n_hist[0]) / qc.reads, 2)}%)\n")
+
+        fileQC.write("\nCYCLE\tREADS\tMEANQ\t" + "\t".join(f"Q{percentile}" for percentile in QC_CYCLE_PERCENTILES) + "\tN%\n")
+        for cycle, reads, mean, levels, n_percent in cycles:
+            fileQC.write(f"{cycle}\t{reads}\t{mean}\t" + "\t".join(str(level) for level in levels) + f"\t{n_percent}\n")
+
+        fileQC.write("\nPERCENT\tGC_READS\tN_READS\n")
+        for percent in range(101):
+            fileQC.write(f"{percent}\t{qc.gc_hist[percent]}\t{qc.n_hist[percent]}\n")
+
+        fileQC.write("\nMEANQ\tREADS\n")
+        for quality in np.flatnonzero(qc.read_qual_hist):
+            fileQC.write(f"{quality}\t{qc.read_qual_hist[quality]}\n")
+
+        fileQC.write(f"\nLEGEND:\nCYCLE: Position in the read in the order of sequencing (reverse strand reads are turned back)\nREADS: Reads at least this long\n")
+        fileQC.write(f"MEANQ: Mean base quality (Phred)\nQ<x>: Base quality below or equal to which x% of the bases of the cycle are\n")
+        fileQC.write(f"N%: Percentage of N bases\nGC_READS, N_READS: Reads whose A/C/G/T bases are PERCENT% G or C, reads whose bases are PERCENT% N\n")
+        fileQC.write(f"Secondary and supplementary alignments are not counted, each read is counted once\n")
+        fileQC.write(f"The statistics per cycle stop at cycle {QC_MAX_CYCLES}, the further bases of long reads count in the other statistics only\n")
+
+    with open(os.path.join(dir_name, "windows_gc.txt"), "w") as fileWindows:
+        fileWindows.write("CHR_NAME\tSTART\tBASES\tGC%\tN%\n")
+        for chrom, (gc_percent, n_percent, bases) in qc.windowTable().items():
+            for window in np.flatnonzero(bases):
+                fileWindows.write(f"{chrom}\t{window * qc.window_size}\t{bases[window]}\t{gc_percent[window]}\t{n_percent[window]}\n")
+
+    print(f"Base quality and composition have been saved as \"qc.txt\" and \"windows_gc.txt\" in directory \"{dir_name}\".")
 
-        if not reads: #case chromosome has no reads
-            continue
 
-        length_ref = header_parsed[chrom]
-        nb_windows = (length_ref // window_size) + 1 # calculate the number of windows needed to cover the reference
-        windows_mapq = [[] for _ in range(nb_windows)] # initialize a list to store MAPQ per window
+################ PLOTTING FUNCTION ###############
 
-        # for each read we determine the range of windows it is on
-        for start, end, mapq in reads:
+PLOT_MAX_COLUMNS = 2000 #longer tracks are downsampled to about the width of the plot in pixels
+PLOT_MAX_CONTIGS = 100 #above this number of contigs with reads, they are put end to end in a single genome-wide plot
+GENOME_LABELS = 20 #longest contigs whose borders are drawn and named on the genome-wide plot
 
-            if mapq < MAPQ_threshold: #skip mapq values below threshold
-                continue
 
-            first_window = start // window_size
-            last_window = end // window_size
-            for window in range(first_window, last_window + 1):
+def pyplot():
+    '''import matplotlib on the first plot only, with the Agg backend (no display needed), runs without plots do not pay for it'''
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
 
-                windows_mapq[window].append(mapq)
-        
-        #we calculate the mean MAPQ per window and we add to the dictionnary of repartition per chromosome
-        mean_mapq_counts = []
-        for mapqs in windows_mapq:
-            if mapqs:
-                mean_mapq = sum(mapqs) / len(mapqs)
-                mean_mapq_counts.append(round(mean_mapq, 3))
-            else:
-                mean_mapq_counts.append(0.0)
-        
-        mapq_window[chrom] = mean_mapq_counts
-    
-    return mapq_window
 
+def downsample(values, nb_columns):
+    '''split values in nb_columns consecutive columns (edges) and return their min, max and mean'''
+    values = np.asarray(values, dtype=float)
+    edges = np.linspace(0, len(values), nb_columns + 1).astype(int)
+    starts = edges[:-1]
+    return edges, np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts), np.add.reduceat(values, starts) / np.diff(edges)
 
-################ PLOTTING FUNCTION ###############
 
-def plotReadsPerWindow(reads_window, mapq_window, window_size, dir_name):
-    '''plot the number of reads per window on each chromosome, colored by mean MAPQ'''
+def plotChromosome(chrom, counts, mapq_values, window_size, dir_name, borders=None):
+    '''plot the number of reads per window on one chromosome, colored by mean MAPQ (run in a worker process)
+    borders [(first window, contig name)] are drawn when chrom is made of several contigs put end to end'''
+    plt = pyplot()
+    from matplotlib import cm, colors
 
-    for chrom, counts in reads_window.items():
-        if not counts: #case chromosome has no reads
-            continue
-        
-        mapq_values = mapq_window[chrom]
+    # Normalize MAPQ values for color mapping
+    min_mapq = min(mapq_values)
+    max_mapq = max(mapq_values)
+
+    #create color map
+    colormap = plt.get_cmap('RdYlGn')
 
-        # Normalize MAPQ values for color mapping
-        min_mapq = min(mapq_values)
-        max_mapq = max(mapq_values)
+    # plot
+    fig, ax = plt.subplots(figsize=(10, 5)) 
 
+    if len(counts) <= PLOT_MAX_COLUMNS:
         if max_mapq == min_mapq:
             norm_mapq = [0.5 for x in mapq_values]  # all same color if no variation
         else:
             norm_mapq = [(mapq - min_mapq) / (max_mapq - min_mapq) for mapq in mapq_values]
-
-        #create color map
-        colormap = cm.get_cmap('RdYlGn')
         colors_mapped = [colormap(norm) for norm in norm_mapq]
 
-        # plot
-        fig, ax = plt.subplots(figsize=(10, 5)) 
-
         ax.bar(range(len(counts)), counts, width=1.0, color = colors_mapped, edgecolor='none') #bar plot with colored bars red to green
-        ax.set_xlabel(f'Windows of size {window_size} bp along {chrom}')
-        ax.set_ylabel('Number of reads')
-        ax.set_title(f'Read distribution along {chrom} (colored by mean MAPQ)')
-        ax.set_xticks(ticks=range(0, len(counts), max(1, len(counts)//10)), 
-                   labels=[str(i * window_size) for i in range(0, len(counts), max(1, len(counts)//10))])
-        
-        #colorbar pour MAPQ
-        norm = colors.Normalize(vmin=min_mapq, vmax=max_mapq)
-        sm = cm.ScalarMappable(cmap=colormap, norm=norm)
-        sm.set_array([])
-        cbar = fig.colorbar(sm, ax = ax) #colorbar to show MAPQ scale
-        cbar.set_label('Mean MAPQ per window')
-        
-        plt.grid(axis='y')
-        plt.tight_layout()
-        fig.savefig(os.path.join(dir_name, f"coverage_{chrom}.png"), dpi=300) #save the graph as an image
-        plt.close(fig)
-        print(f"Graph of coverage depth along the {chrom} has been saved as \"coverage_{chrom}.png\" in directory \"{dir_name}\".")
+    else:
+        #one bar per window would be millions of patches: each column of pixels shows the max of its windows colored by their mean MAPQ,
+        #with the mean and the min of the windows as lines
+        edges, low, high, mean = downsample(counts, PLOT_MAX_COLUMNS)
+        mapq_mean = downsample(mapq_values, PLOT_MAX_COLUMNS)[3]
+        norm_mapq = np.full(len(mapq_mean), 0.5) if max_mapq == min_mapq else (mapq_mean - min_mapq) / (max_mapq - min_mapq)
+        x = (edges[:-1] + edges[1:] - 1) / 2
+
+        ax.fill_between(x, low, high, color="lightgrey", linewidth=0)
+        ax.vlines(x, 0, high, colors=colormap(norm_mapq), linewidth=0.5)
+        ax.plot(x, mean, color="black", linewidth=0.3)
+        ax.plot(x, low, color="dimgrey", linewidth=0.3)
+        ax.set_xlim(-0.5, len(counts) - 0.5)
+
+    if borders is not None:
+        for first_window, contig in borders:
+            ax.axvline(first_window - 0.5, color="grey", linewidth=0.3)
+            ax.text(first_window, 1.0, contig, transform=ax.get_xaxis_transform(), rotation=90, fontsize=4, va="top")
+    ax.set_xlabel(f'Windows of size {window_size} bp along {chrom}')
+    ax.set_ylabel('Number of reads')
+    ax.set_title(f'Read distribution along {chrom} (colored by mean MAPQ)')
+    ax.set_xticks(ticks=range(0, len(counts), max(1, len(counts)//10)), 
+               labels=[str(i * window_size) for i in range(0, len(counts), max(1, len(counts)//10))])
+    
+    #colorbar pour MAPQ
+    norm = colors.Normalize(vmin=min_mapq, vmax=max_mapq)
+    sm = cm.ScalarMappable(cmap=colormap, norm=norm)
+    sm.set_array([])
+    cbar = fig.colorbar(sm, ax = ax) #colorbar to show MAPQ scale
+    cbar.set_label('Mean MAPQ per window')
+    
+    plt.grid(axis='y')
+    plt.tight_layout()
+    fig.savefig(os.path.join(dir_name, f"coverage_{chrom}.png"), dpi=300) #save the graph as an image
+    plt.close(fig)
+
+
+def plotGenome(tracks, window_size, dir_name):
+    '''single plot of all the contigs with reads put end to end (draft assemblies), the borders of the GENOME_LABELS longest ones are drawn'''
+    starts = np.cumsum([0] + [len(counts) for _, counts, _ in tracks[:-1]])
+    longest = sorted(range(len(tracks)), key=lambda i: len(tracks[i][1]), reverse=True)[:GENOME_LABELS]
+    borders = [(int(starts[i]), tracks[i][0]) for i in sorted(longest)]
+    counts = np.concatenate([np.asarray(counts, dtype=float) for _, counts, _ in tracks])
+    mapq_values = np.concatenate([np.asarray(mapq_values, dtype=float) for _, _, mapq_values in tracks])
+    plotChromosome("genome", counts, mapq_values, window_size, dir_name, borders)
+    print(f"Graph of coverage depth along the {len(tracks)} contigs put end to end has been saved as \"coverage_genome.png\" in directory \"{dir_name}\".")
+
+
+def plotReadsPerWindow(reads_window, mapq_window, window_size, dir_name, workers=None):
+    '''plot the number of reads per window on each chromosome, colored by mean MAPQ, chromosomes are drawn by a pool of processes
+    above PLOT_MAX_CONTIGS chromosomes they are drawn end to end in a single plot (see plotGenome)'''
+    tracks = [(chrom, counts, mapq_window[chrom]) for chrom, counts in reads_window.items() if counts] #skip chromosomes without reads
+    if len(tracks) > PLOT_MAX_CONTIGS:
+        plotGenome(tracks, window_size, dir_name)
+        return
+    if workers is None:
+        workers = min(len(tracks), os.cpu_count() or 1)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(plotChromosome, chrom, counts, mapq_values, window_size, dir_name) for chrom, counts, mapq_values in tracks]
+            for (chrom, _, _), future in zip(tracks, futures):
+                future.result()
+                print(f"Graph of coverage depth along the {chrom} has been saved as \"coverage_{chrom}.png\" in directory \"{dir_name}\".")
+    else:
+        for chrom, counts, mapq_values in tracks:
+            plotChromosome(chrom, counts, mapq_values, window_size, dir_name)
+            print(f"Graph of coverage depth along the {chrom} has been saved as \"coverage_{chrom}.png\" in directory \"{dir_name}\".")
+
+
+def plotQuality(cycles, dir_name):
+    '''plot the base quality along the cycles (QCAccumulator.cycleTable): median, 25-75% and 10-90% of the bases and mean'''
+    cycles = [row for row in cycles if row[2] is not None]
+    if not cycles:
+        return
+    plt = pyplot()
+    x = [row[0] for row in cycles]
+    low, q1, median, q3, high = ([row[3][i] for row in cycles] for i in range(len(QC_CYCLE_PERCENTILES)))
+
+    fig, ax = plt.subplots(figsize=(10, 5))
+    ax.fill_between(x, low, high, color="lightgrey", linewidth=0, label="10-90% of the bases")
+    ax.fill_between(x, q1, q3, color="gold", linewidth=0, label="25-75% of the bases")
+    ax.plot(x, median, color="red", linewidth=0.8, label="Median")
+    ax.plot(x, [row[2] for row in cycles], color="blue", linewidth=0.8, label="Mean")
+    ax.set_xlabel('Cycle (position in the read)')
+    ax.set_ylabel('Base quality (Phred)')
+    ax.set_title('Base quality per cycle')
+    ax.set_ylim(bottom=0)
+    ax.legend(loc="lower left")
+    plt.grid(axis='y')
+    plt.tight_layout()
+    fig.savefig(os.path.join(dir_name, "quality_per_cycle.png"), dpi=300)
+    plt.close(fig)
+    print(f"Graph of base quality per cycle has been saved as \"quality_per_cycle.png\" in directory \"{dir_name}\".")
 
  
 
 ################ MAIN FUNCTION ###############
 
-def main():
-    if len(sys.argv) < 2:
-        print("Your entry should be: python3 mapping_test.py file.sam")
+def parseArguments():
+    '''command line options, a JSON config file (--config) gives default values to any of them'''
+    parser = argparse.ArgumentParser(description="Analyse the content of SAM mapping files.")
+    parser.add_argument("input_files", nargs="*", help=f"SAM files to analyse, {STDIN} reads a SAM stream from stdin")
+    parser.add_argument("--sample-sheet", help="tab separated file with one sample per line: name and path of its SAM file (or only the path)")
+    parser.add_argument("--config", help="JSON file of option values, ex. {\"window_size\": 10000, \"workers\": 8}")
+    parser.add_argument("--batch", action="store_true", help="do not ask anything, use the options or their default values")
+
+    #settings asked interactively, giving any of them runs the batch mode
+    parser.add_argument("--mapq", type=int, help="MAPQ threshold to filter reads (default none)")
+    parser.add_argument("--fully-mapped", action="store_true", default=None, help="consider only fully mapped reads")
+    parser.add_argument("--window-size", type=int, help="window size for read distribution (default 30000)")
+    parser.add_argument("--short-size", type=int, help="threshold size for small alignments (default 80)")
+    parser.add_argument("--long-size", type=int, help="threshold size for long alignments (default 200)")
+    parser.add_argument("--exclude-flags", type=flagMask, default=0, help=f"skip the reads with any of these FLAG bits: a number (ex. 0xD00) or names ({','.join(FLAG_NAMES)}), default none")
+    parser.add_argument("--require-flags", type=flagMask, default=0, help="keep only the reads with all of these FLAG bits, same values as --exclude-flags (default none)")
+    parser.add_argument("--min-contig-length", type=int, help=f"contigs shorter than this are pooled in one \"{OTHER_CONTIGS}\" row of the summary (default: the {MANY_CONTIGS} longest references have their own row, 0 for all)")
+    parser.add_argument("--output", help="name of the summary file, also used for the output directory (default summary.txt)")
+
+    parser.add_argument("--length-percentiles", type=lambda value: [float(percent) for percent in value.split(",")], default=[5, 25, 75, 95],
+                        help="percentiles of the alignment lengths saved in lengths.txt with the median and N50 (default 5,25,75,95)")
+    parser.add_argument("--region", help="analyse only the reads overlapping chr:start-end (1-based) or a whole chromosome, the file is indexed on the first use")
+    parser.add_argument("--cache", action="store_true", help="read and write the coverage cache (the first run is slower, the next runs with other window sizes do not read the SAM file)")
+    parser.add_argument("--cache-dir", help=f"directory of the coverage cache, implies --cache (default {CACHE_DIR} next to each SAM file, or ~/.cache/{USER_CACHE_DIR} if its directory cannot be written)")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes parsing the files in parallel (default 1)")
+    parser.add_argument("--no-pipeline", action="store_true", help="draw the plots after the whole file is read (by default the chromosomes of a coordinate-sorted file are plotted while it is read)")
+    parser.add_argument("--depth", action="store_true", help="also compute the depth of each base and save it as bedGraph files")
+    parser.add_argument("--mapq-extras", action="store_true", help="also compute the min/max MAPQ and the fraction of MAPQ 0 reads per window")
+    parser.add_argument("--qc", action="store_true", help="also compute the base quality per cycle and the GC and N content of the reads and of each window from SEQ and QUAL")
+    parser.add_argument("--validate", choices=VALIDATION_MODES, default="head", help="lines checked against the SAM format: none, the first ones, a random sample or all of them (default head)")
+    parser.add_argument("--validate-lines", type=int, default=50, help="number of lines checked with --validate head (default 50)")
+    parser.add_argument("--validate-rate", type=float, default=0.01, help="fraction of the lines checked with --validate sample (default 0.01)")
+    parser.add_argument("--snapshot-reads", type=int, help=f"with {STDIN}: write a partial summary every N reads (default none)")
+    parser.add_argument("--snapshot-seconds", type=float, default=60, help=f"with {STDIN}: write a partial summary every T seconds, 0 for none (default 60)")
+    parser.add_argument("--sample", type=int, help="fast preview: estimate the summary from about N reads read at random places of the file (plain or BGZF SAM), no plots")
+    parser.add_argument("--sample-seed", type=int, default=0, help="random seed of --sample (default 0)")
+    parser.add_argument("--resume", action="store_true", help=f"save the statistics in {CHECKPOINT_NAME} in the output directory while reading, and read only the bytes added since the last checkpoint (plain SAM files)")
+    parser.add_argument("--follow", action="store_true", help="with --resume: keep reading the lines appended to the file and update the results until Ctrl-C")
+    parser.add_argument("--checkpoint-seconds", type=float, default=CHECKPOINT_SECONDS, help=f"time between two checkpoints with --resume (default {CHECKPOINT_SECONDS})")
+    parser.add_argument("--follow-interval", type=float, default=10, help="time between two looks at the file with --follow (default 10)")
+    parser.add_argument("--progress", choices=("auto", "on", "off"), default="auto", help="show the progress of the reading on stderr, auto: only in a terminal (default auto)")
+    parser.add_argument("--metrics", action="store_true", help="save the wall time, CPU time, records and peak memory of each stage in metrics.json next to the summary")
+    parser.add_argument("--max-pending-mates", type=int, default=MAX_PENDING_MATES, help=f"unresolved mates kept in memory before spilling them to temporary files (default {MAX_PENDING_MATES})")
+
+    config, remaining = parser.parse_known_args()
+    if config.config is not None:
+        with open(config.config, "r") as file:
+            parser.set_defaults(**{key.replace("-", "_"): value for key, value in json.load(file).items()})
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error("--workers must be a positive integer")
+    if args.window_size is not None and args.window_size <= 0:
+        parser.error("--window-size must be a positive integer")
+    if any(not (0 <= percent <= 100) for percent in args.length_percentiles):
+        parser.error("--length-percentiles must be between 0 and 100")
+    if args.mapq is not None and not (0 <= args.mapq <= 60):
+        parser.error("--mapq must be between 0 and 60")
+    if not args.input_files and args.sample_sheet is None:
+        parser.error("give at least one SAM file or a --sample-sheet")
+    if STDIN in args.input_files and (len(args.input_files) > 1 or args.sample_sheet is not None):
+        parser.error(f"{STDIN} (stdin) cannot be analysed with other files")
+    args.resume = args.resume or args.follow
+    if args.resume and (args.region is not None or STDIN in args.input_files):
+        parser.error("--resume and --follow cannot be used with --region nor with stdin")
+    if args.follow and (len(args.input_files) > 1 or args.sample_sheet is not None):
+        parser.error("--follow reads a single file")
+    if args.sample is not None and (args.sample <= 0 or args.resume or args.region is not None or STDIN in args.input_files):
+        parser.error("--sample must be a positive number of reads and cannot be used with --resume, --region nor stdin")
+
+    return args
+
+
+def collectSamples(args):
+    '''samples to analyse [(name, path)] from the command line and the sample sheet'''
+    samples = [(os.path.basename(path).split(".")[0] if path != STDIN else "stdin", path) for path in args.input_files]
+
+    if args.sample_sheet is not None:
+        sheet_dir = os.path.dirname(args.sample_sheet)
+        with open(args.sample_sheet, "r") as file:
+            for line in file:
+                if not line.strip() or line.startswith("#"): #skip empty lines and comments
+                    continue
+                fields = line.rstrip("\n").split("\t")
+                path = os.path.join(sheet_dir, fields[-1]) #paths are relative to the sample sheet
+                name = fields[0] if len(fields) > 1 else os.path.basename(path).split(".")[0]
+                samples.append((name, path))
+
+    names = [name for name, path in samples]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        print(f"Sample names must be unique: {', '.join(duplicates)}")
         sys.exit(1)
 
-    input_file = sys.argv[1]
-    
-    ## Check input file existence and extension ##
+    return samples
+
+
+INPUT_EXTENSIONS = (".sam", ".sam.gz", ".sam.bgz", ".bam")
+
+
+def checkInput(input_file):
+    '''exit if the input file does not exist or is not a SAM file'''
+    if input_file == STDIN:
+        return
     if not os.path.exists(input_file): #check existence
-        print("No file found")
+        print(f"No file found: {input_file}")
         sys.exit(1)
-    if not input_file.endswith(".sam"): #check extension
-        print("File must be in .sam format")
+    if not input_file.endswith(INPUT_EXTENSIONS): #check extension
+        print(f"File must be in .sam format (or .sam.gz, .sam.bgz, .bam): {input_file}")
         sys.exit(1)
-    
-    header_parsed = parse_header(input_file) #extract SN and LN for each chromosom (necessary to check plotting parameters input by user are correct)
 
-    ## User inputs ##
+
+def askSettings(header_parsed):
+    '''ask the settings of the analysis to the user (filterMAPQ, fullyMappedOnly, window_size, short_size, long_size, file_name)'''
 
     #Do you want to use default settings?
     defSettingsInput = input("Do you want to use default settings? (YES/no)")
@@ -676,31 +3566,424 @@ def main():
     
     file_name = file_name_input
 
+    return filterMAPQ, fullyMappedOnly, window_size, short_size, long_size, file_name
+
+
+def outputNames(file_name):
+    '''summary file name with its .txt extension and the directory where the results are saved'''
     if not file_name.endswith(".txt"):
         file_name += ".txt" 
     
     dir_name = file_name.split(".")[0] #we create a subdirectory where we will save the graphs and summary (but we don't want it named as file bc it would cause errors!)
+    return file_name, dir_name
+
+
+def analysisOptions(args, input_file, cache_path=None, order=None):
+    '''options of SamStats given on the command line, fine coverage bins are kept when the results go to the cache
+    the sort order is read in the header of input_file, or given as order for stdin'''
+    return {"per_base": args.depth, "mapq_extras": args.mapq_extras, "sort_order": sort_order(input_file) if input_file != STDIN else order, "max_pending": args.max_pending_mates,
+            "validation": Validation(args.validate, args.validate_lines, args.validate_rate), "bin_size": CACHE_BIN_SIZE if cache_path else None, "flag_filter": flagFilter(args), "qc": args.qc}
+
+
+def flagFilter(args):
+    '''(excluded, required) FLAG bits given on the command line'''
+    return args.exclude_flags, args.require_flags
+
+
+def cacheFor(args, input_file, filterMAPQ, fullyMappedOnly, MAPQ_threshold, short_size, long_size, region):
+    '''path of the coverage cache of the analysis (None without --cache or with --resume), every setting but the window size and the short/long sizes is part of its key'''
+    if not (args.cache or args.cache_dir) or args.resume: #a resumed file is growing, the checkpoint plays the part of the cache
+        return None
+    settings = {"filterMAPQ": filterMAPQ, "fullyMappedOnly": fullyMappedOnly, "MAPQ_threshold": MAPQ_threshold, "region": region, "flags": list(flagFilter(args)), "validation": [args.validate, args.validate_lines, args.validate_rate]}
+    return cachePath(input_file, settings, args.cache_dir)
+
+
+def cachedStats(args, cache_path, window_size):
+    '''results of the analysis read from the cache, None if they have to be computed (the per base depth, MAPQ extras and QC are not cached)'''
+    if cache_path is None or args.depth or args.mapq_extras or args.qc:
+        return None
+    stats = loadCache(cache_path, window_size)
+    if stats is not None:
+        print(f"Results read from the coverage cache \"{cache_path}\", the SAM file is not read.")
+    return stats
+
+
+def regionHeader(args, header_parsed):
+    '''region asked with --region and the header reduced to its chromosome, (None, header_parsed) without region'''
+    if args.region is None:
+        return None, header_parsed
+    try:
+        region = parseRegion(args.region, header_parsed)
+    except ValueError as error:
+        print(f"Invalid region: {error}")
+        sys.exit(1)
+    return region, {region[0]: header_parsed[region[0]]}
+
+
+def indexMain(paths):
+    '''samreader.py index file.sam [file.sam...]: build the sidecar index of each file'''
+    if not paths:
+        print("Usage: samreader.py index file.sam [file.sam...]")
+        sys.exit(1)
+    for path in paths:
+        checkInput(path)
+        try:
+            write_index(path)
+        except ValueError as error:
+            print(error)
+            sys.exit(1)
+
+
+def progressFor(args, total_bytes, shared=False):
+    '''Progress of the reading of total_bytes as asked with --progress, None when it is not shown'''
+    if args.progress == "off" or (args.progress == "auto" and not sys.stderr.isatty()):
+        return None
+    return Progress(total_bytes, shared=shared)
+
+
+def readSize(input_file, region):
+    '''bytes of the file read for the analysis (only the span of the region with --region)'''
+    return inputSize(input_file, *regionSpan(input_file, region)) if region is not None else inputSize(input_file)
+
+
+def writeResults(stats, file_name, dir_name, window_size, short_size, long_size, MAPQ_threshold, args, metrics=None, sample=None, plots=None):
+    '''save the summary, the plots and the optional outputs of one SAM file, return the summary table
+    the chromosomes already plotted while reading (PlotPipeline) are not plotted again'''
     os.makedirs(dir_name, exist_ok = True) #exist_ok avoids error if directory already exist
+    metrics = metrics if metrics is not None else Metrics()
+
+    with metrics.stage("windows", sample):
+        reads_window = stats.windows.coverage()
+        mapq_window = stats.windows.meanMAPQ()
+    with metrics.stage("summary", sample):
+        groups, min_length = contigGroups(stats.header_parsed, args.min_contig_length)
+        stat_alignment = stats.alignment.result(short_size, long_size, groups)
+        stat_indel = stats.indel.result(groups)
+        paired_orientation = stats.pairs.result(groups)
+        count_chrom = stats.chrom.result(groups)
+        count_mapq = stats.mapq.result(groups)
+
+        if stats.validation.nbErrors():
+            stats.validation.write(dir_name)
+
+        table = Summary(file_name, dir_name, paired_orientation, count_chrom, count_mapq, stat_alignment, short_size, long_size, MAPQ_threshold, stat_indel,
+                        (len(groups), min_length) if groups else None)
+    with metrics.stage("lengths", sample):
+        writeLengths(stats.alignment, dir_name, args.length_percentiles, groups)
+    with metrics.stage("plots", sample) as stage:
+        plotted = plots.close() if plots is not None else set()
+        plotReadsPerWindow({chrom: counts for chrom, counts in reads_window.items() if chrom not in plotted}, mapq_window, window_size, dir_name)
+        stage["records"] = len(reads_window) #one plot per chromosome
+    if args.depth:
+        with metrics.stage("depth", sample):
+            writeDepth(stats.windows, dir_name)
+    if args.mapq_extras:
+        with metrics.stage("mapq extras", sample):
+            writeWindowsMAPQ(stats.windows, dir_name)
+    if args.qc:
+        with metrics.stage("qc", sample):
+            writeQC(stats.qc, dir_name)
+            plotQuality(stats.qc.cycleTable(), dir_name)
+
+    return table
+
+
+def plotPipeline(args, options, dir_name, window_size, region, header_parsed):
+    '''PlotPipeline drawing the plots while the file is read, only for a whole coordinate-sorted file with one plot per chromosome (None otherwise)
+    the CPU reading the file is left to it, with a single CPU the plots would only slow the reading down'''
+    workers = (os.cpu_count() or 1) - 1
+    if args.no_pipeline or workers < 1 or region is not None or options["sort_order"] != "coordinate" or len(header_parsed) > PLOT_MAX_CONTIGS:
+        return None
+    return PlotPipeline(window_size, dir_name, workers)
+
+
+def runSettings(filterMAPQ, fullyMappedOnly, window_size, MAPQ_threshold, short_size, long_size, args):
+    '''settings of the run saved with the metrics'''
+    return {"filterMAPQ": filterMAPQ, "fullyMappedOnly": fullyMappedOnly, "window_size": window_size, "MAPQ_threshold": MAPQ_threshold,
+            "short_size": short_size, "long_size": long_size, "region": args.region, "workers": args.workers, "validate": args.validate, "flags": list(flagFilter(args))}
+
+
+def runPreview(args, input_file, header_parsed, filterMAPQ, fullyMappedOnly, MAPQ_threshold, short_size, long_size, file_name, dir_name, metrics, sample=None):
+    '''--sample: summary of input_file estimated from a random sample of its reads, return the table as Summary'''
+    os.makedirs(dir_name, exist_ok = True)
+    with metrics.stage("sample", sample) as stage:
+        try:
+            stats = sampleStats(input_file, header_parsed, filterMAPQ, fullyMappedOnly, MAPQ_threshold, short_size, long_size, args.sample, args.sample_seed, flag_filter=flagFilter(args))
+        except ValueError as error:
+            print(f"{error}: {input_file}")
+            sys.exit(1)
+        stage["records"] = sum(stats.run_lines)
+    with metrics.stage("summary", sample):
+        return writePreview(stats, file_name, dir_name, MAPQ_threshold, contigGroups(header_parsed, args.min_contig_length)[0])
+
+
+def checkpointSettings(args, filterMAPQ, fullyMappedOnly, window_size, MAPQ_threshold, short_size, long_size):
+    '''settings a checkpoint must have been made with to be resumed'''
+    return {"filterMAPQ": filterMAPQ, "fullyMappedOnly": fullyMappedOnly, "window_size": window_size, "MAPQ_threshold": MAPQ_threshold,
+            "depth": args.depth, "mapq_extras": args.mapq_extras, "qc": args.qc, "flags": list(flagFilter(args)),
+            "validation": [args.validate, args.validate_lines, args.validate_rate]}
+
+
+def followFile(args, checkpoint, read_range, write):
+    '''--follow: read the lines appended to the file every --follow-interval seconds and write the results again, until Ctrl-C'''
+    print(f"Following \"{checkpoint.input_file}\", press Ctrl-C to stop.")
+    try:
+        while True:
+            time.sleep(args.follow_interval)
+            if not checkpoint.unchanged():
+                print("The file was truncated or replaced, it is not followed anymore.")
+                return
+            if readAppended(checkpoint, read_range, args.checkpoint_seconds):
+                write(checkpoint.stats)
+    except KeyboardInterrupt:
+        print("\nStopped following the file.")
+
+
+def runResume(args, input_file, header_parsed, filterMAPQ, fullyMappedOnly, window_size, MAPQ_threshold, short_size, long_size, dir_name, write, metrics, sample=None):
+    '''--resume: statistics of input_file continued from the checkpoint of dir_name and written with write(stats), --follow then keeps reading the file'''
+    checkpoint = Checkpoint(os.path.join(dir_name, CHECKPOINT_NAME), input_file, checkpointSettings(args, filterMAPQ, fullyMappedOnly, window_size, MAPQ_threshold, short_size, long_size))
+    if checkpoint.load():
+        print(f"Resuming from the checkpoint at byte {checkpoint.offset:,} of \"{input_file}\".")
+    settings = (header_parsed, filterMAPQ, fullyMappedOnly, window_size, MAPQ_threshold, short_size, long_size)
+    options = analysisOptions(args, input_file)
+    progress = progressFor(args, completeEnd(input_file, checkpoint.offset) - checkpoint.offset, shared=args.workers > 1)
+
+    with (ProcessPoolExecutor(max_workers=args.workers, initializer=setWorkerProgress, initargs=(progress,)) if args.workers > 1 else contextlib.nullcontext()) as pool:
+        def read_range(start, end):
+            '''statistics of the byte range [start, end[, split between the processes of the pool with --workers'''
+            if pool is None:
+                return rangeStats(input_file, start, end, *settings, None, options, progress)
+            futures = [pool.submit(rangeStats, input_file, range_start, range_end, *settings, None, options)
+                       for range_start, range_end in split_ranges(input_file, args.workers, start, end)]
+            return mergeFutures(futures, progress)
+
+        with metrics.stage("reads", sample) as stage:
+            stage["bytes"] = readAppended(checkpoint, read_range, args.checkpoint_seconds)
+            stage["records"] = nbRecords(checkpoint.stats) #reads of the checkpoint included
+        if progress is not None:
+            progress.finish()
+            progress = None #the appended lines are not shown
+        write(checkpoint.stats)
+
+        if args.follow:
+            followFile(args, checkpoint, read_range, write)
+
+
+def batchSettings(args):
+    '''settings given on the command line or their default values (filterMAPQ, fullyMappedOnly, window_size, short_size, long_size, MAPQ_threshold, file_name, dir_name)'''
+    filterMAPQ = args.mapq
+    fullyMappedOnly = bool(args.fully_mapped)
+    window_size = args.window_size if args.window_size is not None else 30000
+    short_size = args.short_size if args.short_size is not None else 80
+    long_size = args.long_size if args.long_size is not None else 200
+    MAPQ_threshold = filterMAPQ if filterMAPQ is not None else 0 #default threshold
+    file_name, dir_name = outputNames(args.output if args.output is not None else "summary.txt")
+    return filterMAPQ, fullyMappedOnly, window_size, short_size, long_size, MAPQ_threshold, file_name, dir_name
+
+
+def runBatch(args, samples):
+    '''analyse all the samples without asking anything, the byte ranges of all the files share one pool of processes'''
+    filterMAPQ, fullyMappedOnly, window_size, short_size, long_size, MAPQ_threshold, file_name, dir_name = batchSettings(args)
+
+    metrics = Metrics()
+    settings = {}
+    regions = {}
+    caches = {}
+    for name, path in samples:
+        with metrics.stage("header", name):
+            regions[name], header_parsed = regionHeader(args, parse_header(path))
+        settings[name] = (header_parsed, filterMAPQ, fullyMappedOnly, window_size, MAPQ_threshold, short_size, long_size)
+        caches[name] = cacheFor(args, path, filterMAPQ, fullyMappedOnly, MAPQ_threshold, short_size, long_size, regions[name])
+
+    def sampleDir(name):
+        return dir_name if len(samples) == 1 else os.path.join(dir_name, name) #one subdirectory per sample
+
+    cached = {}
+    for name, path in samples:
+        with metrics.stage("cache lookup", name):
+            cached[name] = cachedStats(args, caches[name], window_size) if not args.sample else None
+    sizes = {name: readSize(path, regions[name]) for name, path in samples if cached[name] is None and not (args.resume or args.sample)}
+    progress = progressFor(args, sum(sizes.values()), shared=args.workers > 1) if sizes else None
+
+    def readStats(name, read):
+        '''statistics of one sample computed by read(), timed and saved in the cache'''
+        with metrics.stage("reads", name) as stage:
+            stats = read()
+            stage["records"], stage["bytes"] = nbRecords(stats), sizes[name]
+        if caches[name] is not None:
+            with metrics.stage("cache write", name):
+                saveCache(caches[name], stats)
+        return stats
+
+    tables = {}
+    if args.sample:
+        for name, path in samples:
+            print(f"Sample {name} ({path}):")
+            tables[name] = runPreview(args, path, settings[name][0], filterMAPQ, fullyMappedOnly, MAPQ_threshold, short_size, long_size, file_name, sampleDir(name), metrics, name)
+    elif args.resume:
+        for name, path in samples:
+            print(f"Sample {name} ({path}):")
+            def write(stats, name=name):
+                tables[name] = writeResults(stats, file_name, sampleDir(name), window_size, short_size, long_size, MAPQ_threshold, args, metrics, name)
+            runResume(args, path, *settings[name], sampleDir(name), write, metrics, name)
+    elif args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=setWorkerProgress, initargs=(progress,)) as pool:
+            #every file is split so that the pool stays busy, results are written sample after sample as soon as they are merged
+            futures = {name: submitRanges(pool, path, args.workers, *settings[name], regions[name], **analysisOptions(args, path, caches[name]))
+                       for name, path in samples if cached[name] is None}
+            for name, path in samples:
+                print(f"Sample {name} ({path}):")
+                stats = cached[name]
+                if stats is None:
+                    stats = readStats(name, lambda: mergeFutures(futures.pop(name), progress))
+                tables[name] = writeResults(stats, file_name, sampleDir(name), window_size, short_size, long_size, MAPQ_threshold, args, metrics, name)
+    else:
+        for name, path in samples:
+            print(f"Sample {name} ({path}):")
+            stats = cached[name]
+            plots = None
+            if stats is None:
+                options = analysisOptions(args, path, caches[name])
+                plots = plotPipeline(args, options, sampleDir(name), window_size, regions[name], settings[name][0])
+                stats = readStats(name, lambda: streamStats(path, *settings[name], regions[name], progress, plots, **options))
+            tables[name] = writeResults(stats, file_name, sampleDir(name), window_size, short_size, long_size, MAPQ_threshold, args, metrics, name, plots)
+    if progress is not None:
+        progress.finish()
+
+    if len(samples) > 1:
+        with metrics.stage("matrix"):
+            writeMatrix(dir_name, tables)
+    if args.metrics:
+        metrics.write(os.path.join(dir_name, "metrics.json"), samples=dict(samples),
+                      settings=runSettings(filterMAPQ, fullyMappedOnly, window_size, MAPQ_threshold, short_size, long_size, args))
+
+
+def writeSnapshot(stats, nb_reads, file_name, dir_name, short_size, long_size, MAPQ_threshold, min_contig_length=None):
+    '''partial summary of the reads accumulated so far, replaced at once so that it can be read at any time'''
+    groups, min_length = contigGroups(stats.header_parsed, min_contig_length)
+    with contextlib.redirect_stdout(io.StringIO()): #Summary tells where it saved the file
+        Summary("." + file_name, dir_name, stats.pairs.result(groups), stats.chrom.result(groups), stats.mapq.result(groups), stats.alignment.result(short_size, long_size, groups),
+                short_size, long_size, MAPQ_threshold, stats.indel.result(groups), (len(groups), min_length) if groups else None)
+    os.replace(os.path.join(dir_name, "." + file_name), os.path.join(dir_name, "partial_" + file_name))
+    print(f"Partial summary after {nb_reads:,} reads saved as \"partial_{file_name}\" in directory \"{dir_name}\".", flush=True)
+
+
+def runStream(args):
+    '''analyse a SAM stream read once from stdin without asking anything (stdin is the data), partial summaries are written while reading'''
+    filterMAPQ, fullyMappedOnly, window_size, short_size, long_size, MAPQ_threshold, file_name, dir_name = batchSettings(args)
+    if args.workers > 1:
+        print("stdin is read by a single process, --workers is ignored.")
+
+    metrics = Metrics()
+    progress = progressFor(args, None)
+    with metrics.stage("header"):
+        header, lines = read_stream(sys.stdin.buffer, progress)
+        header_parsed = header_lengths(header)
+        region, header_parsed = regionHeader(args, header_parsed)
+    if not header_parsed:
+        print("No @SQ line in the header of stdin, the lengths of the references are unknown.")
+        sys.exit(1)
+
+    os.makedirs(dir_name, exist_ok = True)
+    stats = SamStats(header_parsed, window_size, MAPQ_threshold, short_size, long_size, **analysisOptions(args, STDIN, order=header_sort_order(header)))
+
+    def snapshot(stats, nb_reads):
+        with metrics.stage("snapshot"):
+            writeSnapshot(stats, nb_reads, file_name, dir_name, short_size, long_size, MAPQ_threshold, args.min_contig_length)
+
+    with metrics.stage("reads") as stage:
+        #the region is only a filter here: without an index every read of the stream is parsed
+        #the header lines go through the validation as in a file
+        reads = parse_lines(itertools.chain((line.encode() for line in header), lines), filterMAPQ, fullyMappedOnly, stats.validation, region, flag_filter=stats.flag_filter)
+        accumulateSnapshots(reads, stats, snapshot, args.snapshot_reads, args.snapshot_seconds)
+        stage["records"] = nbRecords(stats)
+        if progress is not None:
+            stage["bytes"] = progress.counters[0]
+            progress.finish()
+
+    writeResults(stats, file_name, dir_name, window_size, short_size, long_size, MAPQ_threshold, args, metrics)
+    if args.metrics:
+        metrics.write(os.path.join(dir_name, "metrics.json"), samples={"stdin": STDIN},
+                      settings=runSettings(filterMAPQ, fullyMappedOnly, window_size, MAPQ_threshold, short_size, long_size, args))
+
+
+def main():
+    if sys.argv[1:2] == ["index"]: #subcommand
+        indexMain(sys.argv[2:])
+        return
+
+    args = parseArguments()
+    samples = collectSamples(args)
+
+    ## Check input file existence and extension ##
+    for name, input_file in samples:
+        checkInput(input_file)
+        if args.resume and fileFormat(input_file) != "sam":
+            print(f"Only plain SAM files can be resumed: {input_file}")
+            sys.exit(1)
+
+    if samples[0][1] == STDIN:
+        runStream(args)
+        return
+
+    #any setting given on the command line (or several files) means there is nobody to answer the questions
+    batch = args.batch or len(samples) > 1 or args.config is not None or any(value is not None for value in
+            (args.mapq, args.fully_mapped, args.window_size, args.short_size, args.long_size, args.output))
+    if batch:
+        runBatch(args, samples)
+        return
+
+    input_file = samples[0][1]
+    metrics = Metrics()
+    with metrics.stage("header"):
+        header_parsed = parse_header(input_file) #extract SN and LN for each chromosom (necessary to check plotting parameters input by user are correct)
+        region, header_parsed = regionHeader(args, header_parsed)
+
+    ## User inputs ##
+    filterMAPQ, fullyMappedOnly, window_size, short_size, long_size, file_name = askSettings(header_parsed)
+    file_name, dir_name = outputNames(file_name)
   
     ## Analysis of filtered data ##
-    reads_extract = sam_reader(input_file, header_parsed, filterMAPQ, fullyMappedOnly) #reads with user filtering
-
     if filterMAPQ is None:
         MAPQ_threshold = 0 #default threshold
     else:
         MAPQ_threshold = filterMAPQ
-           
-    positions = positionsReads(reads_extract)
-    reads_window = readsPerWindow(positions, header_parsed, window_size)
-    mapq_window = meanMAPQPerWindow(positions, header_parsed, window_size, MAPQ_threshold)
-    stat_alignment = statAlignment(reads_extract, short_size, long_size)
-    stat_indel = statIndel(reads_extract)
-    paired_orientation = readFlag(reads_extract)
-    count_chrom = readCHROM(reads_extract)
-    count_mapq = readMAPQ(reads_extract, MAPQ_threshold)
-
-    Summary(file_name, dir_name, paired_orientation, count_chrom, count_mapq, stat_alignment, short_size, long_size, MAPQ_threshold, stat_indel)
-    plotReadsPerWindow(reads_window, mapq_window, window_size, dir_name)            
+
+    if args.sample:
+        runPreview(args, input_file, header_parsed, filterMAPQ, fullyMappedOnly, MAPQ_threshold, short_size, long_size, file_name, dir_name, metrics)
+    elif args.resume:
+        runResume(args, input_file, header_parsed, filterMAPQ, fullyMappedOnly, window_size, MAPQ_threshold, short_size, long_size, dir_name,
+                  lambda stats: writeResults(stats, file_name, dir_name, window_size, short_size, long_size, MAPQ_threshold, args, metrics), metrics)
+    else:
+        #a previous analysis with the same settings gives the results for any window size
+        plots = None
+        with metrics.stage("cache lookup"):
+            cache_path = cacheFor(args, input_file, filterMAPQ, fullyMappedOnly, MAPQ_threshold, short_size, long_size, region)
+            stats = cachedStats(args, cache_path, window_size)
+
+        #single pass over the file, every statistic is accumulated read by read
+        if stats is None:
+            with metrics.stage("reads") as stage:
+                options = analysisOptions(args, input_file, cache_path)
+                stage["bytes"] = readSize(input_file, region)
+                progress = progressFor(args, stage["bytes"], shared=args.workers > 1)
+                if args.workers > 1:
+                    stats = parallelStats(input_file, header_parsed, filterMAPQ, fullyMappedOnly, window_size, MAPQ_threshold, short_size, long_size, args.workers, region, progress, **options)
+                else:
+                    plots = plotPipeline(args, options, dir_name, window_size, region, header_parsed)
+                    stats = streamStats(input_file, header_parsed, filterMAPQ, fullyMappedOnly, window_size, MAPQ_threshold, short_size, long_size, region, progress, plots, **options) #reads with user filtering
+                if progress is not None:
+                    progress.finish()
+                stage["records"] = nbRecords(stats)
+            if cache_path is not None:
+                with metrics.stage("cache write"):
+                    saveCache(cache_path, stats)
+
+        writeResults(stats, file_name, dir_name, window_size, short_size, long_size, MAPQ_threshold, args, metrics, plots=plots)
+
+    if args.metrics:
+        metrics.write(os.path.join(dir_name, "metrics.json"), samples={samples[0][0]: input_file},
+                      settings=runSettings(filterMAPQ, fullyMappedOnly, window_size, MAPQ_threshold, short_size, long_size, args))
 
 ############### LAUNCH THE SCRIPT ###############
 
@@ -0,0 +1,148 @@
+'''small synthetic SAM files and the results of samreader.py on them, shared by the tests'''
+import contextlib
+import gzip
+import io
+import os
+import re
+import struct
+import sys
+import zlib
+from unittest import mock
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import benchmark
+import samreader
+
+CHROMOSOMES = benchmark.chromosomeList(3, 200000)
+WINDOW_SIZE = 1000
+SHORT_SIZE, LONG_SIZE = 80, 200
+
+
+def writeSam(path, nb_reads=3000, sort="unsorted", seed=1, **settings):
+    '''deterministic synthetic SAM file (see benchmark.SamGenerator)'''
+    return benchmark.SamGenerator(nb_reads, CHROMOSOMES, sort=sort, seed=seed, **settings).write(path)
+
+
+def sortByName(source, path):
+    '''copy of the SAM file sorted by QNAME, the mates of a template are consecutive'''
+    with open(source) as file:
+        lines = file.readlines()
+    header = [line.replace("SO:unsorted", "SO:queryname").replace("SO:coordinate", "SO:queryname") for line in lines if line.startswith("@")]
+    reads = sorted((line for line in lines if not line.startswith("@")), key=lambda line: line.split("\t", 1)[0])
+    with open(path, "w") as file:
+        file.writelines(header + reads)
+    return path
+
+
+def bgzfBlock(data):
+    '''one BGZF block: a gzip member with the BC extra field giving its size'''
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    header = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00" + struct.pack("<H", len(compressed) + 25)
+    return header + compressed + struct.pack("<II", zlib.crc32(data), len(data))
+
+
+def writeBgzf(data, path, block_size=0xFF00):
+    '''bytes compressed in BGZF blocks as written by bgzip, ended by the empty EOF block'''
+    with open(path, "wb") as file:
+        for start in range(0, len(data), block_size):
+            file.write(bgzfBlock(data[start:start + block_size]))
+        file.write(bgzfBlock(b""))
+    return path
+
+
+def samToBgzf(source, path):
+    with open(source, "rb") as file:
+        return writeBgzf(file.read(), path)
+
+
+def samToGzip(source, path):
+    with open(source, "rb") as file, gzip.open(path, "wb") as compressed:
+        compressed.write(file.read())
+    return path
+
+
+def samToBam(source, path):
+    '''BAM file with the same header and records as the SAM file'''
+    header, names, lengths, records = [], [], [], []
+    with open(source) as file:
+        for line in file:
+            if line.startswith("@"):
+                header.append(line)
+                if line.startswith("@SQ"):
+                    tags = dict(field.split(":", 1) for field in line.rstrip("\n").split("\t")[1:])
+                    names.append(tags["SN"])
+                    lengths.append(int(tags["LN"]))
+                continue
+            qname, flag, rname, pos, mapq, cigar, rnext, pnext, tlen, seq, qual = line.rstrip("\n").split("\t")[:11]
+            ref_id = names.index(rname) if rname != "*" else -1
+            next_id = -1 if rnext == "*" else ref_id if rnext == "=" else names.index(rnext)
+            ops = [int(size) << 4 | "MIDNSHP=X".index(op) for size, op in re.findall(r"(\d+)([MIDNSHP=X])", cigar)]
+            seq = "" if seq == "*" else seq
+            packed = bytearray((len(seq) + 1) // 2)
+            for i, base in enumerate(seq.upper()):
+                packed[i // 2] |= "=ACMGRSVTWYHKDBN".index(base if base in "=ACMGRSVTWYHKDBN" else "N") << (4 * (1 - i % 2))
+            quals = b"\xff" * len(seq) if qual == "*" else bytes(ord(char) - 33 for char in qual)
+            name = qname.encode() + b"\0"
+            body = (struct.pack("<iiBBHHHIiii", ref_id, int(pos) - 1, len(name), int(mapq), 4680, len(ops), int(flag), len(seq), next_id, int(pnext) - 1, int(tlen))
+                    + name + struct.pack(f"<{len(ops)}I", *ops) + bytes(packed) + quals)
+            records.append(struct.pack("<i", len(body)) + body)
+    text = "".join(header).encode()
+    references = b"".join(struct.pack("<i", len(name) + 1) + name.encode() + b"\0" + struct.pack("<i", length) for name, length in zip(names, lengths))
+    return writeBgzf(b"BAM\1" + struct.pack("<i", len(text)) + text + struct.pack("<i", len(names)) + references + b"".join(records), path)
+
+
+def results(stats):
+    '''all the results of a SamStats as plain values that can be compared'''
+    return {"pairs": stats.pairs.result(), "chrom": stats.chrom.result(), "mapq": stats.mapq.result(),
+            "alignment": stats.alignment.result(SHORT_SIZE, LONG_SIZE), "indel": stats.indel.result(),
+            "coverage": {chrom: np.asarray(counts).tolist() for chrom, counts in stats.windows.coverage().items()},
+            "meanMAPQ": {chrom: np.asarray(values).tolist() for chrom, values in stats.windows.meanMAPQ().items()},
+            "validation": stats.validation.nbErrors(), "qc": qcResults(getattr(stats, "qc", None))}
+
+
+def qcResults(qc):
+    '''counts of a QCAccumulator (None without --qc)'''
+    if qc is None:
+        return None
+    return {"cycles": qc.cycleTable(), "gc": qc.gc_hist.tolist(), "n": qc.n_hist.tolist(), "quality": qc.read_qual_hist.tolist(),
+            "windows": {chrom: counts.tolist() for chrom, counts in qc.windows.items()}, "reads": qc.reads}
+
+
+def sortOrder(path):
+    return samreader.sort_order(path) if samreader.fileFormat(path) != "bam" else None
+
+
+def streamStats(path, filterMAPQ=None, region=None, window_size=WINDOW_SIZE, **options):
+    '''SamStats of a single pass over the file'''
+    options.setdefault("sort_order", sortOrder(path))
+    header = samreader.parse_header(path)
+    return samreader.streamStats(path, header, filterMAPQ, False, window_size, 0, SHORT_SIZE, LONG_SIZE, region, **options)
+
+
+def streamResults(path, filterMAPQ=None, region=None, window_size=WINDOW_SIZE, **options):
+    '''results of a single pass over the file'''
+    return results(streamStats(path, filterMAPQ, region, window_size, **options))
+
+
+def parallelResults(path, workers, filterMAPQ=None, region=None, **options):
+    '''results of the byte ranges of the file parsed by a pool of processes (--workers)'''
+    options.setdefault("sort_order", sortOrder(path))
+    header = samreader.parse_header(path)
+    return results(samreader.parallelStats(path, header, filterMAPQ, False, WINDOW_SIZE, 0, SHORT_SIZE, LONG_SIZE, workers, region, **options))
+
+
+def runMain(directory, *arguments):
+    '''run samreader.py with the command line arguments in directory (outputs are relative to it), return what it printed'''
+    output, cwd = io.StringIO(), os.getcwd()
+    os.chdir(directory)
+    try:
+        with mock.patch("sys.argv", ["samreader.py", *arguments]), contextlib.redirect_stdout(output):
+            samreader.main()
+    finally:
+        os.chdir(cwd)
+    return output.getvalue()
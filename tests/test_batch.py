@@ -0,0 +1,86 @@
+'''batch mode: several files analysed without questions, one summary per sample and the samples x chromosomes matrices'''
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from helpers import samreader, writeSam, streamStats, runMain, SHORT_SIZE, LONG_SIZE
+
+
+def readMatrix(path):
+    '''{sample: {chromosome: value}} of a matrix_*.txt file'''
+    with open(path) as file:
+        chromosomes = file.readline().rstrip("\n").split("\t")[1:]
+        return {fields[0]: dict(zip(chromosomes, fields[1:])) for fields in (line.rstrip("\n").split("\t") for line in file)}
+
+
+class BatchTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.paths = {name: writeSam(os.path.join(cls.directory.name, f"{name}.sam"), seed=seed, long_fraction=0.05)
+                     for name, seed in (("first", 1), ("second", 2))}
+
+        #a sample aligned on chr1 only: NA in the columns of the other chromosomes
+        with open(cls.paths["first"]) as file:
+            lines = [line for line in file if not line.startswith(("@SQ\tSN:chr2", "@SQ\tSN:chr3")) and (line.startswith("@") or line.split("\t")[2] == "chr1")]
+        cls.paths["chr1only"] = os.path.join(cls.directory.name, "chr1only.sam")
+        with open(cls.paths["chr1only"], "w") as file:
+            file.writelines(lines)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def table(self, name):
+        '''summary table of one sample computed directly'''
+        stats = streamStats(self.paths[name], window_size=30000)
+        return samreader.summaryTable(stats.pairs.result(), stats.chrom.result(), stats.mapq.result(), stats.alignment.result(SHORT_SIZE, LONG_SIZE),
+                                      SHORT_SIZE, LONG_SIZE, stats.indel.result())
+
+    def run_batch(self, output, *options):
+        runMain(self.directory.name, *self.paths.values(), "--batch", "--output", output, "--short-size", str(SHORT_SIZE), "--long-size", str(LONG_SIZE), *options)
+        return os.path.join(self.directory.name, output)
+
+    def test_matrices(self):
+        output = self.run_batch("run")
+        for name in self.paths:
+            self.assertTrue(os.path.exists(os.path.join(output, name, "run.txt")))
+
+        tables = {name: self.table(name) for name in self.paths}
+        columns = tables["first"][0]
+        for index, column in enumerate(columns):
+            file_name = "matrix_" + column.replace("<", "short").replace(">", "long").replace("%", "").replace("+", "_above").replace("-", "_below") + ".txt"
+            matrix = readMatrix(os.path.join(output, file_name))
+            with self.subTest(column=column):
+                self.assertEqual(list(matrix), list(self.paths))
+                for name, (sample_columns, rows) in tables.items():
+                    for chromosome, values in matrix[name].items():
+                        self.assertEqual(values, str(rows[chromosome][index]) if chromosome in rows else "NA")
+        self.assertEqual(readMatrix(os.path.join(output, "matrix_TOTAL.txt"))["chr1only"]["chr2"], "NA")
+
+    def test_workers(self):
+        #the ranges of all the files share one pool, the matrices are the same as one file after the other
+        serial, parallel = self.run_batch("serial"), self.run_batch("parallel", "--workers", "3")
+        for file_name in sorted(os.listdir(serial)):
+            if file_name.startswith("matrix_"):
+                with self.subTest(matrix=file_name):
+                    self.assertEqual(readMatrix(os.path.join(serial, file_name)), readMatrix(os.path.join(parallel, file_name)))
+
+    def test_sample_sheet(self):
+        sheet = os.path.join(self.directory.name, "samples.tsv")
+        with open(sheet, "w") as file:
+            file.write("#name\tpath\nA\tfirst.sam\n\nsecond.sam\n") #paths relative to the sheet, the name defaults to the file name
+        with mock.patch("sys.argv", ["samreader.py", "--sample-sheet", sheet, "--batch"]):
+            self.assertEqual(samreader.collectSamples(samreader.parseArguments()),
+                             [("A", os.path.join(self.directory.name, "first.sam")), ("second", os.path.join(self.directory.name, "second.sam"))])
+        with mock.patch("sys.argv", ["samreader.py", self.paths["second"], "--sample-sheet", sheet, "--batch"]), self.assertRaises(SystemExit):
+            with contextlib.redirect_stdout(io.StringIO()):
+                samreader.collectSamples(samreader.parseArguments()) #two samples named second
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+'''coverage cache: results of any window size multiple of the bin size read from the pyramid of bins'''
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from helpers import samreader, writeSam, results, streamStats, streamResults
+
+
+class CacheTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = writeSam(os.path.join(cls.directory.name, "reads.sam"), long_fraction=0.05)
+        cls.cache = os.path.join(cls.directory.name, "cache", "reads.npz")
+        with contextlib.redirect_stdout(io.StringIO()):
+            samreader.saveCache(cls.cache, streamStats(cls.path, bin_size=samreader.CACHE_BIN_SIZE))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_window_sizes(self):
+        #powers of 2 of the bin size are read from one level of the pyramid, the other multiples sum several bins
+        for window_size in (100, 800, 1000, 3000, 30000, 250000):
+            with self.subTest(window_size=window_size):
+                cached = samreader.loadCache(self.cache, window_size)
+                self.assertEqual(results(cached), streamResults(self.path, window_size=window_size))
+
+    def test_unusable_cache(self):
+        self.assertIsNone(samreader.loadCache(self.cache, 150))
+        self.assertIsNone(samreader.loadCache(self.cache + ".missing", 1000))
+
+    def test_cache_key(self):
+        settings = {"filterMAPQ": None, "fullyMappedOnly": False}
+        self.assertEqual(samreader.cachePath(self.path, settings), samreader.cachePath(self.path, dict(settings)))
+        self.assertNotEqual(samreader.cachePath(self.path, settings), samreader.cachePath(self.path, {**settings, "filterMAPQ": 30}))
+
+    def test_cache_directory(self):
+        settings = {"filterMAPQ": None}
+        local = samreader.cachePath(self.path, settings)
+        self.assertEqual(os.path.dirname(local), os.path.join(self.directory.name, samreader.CACHE_DIR))
+        self.assertEqual(os.path.dirname(samreader.cachePath(self.path, settings, "elsewhere")), "elsewhere")
+
+        #directory of the file read-only: the cache goes to the user cache directory, unless it is already next to the file
+        user_cache = os.path.join(self.directory.name, "home_cache")
+        with mock.patch.dict(os.environ, {"XDG_CACHE_HOME": user_cache}), mock.patch("os.access", return_value=False):
+            self.assertEqual(samreader.cachePath(self.path, settings), os.path.join(user_cache, samreader.USER_CACHE_DIR, os.path.basename(local)))
+            os.makedirs(os.path.dirname(local))
+            open(local, "wb").close()
+            try:
+                self.assertEqual(samreader.cachePath(self.path, settings), local)
+            finally:
+                os.remove(local)
+                os.rmdir(os.path.dirname(local))
+
+    def test_cache_opt_in(self):
+        #the cache slows the first run down, it is only used with --cache or --cache-dir
+        for options, used in (([], False), (["--cache"], True), (["--cache-dir", self.directory.name], True), (["--cache", "--resume"], False)):
+            with self.subTest(options=options), mock.patch("sys.argv", ["samreader.py", self.path, "--batch"] + options):
+                args = samreader.parseArguments()
+                cache_path = samreader.cacheFor(args, self.path, None, False, 0, 80, 200, None)
+                self.assertEqual(cache_path is not None, used)
+                self.assertEqual(samreader.analysisOptions(args, self.path, cache_path)["bin_size"] is not None, used)
+
+
+if __name__ == "__main__":
+    unittest.main()
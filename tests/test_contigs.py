@@ -0,0 +1,114 @@
+'''draft assemblies: the short contigs pooled in one "other" row, and a single genome-wide plot above PLOT_MAX_CONTIGS contigs'''
+import contextlib
+import io
+import os
+import random
+import re
+import tempfile
+import unittest
+from unittest import mock
+
+from helpers import samreader, benchmark, streamStats, SHORT_SIZE, LONG_SIZE
+
+MIN_LENGTH = 8000
+
+
+def naiveRows(path, contigs):
+    '''[reads, mapped, unmapped, min length, max length, sum of lengths] of the lines of the contigs, every line being split'''
+    lengths, mapped = [], 0
+    with open(path) as file:
+        for line in file:
+            fields = line.split("\t")
+            if line.startswith("@") or fields[2] not in contigs:
+                continue
+            mapped += not int(fields[1]) & 4
+            lengths.append(sum(int(size) for size, op in re.findall(r"(\d+)([MIDNSHP=X])", fields[5]) if op in "MDN=X"))
+    return [len(lengths), mapped, len(lengths) - mapped, min(lengths), max(lengths), sum(lengths)]
+
+
+class ContigTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        rng = random.Random(1)
+        cls.contigs = [(f"ctg{i}", rng.randint(2000, 20000)) for i in range(40)]
+        cls.path = benchmark.SamGenerator(4000, cls.contigs, long_fraction=0.02, long_length=1500).write(os.path.join(cls.directory.name, "draft.sam"))
+        cls.header = samreader.parse_header(cls.path)
+        cls.stats = streamStats(cls.path)
+        cls.pooled = [name for name, length in cls.contigs if length < MIN_LENGTH]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_groups(self):
+        groups, min_length = samreader.contigGroups(self.header, MIN_LENGTH)
+        self.assertEqual(sorted(groups), sorted(self.pooled))
+        self.assertEqual(min_length, MIN_LENGTH)
+        self.assertEqual(samreader.contigGroups(self.header), ({}, 0)) #few contigs: every one has its row
+
+        #many contigs: only the MANY_CONTIGS longest keep their row
+        with mock.patch.object(samreader, "MANY_CONTIGS", 10):
+            groups, min_length = samreader.contigGroups(self.header)
+        longest = sorted(self.header, key=self.header.get, reverse=True)[:10]
+        self.assertEqual(set(self.header) - set(groups), set(longest))
+        self.assertEqual(min_length, min(self.header[contig] for contig in longest))
+
+    def test_other_row(self):
+        #the "other" row holds the reads of the pooled contigs, the rows of the other contigs are unchanged
+        groups, _ = samreader.contigGroups(self.header, MIN_LENGTH)
+        stats = self.stats
+        chrom, mapq, alignment = stats.chrom.result(groups), stats.mapq.result(groups), stats.alignment.result(SHORT_SIZE, LONG_SIZE, groups)
+        reads, mapped, unmapped, min_length, max_length, total_length = naiveRows(self.path, set(self.pooled))
+        self.assertEqual(chrom[samreader.OTHER_CONTIGS], [mapped, unmapped])
+        self.assertEqual(sum(mapq[samreader.OTHER_CONTIGS]), reads)
+        self.assertEqual(alignment[samreader.OTHER_CONTIGS][2:], (round(total_length / reads, 3), reads, min_length, max_length))
+        for name in set(self.header) - set(self.pooled):
+            self.assertEqual(chrom[name], stats.chrom.result()[name])
+            self.assertEqual(alignment[name], stats.alignment.result(SHORT_SIZE, LONG_SIZE)[name])
+        self.assertFalse(set(self.pooled) & set(chrom))
+
+        #the pairs of the pooled contigs are counted together before the percentages
+        counts = stats.pairs._spilledCounts()
+        total, paired, oriented = (sum(counts.get(contig, [0, 0, 0])[i] for contig in self.pooled) for i in range(3))
+        self.assertEqual(stats.pairs.result(groups)[samreader.OTHER_CONTIGS], [round(100 * paired / total, 2), round(100 * oriented / total, 2)])
+
+    def test_summary_note(self):
+        groups, min_length = samreader.contigGroups(self.header, MIN_LENGTH)
+        stats = self.stats
+        with contextlib.redirect_stdout(io.StringIO()):
+            columns, rows = samreader.Summary("summary.txt", self.directory.name, stats.pairs.result(groups), stats.chrom.result(groups), stats.mapq.result(groups),
+                                              stats.alignment.result(SHORT_SIZE, LONG_SIZE, groups), SHORT_SIZE, LONG_SIZE, 0, stats.indel.result(groups), (len(groups), min_length))
+        self.assertEqual(rows[samreader.OTHER_CONTIGS][0], str(naiveRows(self.path, set(self.pooled))[0]))
+        with open(os.path.join(self.directory.name, "summary.txt")) as file:
+            self.assertIn(f"{samreader.OTHER_CONTIGS}: {len(self.pooled)} contigs pooled in one row, the references with their own row are at least {MIN_LENGTH} bp long", file.read())
+
+    def test_genome_plot(self):
+        #above PLOT_MAX_CONTIGS contigs with reads, one plot of the contigs end to end with the borders of the longest ones
+        coverage, mean_mapq = self.stats.windows.coverage(), self.stats.windows.meanMAPQ()
+        tracks = [(chrom, counts) for chrom, counts in coverage.items() if counts]
+        with mock.patch.object(samreader, "PLOT_MAX_CONTIGS", 10), mock.patch.object(samreader, "plotChromosome") as plot, contextlib.redirect_stdout(io.StringIO()):
+            samreader.plotReadsPerWindow(coverage, mean_mapq, 1000, self.directory.name)
+        self.assertEqual(plot.call_count, 1)
+        name, counts, mapq_values, window_size, dir_name, borders = plot.call_args.args
+        self.assertEqual(name, "genome")
+        self.assertEqual(counts.tolist(), [value for chrom, values in tracks for value in values])
+        self.assertEqual(mapq_values.tolist(), [value for chrom, values in tracks for value in mean_mapq[chrom]])
+
+        starts, start = {}, 0
+        for chrom, values in tracks:
+            starts[chrom] = start
+            start += len(values)
+        longest = sorted(tracks, key=lambda track: len(track[1]), reverse=True)[:samreader.GENOME_LABELS]
+        self.assertEqual(sorted(borders), sorted((starts[chrom], chrom) for chrom, values in longest))
+
+    def test_genome_plot_file(self):
+        with mock.patch.object(samreader, "PLOT_MAX_CONTIGS", 10), contextlib.redirect_stdout(io.StringIO()):
+            samreader.plotReadsPerWindow(self.stats.windows.coverage(), self.stats.windows.meanMAPQ(), 1000, self.directory.name)
+        pngs = [name for name in os.listdir(self.directory.name) if name.endswith(".png")]
+        self.assertEqual(pngs, ["coverage_genome.png"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+'''--exclude-flags, --require-flags and the filters tested on the raw fields: the reads kept are the ones of a filter on whole lines'''
+import argparse
+import os
+import random
+import re
+import tempfile
+import unittest
+from unittest import mock
+
+from helpers import samreader, writeSam, samToBam, streamResults
+
+#(excluded bits, required bits, minimum MAPQ, fully mapped only)
+FILTERS = ((0x900, 0, None, False), (0x400, 0x1, None, False), (0xD04, 0x2, 30, False), (0, 0x40, None, True), (0x100, 0, 20, True), (0, 0, None, False))
+
+
+def kept(path, exclude, require, filterMAPQ, fullyMappedOnly):
+    '''(QNAME, FLAG, POS) of the lines passing the filters, every line being split'''
+    reads = []
+    with open(path) as file:
+        for line in file:
+            if line.startswith("@"):
+                continue
+            fields = line.split("\t")
+            flag, mapq = int(fields[1]), int(fields[4])
+            if flag & exclude or flag & require != require or (filterMAPQ is not None and mapq < filterMAPQ):
+                continue
+            if fullyMappedOnly and (flag & 4 or not re.fullmatch(r"[0-9]+M", fields[5])):
+                continue
+            reads.append((fields[0], flag, int(fields[3])))
+    return reads
+
+
+class FlagTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        source = writeSam(os.path.join(cls.directory.name, "source.sam"), long_fraction=0.05)
+
+        #some reads marked secondary, supplementary, QC fail or duplicate
+        rng = random.Random(1)
+        cls.path = os.path.join(cls.directory.name, "flags.sam")
+        with open(source) as file, open(cls.path, "w") as out:
+            for line in file:
+                if not line.startswith("@"):
+                    fields = line.split("\t")
+                    fields[1] = str(int(fields[1]) | rng.choice((0, 0, 0, 0x100, 0x200, 0x400, 0x800)))
+                    line = "\t".join(fields)
+                out.write(line)
+        cls.bam = samToBam(cls.path, cls.path.replace(".sam", ".bam"))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_flag_mask(self):
+        self.assertEqual(samreader.flagMask("0xD00"), 0xD00)
+        self.assertEqual(samreader.flagMask("3328"), 0xD00)
+        self.assertEqual(samreader.flagMask("secondary,supplementary"), 0x900)
+        self.assertEqual(samreader.flagMask("Duplicate, qcfail"), 0x600)
+        with self.assertRaises(argparse.ArgumentTypeError):
+            samreader.flagMask("secondary,primary")
+        with mock.patch("sys.argv", ["samreader.py", self.path, "--exclude-flags", "secondary,duplicate", "--require-flags", "0x1"]):
+            self.assertEqual(samreader.flagFilter(samreader.parseArguments()), (0x500, 0x1))
+
+    def test_reads_kept(self):
+        for exclude, require, filterMAPQ, fullyMappedOnly in FILTERS:
+            expected = kept(self.path, exclude, require, filterMAPQ, fullyMappedOnly)
+            for path in (self.path, self.bam):
+                with self.subTest(file=os.path.basename(path), exclude=hex(exclude), require=hex(require), mapq=filterMAPQ, fully_mapped=fullyMappedOnly):
+                    reads = samreader.iter_reads(path, filterMAPQ, fullyMappedOnly, flag_filter=(exclude, require))
+                    self.assertEqual([(read.qname, read.flag, read.pos) for read in reads], expected)
+
+    def test_results(self):
+        #the statistics of the filtered reads are the ones of a file holding only them
+        exclude, require = 0xD00, 0x1
+        with open(self.path) as file:
+            lines = [line for line in file if line.startswith("@") or not int(line.split("\t")[1]) & exclude and int(line.split("\t")[1]) & require == require]
+        filtered = os.path.join(self.directory.name, "filtered.sam")
+        with open(filtered, "w") as file:
+            file.writelines(lines)
+        self.assertEqual(streamResults(self.path, flag_filter=(exclude, require)), streamResults(filtered))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+'''the same reads give the same results whatever the format of the file: plain SAM, gzip, BGZF or BAM'''
+import os
+import tempfile
+import unittest
+
+from helpers import samreader, writeSam, writeBgzf, samToGzip, samToBgzf, samToBam, streamResults
+
+
+class FormatTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.files = {}
+        for sort in ("unsorted", "coordinate"):
+            sam = writeSam(os.path.join(cls.directory.name, f"{sort}.sam"), sort=sort, long_fraction=0.05)
+            cls.files[sort] = cls.compressed(sam, sort)
+
+    @classmethod
+    def compressed(cls, sam, sort):
+        '''{format: path} of the SAM file written in each format'''
+        return {"sam": sam, "gzip": samToGzip(sam, sam + ".gz"), "bgzf": samToBgzf(sam, sam + ".bgz"),
+                "bam": samToBam(sam, os.path.join(cls.directory.name, f"{sort}.bam"))}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_detected_formats(self):
+        for file_format, path in self.files["unsorted"].items():
+            with self.subTest(file_format=file_format):
+                self.assertEqual(samreader.fileFormat(path), file_format)
+
+    def test_same_header(self):
+        reference = samreader.parse_header(self.files["unsorted"]["sam"])
+        for file_format, path in self.files["unsorted"].items():
+            with self.subTest(file_format=file_format):
+                self.assertEqual(samreader.parse_header(path), reference)
+
+    def test_same_results(self):
+        for sort, files in self.files.items():
+            reference = streamResults(files["sam"], sort_order=sort, qc=True)
+            for file_format, path in files.items():
+                with self.subTest(sort=sort, file_format=file_format):
+                    self.assertEqual(streamResults(path, sort_order=sort, qc=True), reference)
+
+    def test_same_results_with_filters(self):
+        reference = streamResults(self.files["unsorted"]["sam"], filterMAPQ=30, max_pending=20)
+        for file_format, path in self.files["unsorted"].items():
+            with self.subTest(file_format=file_format):
+                self.assertEqual(streamResults(path, filterMAPQ=30, max_pending=20), reference)
+
+    def test_small_bgzf_blocks(self):
+        #lines split across many blocks
+        sam = self.files["unsorted"]["sam"]
+        with open(sam, "rb") as file:
+            path = writeBgzf(file.read(), os.path.join(self.directory.name, "small_blocks.sam.bgz"), block_size=777)
+        self.assertEqual(streamResults(path), streamResults(sam))
+
+if __name__ == "__main__":
+    unittest.main()
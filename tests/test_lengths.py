@@ -0,0 +1,53 @@
+'''alignment lengths kept in fixed bins (LengthHistogram) compared with the exact lengths'''
+import random
+import unittest
+
+import numpy as np
+
+from helpers import samreader
+
+
+class LengthHistogramTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(3)
+        self.short = [rng.randint(1, 4000) for _ in range(5000)]
+        self.long = [int(rng.lognormvariate(9, 1)) + 1 for _ in range(5000)]
+
+    def histogram(self, lengths):
+        histogram = samreader.LengthHistogram()
+        for length in lengths:
+            histogram.add(length)
+        return histogram
+
+    def test_exact_below_length_exact(self):
+        histogram = self.histogram(self.short)
+        for percent in (1, 10, 25, 50, 75, 90, 99, 100):
+            with self.subTest(percent=percent):
+                self.assertEqual(histogram.percentile(percent), int(np.percentile(self.short, percent, method="inverted_cdf")))
+        for size in (0, 1, 80, 200, 3999, 5000):
+            with self.subTest(size=size):
+                self.assertEqual(histogram.countBelow(size), sum(length <= size for length in self.short))
+        self.assertEqual((histogram.min_len, histogram.max_len, histogram.length_sum), (min(self.short), max(self.short), sum(self.short)))
+
+    def test_long_lengths_within_a_bin(self):
+        histogram = self.histogram(self.long)
+        for percent in (10, 50, 90):
+            expected = np.percentile(self.long, percent, method="inverted_cdf")
+            with self.subTest(percent=percent):
+                self.assertLessEqual(abs(histogram.percentile(percent) - expected), expected / samreader.LENGTH_SUBBINS + 1)
+
+    def test_bins_of_an_array(self):
+        lengths = np.array(self.short + self.long + [1 << 40])
+        self.assertEqual(samreader.LengthHistogram.bins(lengths).tolist(), [samreader.LengthHistogram.bin(int(length)) for length in lengths])
+
+    def test_merge_and_state(self):
+        merged = self.histogram(self.short[:100] + self.long[:100])
+        merged.merge(self.histogram(self.short[100:] + self.long[100:]))
+        whole = self.histogram(self.short + self.long)
+        self.assertEqual(merged.state(), whole.state())
+        self.assertEqual(samreader.LengthHistogram.fromState(whole.state()).state(), whole.state())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+'''--metrics and the progress of the reading: bytes and lines counted by the readers, stages saved in metrics.json'''
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from helpers import samreader, writeSam, samToGzip, samToBgzf, sortOrder, runMain, WINDOW_SIZE, SHORT_SIZE, LONG_SIZE
+
+
+class MetricsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = writeSam(os.path.join(cls.directory.name, "reads.sam"))
+        with open(cls.path) as file:
+            lines = file.readlines()
+        cls.nb_lines = len(lines)
+        cls.nb_reads = sum(1 for line in lines if not line.startswith("@"))
+        cls.header = samreader.parse_header(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_progress_counts(self):
+        #every byte of the input (compressed bytes for gzip and BGZF) and every line is counted once,
+        #but the empty block closing a BGZF file (28 bytes) which holds no line
+        for path, unread in ((self.path, 0), (samToGzip(self.path, self.path + ".gz"), 0), (samToBgzf(self.path, self.path + ".bgz"), 28)):
+            with self.subTest(file=os.path.basename(path)):
+                progress = samreader.Progress(samreader.inputSize(path), stream=io.StringIO())
+                for read in samreader.iter_reads(path, None, False, progress=progress):
+                    pass
+                self.assertEqual(list(progress.counters), [samreader.inputSize(path) - unread, self.nb_lines])
+
+    def test_progress_workers(self):
+        #the workers add their ranges to the counters shared with the parent
+        progress = samreader.Progress(samreader.inputSize(self.path), shared=True, stream=io.StringIO())
+        samreader.parallelStats(self.path, self.header, None, False, WINDOW_SIZE, 0, SHORT_SIZE, LONG_SIZE, 3, progress=progress, sort_order=sortOrder(self.path))
+        self.assertEqual(list(progress.counters), [samreader.inputSize(self.path), self.nb_lines])
+
+    def test_progress_display(self):
+        stream = io.StringIO()
+        progress = samreader.Progress(1000, stream=stream)
+        progress.update(250, 10)
+        progress.show()
+        progress.update(250, 10)
+        progress.finish()
+        shown = stream.getvalue().splitlines() #a log file gets one line each time
+        self.assertEqual(len(shown), 2)
+        self.assertTrue(shown[0].startswith("Reading:  25.0%  10 reads"))
+        self.assertRegex(shown[0], r"ETA \d\d:\d\d:\d\d$")
+        self.assertTrue(shown[1].startswith("Reading: 100.0%  20 reads"))
+        self.assertTrue(shown[1].endswith("ETA done"))
+
+        stream = io.StringIO()
+        progress = samreader.Progress(None, stream=stream) #stdin: no size, no ETA
+        progress.update(100, 5)
+        progress.finish()
+        self.assertNotIn("ETA", stream.getvalue())
+
+    def test_metrics_file(self):
+        runMain(self.directory.name, self.path, "--batch", "--output", "run", "--metrics", "--no-pipeline")
+        with open(os.path.join(self.directory.name, "run", "metrics.json")) as file:
+            metrics = json.load(file)
+        stages = {stage["name"]: stage for stage in metrics["stages"]}
+        for name in ("header", "reads", "windows", "summary", "plots"):
+            with self.subTest(stage=name):
+                self.assertIn(name, stages)
+                self.assertGreaterEqual(stages[name]["wall_s"], 0)
+                self.assertGreaterEqual(stages[name]["cpu_s"], 0)
+                self.assertGreater(stages[name]["peak_rss_mb"], 0)
+        self.assertEqual(stages["reads"]["records"], self.nb_reads)
+        self.assertEqual(stages["reads"]["bytes"], os.path.getsize(self.path))
+        self.assertEqual(metrics["settings"]["window_size"], 30000)
+        self.assertGreaterEqual(metrics["wall_s"], sum(stage["wall_s"] for stage in metrics["stages"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
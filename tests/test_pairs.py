@@ -0,0 +1,76 @@
+'''pairing of the mates (FlagAccumulator): the counts must not depend on the sort order of the file nor on spilling'''
+import os
+import tempfile
+import unittest
+
+from helpers import samreader, writeSam, sortByName, streamResults
+
+
+def pairCounts(path, sort_order, max_pending):
+    header = samreader.parse_header(path)
+    pairs = samreader.FlagAccumulator(header, sort_order, max_pending)
+    for read in samreader.iter_reads(path, None, False):
+        pairs.update(read)
+    return pairs.state()
+
+
+class PairingTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.unsorted = writeSam(os.path.join(cls.directory.name, "unsorted.sam"))
+        cls.coordinate = writeSam(os.path.join(cls.directory.name, "coordinate.sam"), sort="coordinate")
+        cls.queryname = sortByName(cls.unsorted, os.path.join(cls.directory.name, "queryname.sam"))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_sorted_fast_paths(self):
+        reference = pairCounts(self.unsorted, None, samreader.MAX_PENDING_MATES)
+        self.assertEqual(pairCounts(self.queryname, "queryname", samreader.MAX_PENDING_MATES), reference)
+        self.assertEqual(pairCounts(self.coordinate, None, samreader.MAX_PENDING_MATES),
+                         pairCounts(self.coordinate, "coordinate", samreader.MAX_PENDING_MATES))
+
+    def test_spilling(self):
+        for path, sort_order in ((self.unsorted, None), (self.coordinate, "coordinate"), (self.queryname, "queryname")):
+            reference = pairCounts(path, sort_order, samreader.MAX_PENDING_MATES)
+            for max_pending in (1, 5, 20):
+                with self.subTest(sort_order=sort_order, max_pending=max_pending):
+                    self.assertEqual(pairCounts(path, sort_order, max_pending), reference)
+
+    def test_spilling_with_filters(self):
+        reference = streamResults(self.coordinate, filterMAPQ=30)["pairs"]
+        self.assertEqual(streamResults(self.coordinate, filterMAPQ=30, max_pending=20)["pairs"], reference)
+
+    def test_spilled_mate_at_same_position(self):
+        #C and its mate are both at position 12, the first end of C is spilled with the others before the second one comes
+        records = [("A", 99, 10, 20), ("B", 99, 11, 30), ("C", 99, 12, 12), ("D", 99, 12, 40), ("C", 147, 12, 12), ("A", 147, 20, 10), ("B", 147, 30, 11)]
+        counts = []
+        for max_pending in (samreader.MAX_PENDING_MATES, 3):
+            pairs = samreader.FlagAccumulator({"chr1": 1000}, "coordinate", max_pending)
+            for qname, flag, pos, pnext in records:
+                pairs.update(samreader.Record(qname, flag, "chr1", pos, 60, "10M", "=", pnext))
+            counts.append(pairs.state())
+        self.assertEqual(counts[0], {"chr1": [4, 3, 3]})
+        self.assertEqual(counts[1], counts[0])
+
+    def test_single_end_reads_not_kept(self):
+        #reads without the 0x1 bit or with RNEXT "*" have no other end: nothing is kept for them, so nothing is spilled
+        directory = self.directory.name
+        single = writeSam(os.path.join(directory, "single_unsorted.sam"), nb_reads=5000, paired_fraction=0)
+        single_sorted = writeSam(os.path.join(directory, "single_coordinate.sam"), nb_reads=5000, paired_fraction=0, sort="coordinate")
+        long_reads = writeSam(os.path.join(directory, "long.sam"), nb_reads=2000, long_fraction=1)
+        for path, sort_order in ((single, None), (single_sorted, "coordinate"), (long_reads, None)):
+            with self.subTest(file=os.path.basename(path)):
+                pairs = samreader.FlagAccumulator(samreader.parse_header(path), sort_order, 100)
+                for read in samreader.iter_reads(path, None, False):
+                    pairs.update(read)
+                self.assertEqual(pairs.nb_pending, 0)
+                self.assertIsNone(pairs.spill_dir)
+                self.assertEqual(pairs.state(), pairCounts(path, sort_order, samreader.MAX_PENDING_MATES))
+
+
+if __name__ == "__main__":
+    unittest.main()
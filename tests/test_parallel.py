@@ -0,0 +1,46 @@
+'''--workers: the byte ranges parsed by a pool of processes and merged in file order give the results of the serial pass'''
+import os
+import tempfile
+import unittest
+
+from helpers import writeSam, samToBgzf, samToBam, streamResults, parallelResults
+
+
+class ParallelTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.unsorted = writeSam(os.path.join(cls.directory.name, "unsorted.sam"), long_fraction=0.05)
+        cls.coordinate = writeSam(os.path.join(cls.directory.name, "coordinate.sam"), sort="coordinate")
+        cls.bgzf = samToBgzf(cls.coordinate, cls.coordinate + ".bgz")
+        cls.bam = samToBam(cls.unsorted, os.path.join(cls.directory.name, "unsorted.bam"))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def files(self):
+        return (self.unsorted, self.coordinate, self.bgzf, self.bam)
+
+    def test_workers(self):
+        for path in self.files():
+            reference = streamResults(path, qc=True)
+            for workers in (2, 3):
+                with self.subTest(file=os.path.basename(path), workers=workers):
+                    self.assertEqual(parallelResults(path, workers, qc=True), reference)
+
+    def test_workers_with_spilling(self):
+        #mates are paired across the byte ranges when the partial results are merged, also when they were spilled
+        for path in (self.unsorted, self.coordinate):
+            reference = streamResults(path)
+            with self.subTest(file=os.path.basename(path)):
+                self.assertEqual(parallelResults(path, 3, max_pending=20), reference)
+
+    def test_more_workers_than_lines(self):
+        path = writeSam(os.path.join(self.directory.name, "small.sam"), nb_reads=5)
+        self.assertEqual(parallelResults(path, 8), streamResults(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+'''PlotPipeline: the chromosomes plotted while a coordinate-sorted file is read are final, the others are left to the plots of the end'''
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from helpers import samreader, writeSam, streamStats, WINDOW_SIZE
+
+
+class PlotPipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = writeSam(os.path.join(self.directory.name, "coordinate.sam"), sort="coordinate")
+        samreader.PLOT_QUEUE, self.queue = 1, samreader.PLOT_QUEUE #each plot is collected when the next one is submitted
+
+    def tearDown(self):
+        samreader.PLOT_QUEUE = self.queue
+        self.directory.cleanup()
+
+    def reorder(self, chromosomes):
+        '''file with the reads of each run of chromosomes in turn, a chromosome listed twice has its reads split in two runs'''
+        with open(self.path) as file:
+            lines = file.readlines()
+        header = [line for line in lines if line.startswith("@")]
+        reads = {}
+        for line in lines:
+            if not line.startswith("@"):
+                reads.setdefault(line.split("\t")[2], []).append(line)
+        runs = []
+        for chromosome in chromosomes:
+            count = chromosomes.count(chromosome)
+            part = len(reads[chromosome]) // count
+            seen = sum(1 for run in runs if run[0] == chromosome)
+            lines = reads[chromosome][seen * part:] if seen == count - 1 else reads[chromosome][seen * part:(seen + 1) * part]
+            runs.append((chromosome, lines))
+        path = os.path.join(self.directory.name, "reordered.sam")
+        with open(path, "w") as file:
+            file.writelines(header + [line for chromosome, lines in runs for line in lines])
+        return path
+
+    def plotted(self, path):
+        plots = samreader.PlotPipeline(WINDOW_SIZE, os.path.join(self.directory.name, "plots"), 1)
+        with contextlib.redirect_stdout(io.StringIO()):
+            streamStats(path, sort_order="coordinate", plots=plots)
+            return plots.close()
+
+    def test_sorted_file(self):
+        #the unmapped reads ("*") come last, every chromosome is left by the reads
+        self.assertEqual(self.plotted(self.path), {"chr1", "chr2", "chr3"})
+        for chromosome in ("chr1", "chr2", "chr3"):
+            self.assertTrue(os.path.exists(os.path.join(self.directory.name, "plots", f"coverage_{chromosome}.png")))
+
+    def test_chromosome_in_two_runs(self):
+        #the plot of chr1 is collected before its reads come back, it must be drawn again at the end (the last chromosome is never left)
+        self.assertEqual(self.plotted(self.reorder(["chr1", "chr2", "chr1"])), {"chr2"})
+        self.assertEqual(self.plotted(self.reorder(["chr1", "chr2", "chr1", "chr3"])), {"chr2"})
+
+
+if __name__ == "__main__":
+    unittest.main()
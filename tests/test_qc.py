@@ -0,0 +1,101 @@
+'''--qc statistics (QCAccumulator) compared with a computation read by read'''
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from helpers import samreader, writeSam, streamStats, CHROMOSOMES, WINDOW_SIZE
+
+
+def naiveQC(path, window_size, max_cycles):
+    '''--qc counts computed read by read from the lines of the file'''
+    header = dict(CHROMOSOMES)
+    levels = samreader.QUAL_LEVELS
+    cycle_reads, cycle_n = np.zeros(max_cycles, dtype=np.int64), np.zeros(max_cycles, dtype=np.int64)
+    cycle_qual = np.zeros((max_cycles, levels), dtype=np.int64)
+    gc_hist, n_hist, qual_hist = np.zeros(101, dtype=np.int64), np.zeros(101, dtype=np.int64), np.zeros(levels, dtype=np.int64)
+    windows = {}
+    with open(path) as file:
+        for line in file:
+            if line.startswith("@"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            flag, seq, qual = int(fields[1]), fields[9], fields[10]
+            if flag & 0x900 or seq == "*":
+                continue
+            if qual == "*" or len(qual) != len(seq):
+                qual = ""
+            if flag & 16:
+                seq, qual = seq[::-1], qual[::-1]
+            bases = seq.upper()
+            gc = bases.count("G") + bases.count("C")
+            called = gc + bases.count("A") + bases.count("T") + bases.count("U")
+            n = bases.count("N")
+            if called:
+                gc_hist[(100 * gc + called // 2) // called] += 1
+            n_hist[(100 * n + len(seq) // 2) // len(seq)] += 1
+            for cycle, base in enumerate(bases[:max_cycles]):
+                cycle_reads[cycle] += 1
+                cycle_n[cycle] += base == "N"
+            if qual:
+                values = [min(ord(char) - 33, levels - 1) for char in qual]
+                qual_hist[sum(values) // len(values)] += 1
+                for cycle, value in enumerate(values[:max_cycles]):
+                    cycle_qual[cycle, value] += 1
+            if not flag & 4 and fields[2] in header:
+                counts = windows.setdefault(fields[2], np.zeros((3, header[fields[2]] // window_size + 1), dtype=np.int64))
+                counts[:, int(fields[3]) // window_size] += (gc, called, n)
+    nb_cycles = int(np.count_nonzero(cycle_reads))
+    return {"cycle_reads": cycle_reads[:nb_cycles].tolist(), "cycle_n": cycle_n[:nb_cycles].tolist(), "cycle_qual": cycle_qual[:nb_cycles].tolist(),
+            "gc": gc_hist.tolist(), "n": n_hist.tolist(), "quality": qual_hist.tolist(), "windows": {chrom: counts.tolist() for chrom, counts in windows.items()}}
+
+
+def qcCounts(qc):
+    qc.flush()
+    return {"cycle_reads": qc.cycle_reads.tolist(), "cycle_n": qc.cycle_n.tolist(), "cycle_qual": qc.cycle_qual_hist.tolist(),
+            "gc": qc.gc_hist.tolist(), "n": qc.n_hist.tolist(), "quality": qc.read_qual_hist.tolist(),
+            "windows": {chrom: counts.tolist() for chrom, counts in qc.windows.items()}}
+
+
+class QCTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.generated = writeSam(os.path.join(cls.directory.name, "reads.sam"), long_fraction=0.1, long_length=1500)
+        #lower case and N bases, QUAL "*" or of another length, secondary alignment, SEQ "*", reverse strand and unmapped reads
+        cls.special = os.path.join(cls.directory.name, "special.sam")
+        with open(cls.special, "w") as file:
+            file.write("@HD\tVN:1.6\tSO:unsorted\n" + "".join(f"@SQ\tSN:{name}\tLN:{length}\n" for name, length in CHROMOSOMES))
+            for i, (flag, pos, seq, qual) in enumerate(((0, 10, "ACGTN", "IIII#"), (16, 1500, "acgtnNGG", "!!5?IIII"), (0, 1999, "NNNN", "*"),
+                                                         (256, 20, "GGGG", "IIII"), (0, 30, "*", "*"), (4, 0, "ACGA", "I#I#"), (0, 40, "ACG", "II"),
+                                                         (2048, 50, "CC", "II"), (16, 60, "AAAAAAAAAAAAAAC", "#" * 14 + "~"))):
+                file.write(f"r{i}\t{flag}\t{'*' if flag & 4 else 'chr1'}\t{pos}\t60\t{len(seq) if seq != '*' else 1}M\t*\t0\t0\t{seq}\t{qual}\n")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_naive_counts(self):
+        for path in (self.generated, self.special):
+            with self.subTest(file=os.path.basename(path)):
+                stats = streamStats(path, qc=True)
+                self.assertEqual(qcCounts(stats.qc), naiveQC(path, WINDOW_SIZE, samreader.QC_MAX_CYCLES))
+
+    def test_small_batches(self):
+        batch_bytes, samreader.QC_BATCH_BYTES = samreader.QC_BATCH_BYTES, 1000
+        try:
+            self.assertEqual(qcCounts(streamStats(self.generated, qc=True).qc), naiveQC(self.generated, WINDOW_SIZE, samreader.QC_MAX_CYCLES))
+        finally:
+            samreader.QC_BATCH_BYTES = batch_bytes
+
+    def test_cycle_table(self):
+        rows = streamStats(self.special, qc=True).qc.cycleTable(percentiles=(50,))
+        #first cycle: 6 reads, the qualities 40, 40, 40 and 93 ("~" of the reverse read) and one N
+        self.assertEqual(rows[0], (1, 6, 53.25, [40], 16.67))
+        self.assertEqual(rows[-1], (15, 1, 2.0, [2], 0.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
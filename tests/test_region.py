@@ -0,0 +1,89 @@
+'''--region: the reads read through the index are exactly the reads of the file overlapping the region'''
+import contextlib
+import io
+import os
+import re
+import tempfile
+import unittest
+
+from helpers import samreader, writeSam, samToBgzf, streamResults, parallelResults
+
+REGIONS = ("chr1", "chr1:50000-60000", "chr2:1-1", "chr2:120,000-120,150", "chr3:199000-", "chr3:1-200000")
+
+
+def overlapping(path, region):
+    '''lines of the file overlapping the region, found by parsing every line'''
+    chromosome, start, end = region
+    lines = []
+    with open(path) as file:
+        for line in file:
+            if line.startswith("@"):
+                continue
+            fields = line.split("\t")
+            span = sum(int(size) for size, op in re.findall(r"(\d+)([MIDNSHP=X])", fields[5]) if op in "MDN=X")
+            if fields[2] == chromosome and int(fields[3]) <= end and int(fields[3]) + max(span, 1) > start:
+                lines.append(line)
+    return lines
+
+
+class RegionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.unsorted = writeSam(os.path.join(cls.directory.name, "unsorted.sam"), long_fraction=0.05)
+        cls.coordinate = writeSam(os.path.join(cls.directory.name, "coordinate.sam"), sort="coordinate", long_fraction=0.05)
+        cls.bgzf = samToBgzf(cls.coordinate, cls.coordinate + ".bgz")
+        cls.header = samreader.parse_header(cls.unsorted)
+        samreader.INDEX_CHECKPOINT, cls.checkpoint = 50, samreader.INDEX_CHECKPOINT #position checkpoints in small files
+        with contextlib.redirect_stdout(io.StringIO()): #index built by the first run with a region
+            for path in (cls.unsorted, cls.coordinate, cls.bgzf):
+                samreader.write_index(path)
+
+    @classmethod
+    def tearDownClass(cls):
+        samreader.INDEX_CHECKPOINT = cls.checkpoint
+        cls.directory.cleanup()
+
+    def reference(self, region, sort):
+        '''results of a file holding only the lines overlapping the region'''
+        with open(self.unsorted) as file:
+            header = [line for line in file if line.startswith("@")]
+        path = os.path.join(self.directory.name, "expected.sam")
+        source = self.unsorted if sort == "unsorted" else self.coordinate
+        with open(path, "w") as file:
+            file.writelines(header + overlapping(source, region))
+        return streamResults(path, sort_order=sort)
+
+    def test_parse_region(self):
+        self.assertEqual(samreader.parseRegion("chr1", self.header), ("chr1", 1, 200000))
+        self.assertEqual(samreader.parseRegion("chr2:1,000-2,000", self.header), ("chr2", 1000, 2000))
+        self.assertEqual(samreader.parseRegion("chr3:5000", self.header), ("chr3", 5000, 200000))
+        for region in ("chr4", "chr1:0-10", "chr1:20-10", "chr1:a-b"):
+            with self.subTest(region=region), self.assertRaises(ValueError):
+                samreader.parseRegion(region, self.header)
+
+    def test_region_counts(self):
+        for text in REGIONS:
+            region = samreader.parseRegion(text, self.header)
+            expected = len(overlapping(self.unsorted, region))
+            counts = streamResults(self.unsorted, region=region)["chrom"][region[0]]
+            with self.subTest(region=text):
+                self.assertEqual(sum(counts), expected)
+
+    def test_region_results(self):
+        for text in REGIONS:
+            region = samreader.parseRegion(text, self.header)
+            for path, sort in ((self.unsorted, "unsorted"), (self.coordinate, "coordinate"), (self.bgzf, "coordinate")):
+                with self.subTest(region=text, file=os.path.basename(path)):
+                    self.assertEqual(streamResults(path, region=region), self.reference(region, sort))
+
+    def test_region_workers(self):
+        region = samreader.parseRegion("chr2:20000-150000", self.header)
+        for path, sort in ((self.coordinate, "coordinate"), (self.bgzf, "coordinate")):
+            with self.subTest(file=os.path.basename(path)):
+                self.assertEqual(parallelResults(path, 3, region=region), self.reference(region, sort))
+
+
+if __name__ == "__main__":
+    unittest.main()
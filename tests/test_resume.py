@@ -0,0 +1,82 @@
+'''--resume: statistics continued from a checkpoint on a file that grew give the results of a single pass over the whole file'''
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from helpers import samreader, writeSam, results, streamResults, WINDOW_SIZE, SHORT_SIZE, LONG_SIZE
+
+
+class ResumeTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.files = {sort: writeSam(os.path.join(cls.directory.name, f"{sort}.sam"), sort=sort) for sort in ("unsorted", "coordinate")}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def resume(self, source, cuts, interval=samreader.CHECKPOINT_SECONDS, **options):
+        '''write the file in parts ending at the fractions cuts (in the middle of a line), read the lines appended after each part
+        with a new Checkpoint loaded from the disk as a new run of --resume would, return the final statistics'''
+        with open(source, "rb") as file:
+            data = file.read()
+        growing = os.path.join(self.directory.name, "growing.sam")
+        checkpoint_path = os.path.join(self.directory.name, "checkpoint.pkl")
+        for path in (growing, checkpoint_path):
+            if os.path.exists(path):
+                os.remove(path)
+        header = samreader.parse_header(source)
+        options.setdefault("sort_order", samreader.sort_order(source))
+
+        def read_range(start, end):
+            return samreader.rangeStats(growing, start, end, header, None, False, WINDOW_SIZE, 0, SHORT_SIZE, LONG_SIZE, None, options)
+
+        written = 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            for cut in list(cuts) + [1]:
+                end = int(len(data) * cut)
+                with open(growing, "ab") as file:
+                    file.write(data[written:end])
+                written = end
+                checkpoint = samreader.Checkpoint(checkpoint_path, growing, {"options": sorted(options)})
+                checkpoint.load()
+                samreader.readAppended(checkpoint, read_range, interval)
+        self.assertEqual(checkpoint.offset, len(data))
+        return checkpoint.stats
+
+    def test_resumed_run(self):
+        for sort, path in self.files.items():
+            reference = streamResults(path)
+            for cuts in ((0.5,), (0.1, 0.35, 0.351, 0.8)):
+                with self.subTest(sort=sort, cuts=cuts):
+                    self.assertEqual(results(self.resume(path, cuts)), reference)
+
+    def test_resumed_run_with_spilling(self):
+        #mates spilled to the disk before the checkpoint are saved with it and paired after the resume
+        for sort, path in self.files.items():
+            reference = streamResults(path)
+            with self.subTest(sort=sort):
+                self.assertEqual(results(self.resume(path, (0.3, 0.6), max_pending=20)), reference)
+
+    def test_checkpoints_while_reading(self):
+        #interval 0: a checkpoint is saved after each segment of the file
+        path = self.files["unsorted"]
+        self.assertEqual(results(self.resume(path, (0.5,), interval=0, qc=True)), streamResults(path, qc=True))
+
+    def test_changed_file(self):
+        path = self.files["unsorted"]
+        self.resume(path, ())
+        checkpoint = samreader.Checkpoint(os.path.join(self.directory.name, "checkpoint.pkl"), os.path.join(self.directory.name, "growing.sam"),
+                                          {"options": ["sort_order"]})
+        with open(checkpoint.input_file, "r+b") as file:
+            file.write(b"@CO")
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertFalse(checkpoint.load())
+
+
+if __name__ == "__main__":
+    unittest.main()
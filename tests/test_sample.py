@@ -0,0 +1,61 @@
+'''--sample: the estimates for the file, lines and distinct templates'''
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from helpers import samreader, writeSam, samToBgzf, SHORT_SIZE, LONG_SIZE
+
+
+class SampleTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = writeSam(os.path.join(cls.directory.name, "reads.sam"), nb_reads=20000)
+        cls.header = samreader.parse_header(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def sample(self, path, nb_reads):
+        return samreader.sampleStats(path, self.header, None, False, 0, SHORT_SIZE, LONG_SIZE, nb_reads, seed=1)
+
+    def test_hyperloglog(self):
+        sketch, other = samreader.HyperLogLog(), samreader.HyperLogLog()
+        for i in range(30000):
+            (sketch if i % 2 else other).add(f"read{i % 20000}")
+        sketch.merge(other)
+        self.assertLess(abs(sketch.count() - 20000), 20000 * 0.03)
+
+    def test_estimated_templates(self):
+        #the mates written next to each other are read in the same run
+        with open(self.path) as file:
+            names = {line.split("\t", 1)[0] for line in file if not line.startswith("@")}
+        stats = self.sample(self.path, 2000)
+        templates, low, high = stats.estimatedTemplates()
+        self.assertLess(sum(stats.run_lines), len(names) / 2)
+        self.assertLess(low, templates)
+        self.assertLess(templates, high)
+        self.assertLess(abs(templates - len(names)), len(names) * 0.15)
+
+    def test_estimated_lines(self):
+        for path in (self.path, samToBgzf(self.path, self.path + ".bgz")):
+            reads, low, high = self.sample(path, 2000).estimatedReads()
+            with self.subTest(file=os.path.basename(path)):
+                self.assertLess(low, high)
+                self.assertLess(abs(reads - 20000), 20000 * 0.15)
+
+    def test_preview_labels(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            samreader.writePreview(self.sample(self.path, 2000), "preview.txt", self.directory.name, 0)
+        with open(os.path.join(self.directory.name, "preview.txt")) as file:
+            lines = [line for line in file if line.startswith("Estimated distinct templates")]
+        self.assertEqual(len(lines), 1)
+        self.assertIn("in the file", lines[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
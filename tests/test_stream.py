@@ -0,0 +1,74 @@
+'''stdin: a SAM stream read once gives the results of the same file, partial summaries are written while reading'''
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from helpers import samreader, writeSam, runMain
+
+
+class StreamTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = writeSam(os.path.join(cls.directory.name, "reads.sam"), long_fraction=0.05)
+        with open(cls.path, "rb") as file:
+            cls.data = file.read()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def summary(self, output):
+        with open(os.path.join(self.directory.name, output, output + ".txt")) as file:
+            return file.read()
+
+    def runStdin(self, output, *options):
+        with mock.patch("sys.stdin", io.TextIOWrapper(io.BytesIO(self.data))):
+            return runMain(self.directory.name, samreader.STDIN, "--output", output, "--snapshot-seconds", "0", *options)
+
+    def test_read_stream(self):
+        header, lines = samreader.read_stream(io.BytesIO(self.data))
+        lines = list(lines)
+        self.assertEqual("".join(header).encode() + b"".join(lines), self.data)
+        self.assertTrue(all(line.startswith("@") for line in header))
+        self.assertFalse(any(line.startswith(b"@") for line in lines))
+
+    def test_same_results_as_file(self):
+        self.runStdin("stream")
+        runMain(self.directory.name, self.path, "--batch", "--output", "file", "--no-pipeline")
+        self.assertEqual(self.summary("stream"), self.summary("file"))
+        for name in ("lengths.txt", "coverage_chr1.png"):
+            self.assertTrue(os.path.exists(os.path.join(self.directory.name, "stream", name)))
+
+    def test_snapshots(self):
+        #the last partial summary holds the first 700 * k reads, the same summary as a file holding only them
+        lines = self.data.decode().splitlines(True)
+        header = [line for line in lines if line.startswith("@")]
+        reads = [line for line in lines if not line.startswith("@")]
+        last = len(reads) // 700 * 700
+
+        printed = self.runStdin("partial", "--snapshot-reads", "700")
+        self.assertEqual(printed.count("Partial summary after"), len(reads) // 700)
+        self.assertIn(f"Partial summary after {last:,} reads", printed)
+
+        with open(os.path.join(self.directory.name, "first.sam"), "w") as file:
+            file.writelines(header + reads[:last])
+        runMain(self.directory.name, os.path.join(self.directory.name, "first.sam"), "--batch", "--output", "first", "--no-pipeline")
+        with open(os.path.join(self.directory.name, "partial", "partial_partial.txt")) as file:
+            self.assertEqual(file.read(), self.summary("first"))
+
+    def test_snapshot_clock(self):
+        #with a period in seconds the partial summary is written when the clock is read, every 1000 reads
+        snapshots = []
+        with mock.patch("time.monotonic", side_effect=range(0, 10**6, 10)): #10 s pass each time the clock is read
+            stats = samreader.SamStats(samreader.parse_header(self.path), 1000, 0, 80, 200)
+            reads = samreader.iter_reads(self.path, None, False)
+            samreader.accumulateSnapshots(reads, stats, lambda stats, nb_reads: snapshots.append(nb_reads), every_seconds=5)
+        self.assertEqual(snapshots, list(range(1000, samreader.nbRecords(stats) + 1, 1000)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+'''--validate: the lines checked in each mode, the malformed lines skipped and the report'''
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from helpers import samreader, writeSam, results, streamStats, streamResults, parallelResults
+
+#(field index, value) making an alignment line malformed
+ERRORS = ((4, "300"), (5, "10Q"), (3, "abc"), (6, "chr 1"), (10, "x y"))
+
+
+class ValidationTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.clean = writeSam(os.path.join(cls.directory.name, "clean.sam"))
+        with open(cls.clean) as file:
+            lines = file.readlines()
+        cls.nb_header = sum(1 for line in lines if line.startswith("@"))
+
+        #one malformed copy of a read after every 500 lines, the line numbers of the copies are kept
+        cls.malformed, lines_out = [], []
+        for index, line in enumerate(lines):
+            lines_out.append(line)
+            if index > cls.nb_header and index % 500 == 0:
+                fields = line.rstrip("\n").split("\t")
+                position, value = ERRORS[len(cls.malformed) % len(ERRORS)]
+                fields[position] = value
+                lines_out.append("\t".join(fields) + "\n")
+                cls.malformed.append(len(lines_out))
+        cls.path = os.path.join(cls.directory.name, "malformed.sam")
+        with open(cls.path, "w") as file:
+            file.writelines(lines_out)
+        cls.nb_lines = len(lines_out)
+        cls.unparsable = [line_index for index, line_index in enumerate(cls.malformed) if ERRORS[index % len(ERRORS)][1] == "abc"] #skipped even if not checked
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def validation(self, mode, **settings):
+        return streamStats(self.path, validation=samreader.Validation(mode, **settings)).validation
+
+    def test_check(self):
+        #the fast path of check (one regular expression for the whole line) agrees with the field by field check
+        with open(self.path) as file:
+            for line_index, line in enumerate(file, start=1):
+                with self.subTest(line=line_index):
+                    self.assertEqual(samreader.check(line, line_index, samreader.Validation()), samreader.checkFields(line) is None)
+                    self.assertEqual(samreader.checkFields(line) is None, line_index not in self.malformed)
+
+    def test_full(self):
+        #every malformed line is skipped, the other reads give the results of the clean file
+        stats = streamStats(self.path, validation=samreader.Validation("full"))
+        self.assertEqual(stats.validation.checked, self.nb_lines)
+        self.assertEqual(stats.validation.nbErrors(), len(self.malformed))
+        self.assertEqual([line_index for line_index, error in stats.validation.messages], self.malformed)
+        self.assertEqual({**results(stats), "validation": 0}, streamResults(self.clean, validation=samreader.Validation("full")))
+
+    def test_head(self):
+        for head_lines in (self.malformed[0] - 1, self.malformed[0], self.malformed[2]):
+            with self.subTest(head_lines=head_lines):
+                validation = self.validation("head", head_lines=head_lines)
+                self.assertEqual(validation.checked, head_lines)
+                checked = [line_index for line_index in self.malformed if line_index <= head_lines]
+                self.assertEqual(validation.nbErrors(), len(checked) + sum(1 for line_index in self.unparsable if line_index > head_lines))
+
+    def test_sample(self):
+        self.assertEqual(self.validation("sample", sample_rate=1).nbErrors(), len(self.malformed))
+        self.assertEqual(self.validation("sample", sample_rate=0).checked, 0)
+        validation = self.validation("sample", sample_rate=0.3)
+        self.assertLess(abs(validation.checked - 0.3 * self.nb_lines), 0.05 * self.nb_lines)
+
+    def test_off(self):
+        #nothing is checked, only the lines that cannot be parsed at all are skipped (POS "abc")
+        validation = self.validation("off")
+        self.assertEqual(validation.checked, 0)
+        self.assertEqual(validation.nbErrors(), len(self.unparsable))
+
+    def test_workers(self):
+        self.assertEqual(parallelResults(self.path, 3, validation=samreader.Validation("full")), streamResults(self.path, validation=samreader.Validation("full")))
+
+    def test_report(self):
+        stats = streamStats(self.path, validation=samreader.Validation("full"))
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats.validation.write(self.directory.name)
+        with open(os.path.join(self.directory.name, "validation.txt")) as file:
+            report = file.read()
+        self.assertIn(f"Checked lines: {self.nb_lines}\nRejected lines: {len(self.malformed)}\n", report)
+        for line_index in self.malformed:
+            self.assertIn(f"line {line_index}: ", report)
+        self.assertIn("MAPQ incorrect.", report)
+
+
+if __name__ == "__main__":
+    unittest.main()
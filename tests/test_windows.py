@@ -0,0 +1,115 @@
+'''WindowAccumulator: bases of each read counted in the windows it covers'''
+import random
+import unittest
+
+from helpers import samreader
+
+HEADER = {"chr1": 10000}
+
+
+def randomIntervals(nb_reads, seed=1):
+    '''(start, end, mapq) of short and long reads, some overhanging the end of the reference'''
+    rng = random.Random(seed)
+    intervals = []
+    for i in range(nb_reads):
+        start = rng.randint(1, HEADER["chr1"])
+        intervals.append((start, start + rng.choice((rng.randint(0, 150), rng.randint(1000, 5000))), rng.choice((0, 0, 20, 40, 60))))
+    return intervals
+
+
+def naiveWindows(intervals, window_size, MAPQ_threshold=0):
+    '''bp covered and MAPQ values per window, base by base'''
+    nb_windows = HEADER["chr1"] // window_size + 1
+    bp, mapqs = [0] * nb_windows, [[] for _ in range(nb_windows)]
+    for start, end, mapq in intervals:
+        end = min(end, HEADER["chr1"])
+        for position in range(start, end + 1):
+            bp[position // window_size] += 1
+        if mapq >= MAPQ_threshold:
+            for window in range(start // window_size, end // window_size + 1):
+                mapqs[window].append(mapq)
+    return bp, mapqs
+
+
+class WindowTest(unittest.TestCase):
+
+    def windows(self, intervals, window_size=1000, MAPQ_threshold=0):
+        windows = samreader.WindowAccumulator(HEADER, window_size, MAPQ_threshold)
+        for start, end, mapq in intervals:
+            windows.addInterval("chr1", start, end, mapq)
+        return windows
+
+    def test_read_in_one_window(self):
+        #[1500, 1600] covers 101 bp, older versions counted it up to the end of the window (500 bp)
+        bp = self.windows([(1500, 1600, 30)]).coverageBp("chr1").tolist()
+        self.assertEqual(bp[1], 101)
+        self.assertEqual(sum(bp), 101)
+
+    def test_read_spanning_windows(self):
+        #first window: (1 + 1) * 1000 - 1900 = 100 bp, full window 2, last window: 3099 - 3 * 1000 + 1 = 100 bp
+        bp = self.windows([(1900, 3099, 30)]).coverageBp("chr1").tolist()
+        self.assertEqual(bp[:5], [0, 100, 1000, 100, 0])
+        self.assertEqual(sum(bp), 3099 - 1900 + 1)
+
+    def test_read_on_window_boundaries(self):
+        #a read ending on the last base of a window and a read starting on the first base of the next one
+        bp = self.windows([(1000, 1999, 30), (2000, 2000, 30), (999, 1000, 30)]).coverageBp("chr1").tolist()
+        self.assertEqual(bp[:3], [1, 1001, 1])
+
+    def test_difference_arrays(self):
+        #the prefix sums of the difference arrays give the same windows as a count base by base
+        intervals = randomIntervals(300)
+        for window_size in (100, 1000, 3000):
+            with self.subTest(window_size=window_size):
+                windows = self.windows(intervals, window_size, MAPQ_threshold=20)
+                bp, mapqs = naiveWindows(intervals, window_size, MAPQ_threshold=20)
+                self.assertEqual(windows.coverageBp("chr1").tolist(), bp)
+                self.assertEqual(windows.chromCoverage("chr1"), [round(b / window_size, 3) for b in bp])
+                self.assertEqual(windows.chromMeanMAPQ("chr1"), [round(sum(m) / len(m), 3) if m else 0.0 for m in mapqs])
+
+    def test_per_base_depth(self):
+        intervals = randomIntervals(300)
+        windows = samreader.WindowAccumulator(HEADER, 1000, 0, per_base=True)
+        depth = [0] * (HEADER["chr1"] + 1)
+        for start, end, mapq in intervals:
+            windows.addInterval("chr1", start, end, mapq)
+            for position in range(start, min(end, HEADER["chr1"]) + 1):
+                depth[position] += 1
+        self.assertEqual(windows.depth("chr1").tolist(), depth)
+
+    def test_merge(self):
+        intervals = randomIntervals(300)
+        merged = self.windows(intervals[:100])
+        merged.merge(self.windows(intervals[100:]))
+        whole = self.windows(intervals)
+        self.assertEqual(merged.coverage(), whole.coverage())
+        self.assertEqual(merged.meanMAPQ(), whole.meanMAPQ())
+
+    def test_mapq_extras(self):
+        #min/max of the segment trees and fraction of MAPQ 0 against the MAPQ of each window, all reads whatever the threshold
+        intervals = randomIntervals(300, seed=2)
+        for window_size in (100, 1000, 7000):
+            windows = samreader.WindowAccumulator(HEADER, window_size, 20, mapq_extras=True)
+            for start, end, mapq in intervals:
+                windows.addInterval("chr1", start, end, mapq)
+            _, mapqs = naiveWindows(intervals, window_size, MAPQ_threshold=20)
+            _, every = naiveWindows(intervals, window_size)
+            with self.subTest(window_size=window_size):
+                self.assertEqual(windows.minMaxMAPQ()["chr1"], ([min(m, default=0) for m in mapqs], [max(m, default=0) for m in mapqs]))
+                self.assertEqual(windows.fractionMAPQ0()["chr1"], [round(m.count(0) / len(m), 3) if m else 0.0 for m in every])
+
+    def test_mapq_extras_merge(self):
+        intervals = randomIntervals(300, seed=3)
+        halves = []
+        for part in (intervals[:150], intervals[150:], intervals):
+            windows = samreader.WindowAccumulator(HEADER, 1000, 0, mapq_extras=True)
+            for start, end, mapq in part:
+                windows.addInterval("chr1", start, end, mapq)
+            halves.append(windows)
+        halves[0].merge(halves[1])
+        self.assertEqual(halves[0].minMaxMAPQ(), halves[2].minMaxMAPQ())
+        self.assertEqual(halves[0].fractionMAPQ0(), halves[2].fractionMAPQ0())
+
+
+if __name__ == "__main__":
+    unittest.main()